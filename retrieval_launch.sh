@@ -1,6 +1,6 @@
 
 file_path=/the/path/you/save/corpus
-index_file=$file_path/e5_Flat.index
+index_file=$file_path/e5_Flat.index # approximate indexes (e.g. e5_IVF4096_PQ64.index) also take --nprobe / --efsearch
 corpus_file=$file_path/wiki-18.jsonl
 retriever=intfloat/e5-base-v2
 
@@ -8,3 +8,20 @@ python search_r1/search/retrieval_server.py --index_path $index_file \
                                             --corpus_path $corpus_file \
                                             --topk 3 \
                                             --retriever_model $retriever
+
+# CPU-only serving: index (or its shards built with index_builder.py --num_shards) memory-mapped and searched by a thread pool
+# python search_r1/search/retrieval_server.py --index_path $index_file \
+#                                             --corpus_path $corpus_file \
+#                                             --topk 3 \
+#                                             --retriever_model $retriever \
+#                                             --faiss_cpu \
+#                                             --cpu_threads 8 \
+#                                             --omp_threads_per_shard 4
+
+# Hybrid BM25 + dense retrieval fused in one server (reciprocal rank fusion by default)
+# python search_r1/search/retrieval_server.py --index_path $index_file \
+#                                             --corpus_path $corpus_file \
+#                                             --topk 3 \
+#                                             --retriever_model $retriever \
+#                                             --bm25_index_path $file_path/bm25 \
+#                                             --fusion rrf
@@ -0,0 +1,96 @@
+"""
+Check logprobs_and_entropy_from_logits_chunked against logprobs_from_logits / entropy_from_logits,
+then compare their time and peak memory for a forward + backward pass.
+
+    python scripts/benchmark_logprobs.py --num_tokens 256 --vocab_size 1000 --device cpu
+    python scripts/benchmark_logprobs.py --num_tokens 8192 --vocab_size 151936 --dtype bfloat16
+"""
+
+import argparse
+import time
+
+import torch
+
+from verl.utils.torch_functional import (entropy_from_logits, logprobs_and_entropy_from_logits_chunked,
+                                         logprobs_from_logits_naive)
+
+
+def reference(logits, labels):
+    return logprobs_from_logits_naive(logits.float(), labels), entropy_from_logits(logits.float())
+
+
+def chunked(chunk_size):
+
+    def fn(logits, labels):
+        return logprobs_and_entropy_from_logits_chunked(logits, labels, chunk_size=chunk_size)
+
+    return fn
+
+
+def forward_backward(fn, logits, labels, grad_log_probs, grad_entropy):
+    logits = logits.detach().requires_grad_(True)
+    log_probs, entropy = fn(logits, labels)
+    torch.autograd.backward([log_probs, entropy], [grad_log_probs, grad_entropy])
+    return log_probs.detach(), entropy.detach(), logits.grad
+
+
+def check_correctness(args, device, dtype):
+    torch.manual_seed(0)
+    logits = torch.randn(args.num_tokens, args.vocab_size, device=device, dtype=dtype) * 3
+    labels = torch.randint(0, args.vocab_size, (args.num_tokens,), device=device)
+    grad_log_probs = torch.randn(args.num_tokens, device=device)
+    grad_entropy = torch.randn(args.num_tokens, device=device)
+
+    ref = forward_backward(reference, logits, labels, grad_log_probs, grad_entropy)
+    atol = 1e-4 if dtype == torch.float32 else 2e-2
+    for chunk_size in args.chunk_sizes:
+        out = forward_backward(chunked(chunk_size), logits, labels, grad_log_probs, grad_entropy)
+        for name, a, b in zip(['log_probs', 'entropy', 'grad'], out, ref):
+            torch.testing.assert_close(a.float(), b.float(), atol=atol, rtol=1e-3,
+                                       msg=f'{name} mismatch, chunk_size={chunk_size}')
+    print(f'chunked results match the reference for chunk sizes {args.chunk_sizes}')
+
+
+def benchmark(name, fn, args, device, dtype):
+    logits = torch.randn(args.num_tokens, args.vocab_size, device=device, dtype=dtype)
+    labels = torch.randint(0, args.vocab_size, (args.num_tokens,), device=device)
+    grad_log_probs = torch.randn(args.num_tokens, device=device)
+    grad_entropy = torch.randn(args.num_tokens, device=device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        forward_backward(fn, logits, labels, grad_log_probs, grad_entropy)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = f'{(torch.cuda.max_memory_allocated() - base_memory) / 1024**2:>14.1f}'
+    else:
+        peak = f'{"-":>14}'
+    elapsed = (time.perf_counter() - start) / args.repeat
+    print(f'{name:<24}{elapsed * 1000:>12.2f}{peak}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Correctness and memory of the chunked log-prob/entropy.')
+    parser.add_argument('--num_tokens', type=int, default=4096)
+    parser.add_argument('--vocab_size', type=int, default=151936)
+    parser.add_argument('--chunk_sizes', type=int, nargs='+', default=[256, 1024])
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'bfloat16'])
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    check_correctness(args, device, dtype)
+
+    print(f'{"implementation":<24}{"time(ms)":>12}{"peak(MB)":>14}')
+    benchmark('reference', reference, args, device, dtype)
+    for chunk_size in args.chunk_sizes:
+        benchmark(f'chunked ({chunk_size})', chunked(chunk_size), args, device, dtype)
+
+
+if __name__ == '__main__':
+    main()
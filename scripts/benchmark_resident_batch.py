@@ -0,0 +1,125 @@
+"""
+Compare the bytes the driver serializes per PPO step when the batch is re-split and sent for every worker call,
+with the resident shards of DataProtoFuture.put, where the workers get object refs and the driver-side deltas only.
+
+Runs on CPU with Ray in local mode, the workers are plain actors mimicking the DP_COMPUTE_PROTO calls of a step.
+
+    python scripts/benchmark_resident_batch.py --batch_size 256 --prompt_length 1024 --response_length 1024
+"""
+
+import argparse
+import time
+
+import numpy as np
+import ray
+import torch
+
+from verl import DataProto
+from verl.protocol import DataProtoFuture
+from verl.single_controller.base.decorator import _split_args_kwargs_data_proto
+
+
+@ray.remote
+class ShardWorker:
+
+    def compute(self, data):
+        """Like compute_ref_log_prob/compute_values: one float per response token"""
+        if isinstance(data, DataProtoFuture):
+            data = data.get()
+        responses = data.batch['responses']
+        return DataProto.from_dict({'out': responses.float() / responses.shape[-1]})
+
+    def update(self, data):
+        """Like update_actor/update_critic: only metrics are returned"""
+        if isinstance(data, DataProtoFuture):
+            data = data.get()
+        checksum = sum(float(data.batch[key].float().sum()) for key in sorted(data.batch.keys()))
+        return DataProto(meta_info={'metrics': {'checksum': checksum, 'keys': sorted(data.batch.keys())}})
+
+
+def serialized_bytes(obj) -> int:
+    return len(ray.cloudpickle.dumps(obj))
+
+
+def make_batch(args) -> DataProto:
+    seq_length = args.prompt_length + args.response_length
+    input_ids = torch.randint(0, 32000, (args.batch_size, seq_length))
+    return DataProto.from_dict(
+        {
+            'input_ids': input_ids,
+            'attention_mask': torch.ones_like(input_ids),
+            'position_ids': torch.arange(seq_length).expand(args.batch_size, -1).contiguous(),
+            'prompts': input_ids[:, :args.prompt_length].contiguous(),
+            'responses': input_ids[:, args.prompt_length:].contiguous(),
+        },
+        non_tensors={'index': np.arange(args.batch_size, dtype=object)},
+        meta_info={'global_token_num': [seq_length] * args.batch_size})
+
+
+def call(workers, method, data):
+    """Dispatch like DP_COMPUTE_PROTO and return (collected output, bytes serialized by the driver)"""
+    (shards,), _ = _split_args_kwargs_data_proto(len(workers), data)
+    num_bytes = sum(serialized_bytes(shard) for shard in shards)
+    outputs = ray.get([getattr(worker, method).remote(shard) for worker, shard in zip(workers, shards)])
+    return outputs, num_bytes
+
+
+def run_step(workers, batch: DataProto, resident: bool):
+    num_bytes = 0
+    worker_batch = batch
+    if resident:
+        worker_batch = DataProtoFuture.put(batch, chunks=len(workers))
+        num_bytes += sum(serialized_bytes(shard) for shard in batch.chunk(len(workers)))
+
+    # ref log-prob and values, then the driver computes the advantages
+    new_keys = {}
+    for key in ['ref_log_prob', 'values']:
+        outputs, call_bytes = call(workers, 'compute', worker_batch)
+        num_bytes += call_bytes
+        new_keys[key] = DataProto.concat(outputs).batch['out']
+    new_keys['advantages'] = new_keys['values'] - new_keys['ref_log_prob']
+    delta = DataProto.from_dict(new_keys)
+
+    # critic and actor updates
+    update_batch = worker_batch.union(delta) if resident else DataProto.from_dict({
+        **batch.batch, **new_keys
+    }, non_tensors=batch.non_tensor_batch, meta_info=batch.meta_info)
+    metrics = []
+    for _ in range(2):
+        outputs, call_bytes = call(workers, 'update', update_batch)
+        num_bytes += call_bytes
+        metrics.append([output.meta_info['metrics'] for output in outputs])
+    return num_bytes, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes sent by the driver with and without resident batch shards.')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--prompt_length', type=int, default=1024)
+    parser.add_argument('--response_length', type=int, default=1024)
+    parser.add_argument('--world_size', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    ray.init(local_mode=True, include_dashboard=False)
+    workers = [ShardWorker.remote() for _ in range(args.world_size)]
+    batch = make_batch(args)
+    print(f'batch: {serialized_bytes(batch) / 1024**2:.1f} MB serialized, {args.world_size} ranks')
+
+    print(f'{"mode":<12}{"driver MB/step":>16}{"time(s)":>10}')
+    results = {}
+    for name, resident in [('re-split', False), ('resident', True)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            num_bytes, metrics = run_step(workers, batch, resident)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        results[name] = metrics
+        print(f'{name:<12}{num_bytes / 1024**2:>16.2f}{elapsed:>10.3f}')
+
+    assert results['re-split'] == results['resident'], 'the workers received different data'
+    print('the updates received the same data in both modes')
+    ray.shutdown()
+
+
+if __name__ == '__main__':
+    main()
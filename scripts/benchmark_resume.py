@@ -0,0 +1,155 @@
+"""
+Time to save and resume a toy FSDP model: rank-0 huggingface export vs sharded checkpoint (model, optimizer,
+lr scheduler), and the cost of skipping the trained batches of an epoch in the sampler vs iterating the dataloader.
+
+    torchrun --nproc_per_node 2 scripts/benchmark_resume.py --hidden_size 512 --num_layers 8
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import torch
+import torch.distributed
+from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType, FullStateDictConfig
+from torch.utils.data import DataLoader, Dataset
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from verl.utils.dataset.rl_dataset import ShuffledBatchSampler
+from verl.utils.fsdp_checkpoint import ShardedCheckpointer
+
+
+class SlowDataset(Dataset):
+    """Samples that take ``load_ms`` to load, like tokenizing a prompt"""
+
+    def __init__(self, num_samples, load_ms):
+        self.num_samples = num_samples
+        self.load_ms = load_ms
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        time.sleep(self.load_ms / 1000)
+        return torch.tensor(index)
+
+
+def build(args, device):
+    config = LlamaConfig(vocab_size=args.vocab_size,
+                         hidden_size=args.hidden_size,
+                         intermediate_size=args.hidden_size * 4,
+                         num_hidden_layers=args.num_layers,
+                         num_attention_heads=max(args.hidden_size // 64, 1))
+    torch.manual_seed(0)
+    model = FSDP(LlamaForCausalLM(config), device_id=device if device.type == 'cuda' else None, use_orig_params=False)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    lr_scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: min(1.0, (step + 1) / 10))
+    return config, model, optimizer, lr_scheduler
+
+
+def train_step(model, optimizer, lr_scheduler, args, device):
+    input_ids = torch.randint(0, args.vocab_size, (2, 64), device=device)
+    model(input_ids=input_ids, labels=input_ids).loss.backward()
+    optimizer.step()
+    lr_scheduler.step()
+    optimizer.zero_grad()
+
+
+def timed(fn):
+    torch.distributed.barrier()
+    start = time.perf_counter()
+    out = fn()
+    torch.distributed.barrier()
+    return time.perf_counter() - start, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time to save and resume a toy FSDP model.')
+    parser.add_argument('--hidden_size', type=int, default=512)
+    parser.add_argument('--num_layers', type=int, default=8)
+    parser.add_argument('--vocab_size', type=int, default=32000)
+    parser.add_argument('--num_samples', type=int, default=2048)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--skip_batches', type=int, default=48)
+    parser.add_argument('--load_ms', type=float, default=1.0)
+    args = parser.parse_args()
+
+    use_cuda = torch.cuda.is_available()
+    torch.distributed.init_process_group(backend='nccl' if use_cuda else 'gloo')
+    rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+    device = torch.device('cuda', int(os.environ.get('LOCAL_RANK', 0))) if use_cuda else torch.device('cpu')
+    if use_cuda:
+        torch.cuda.set_device(device)
+
+    config, model, optimizer, lr_scheduler = build(args, device)
+    train_step(model, optimizer, lr_scheduler, args, device)
+    root = tempfile.mkdtemp() if rank == 0 else None
+    root = [root]
+    torch.distributed.broadcast_object_list(root)
+    root = root[0]
+    results = []
+
+    # rank 0 huggingface export, the model only
+    hf_path = os.path.join(root, 'hf')
+
+    def save_hf():
+        cfg = FullStateDictConfig(offload_to_cpu=True, rank0_only=True)
+        with FSDP.state_dict_type(model, StateDictType.FULL_STATE_DICT, cfg):
+            state_dict = model.state_dict()
+        if rank == 0:
+            model._fsdp_wrapped_module.save_pretrained(hf_path, state_dict=state_dict)
+
+    def load_hf():
+        return FSDP(LlamaForCausalLM.from_pretrained(hf_path), device_id=device if use_cuda else None)
+
+    results.append(('hf save (model only)', timed(save_hf)[0]))
+    results.append(('hf load (model only)', timed(load_hf)[0]))
+
+    # sharded model + optimizer + lr scheduler
+    sharded_path = os.path.join(root, 'sharded')
+    checkpointer = ShardedCheckpointer(rank=rank, world_size=world_size, async_save=True)
+    blocking_time, _ = timed(lambda: checkpointer.save(sharded_path, model, optimizer, lr_scheduler))
+    results.append(('sharded save (blocking)', blocking_time))
+    results.append(('sharded save (written)', blocking_time + timed(checkpointer.wait)[0]))
+
+    _, new_model, new_optimizer, new_lr_scheduler = build(args, device)
+    results.append(('sharded load (all states)',
+                    timed(lambda: checkpointer.load(sharded_path, new_model, new_optimizer, new_lr_scheduler))[0]))
+    for param, new_param in zip(model.parameters(), new_model.parameters()):
+        assert torch.equal(param, new_param), 'the resumed model differs from the saved one'
+    assert new_lr_scheduler.state_dict() == lr_scheduler.state_dict(), 'the resumed lr scheduler differs'
+
+    # resume in the middle of an epoch
+    dataset = SlowDataset(args.num_samples, args.load_ms)
+    sampler = ShuffledBatchSampler(num_samples=args.num_samples, batch_size=args.batch_size, seed=0)
+    dataloader = DataLoader(dataset, batch_sampler=sampler)
+    expected = list(dataloader)[args.skip_batches]
+
+    def iterate_to_batch():
+        iterator = iter(dataloader)
+        for _ in range(args.skip_batches):
+            next(iterator)
+        return next(iterator)
+
+    def skip_in_sampler():
+        sampler.skip_batches = args.skip_batches
+        return next(iter(dataloader))
+
+    for name, fn in [('dataloader iterate', iterate_to_batch), ('sampler skip', skip_in_sampler)]:
+        sampler.set_epoch(0)
+        elapsed, batch = timed(fn)
+        assert torch.equal(batch, expected), f'{name} gave a different batch'
+        results.append((f'{name} ({args.skip_batches} batches)', elapsed))
+
+    if rank == 0:
+        print(f'{"":<36}{"time(s)":>10}')
+        for name, elapsed in results:
+            print(f'{name:<36}{elapsed:>10.3f}')
+        shutil.rmtree(root)
+    torch.distributed.destroy_process_group()
+
+
+if __name__ == '__main__':
+    main()
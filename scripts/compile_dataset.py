@@ -0,0 +1,31 @@
+"""
+Compile RL parquet files into the pre-tokenized cache used by RLHFDataset(compile_cache=True),
+so that training starts without tokenizing any prompt.
+
+python scripts/compile_dataset.py --files data/word_guessing_345_train.parquet data/word_guessing_345_valid.parquet \
+    --model Qwen/Qwen2.5-1.5B-Instruct --max_prompt_length 4096
+"""
+import argparse
+
+from verl.utils import hf_tokenizer
+from verl.utils.dataset.rl_dataset import RLHFDataset
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', nargs='+', required=True)
+    parser.add_argument('--model', required=True, help='model (tokenizer) path used for training')
+    parser.add_argument('--max_prompt_length', type=int, default=512)
+    parser.add_argument('--prompt_key', default='prompt')
+    parser.add_argument('--cache_dir', default='~/.cache/verl/rlhf')
+    args = parser.parse_args()
+
+    tokenizer = hf_tokenizer(args.model)
+    for parquet_file in args.files:
+        # every file is compiled on its own, matching how the trainer loads train_files and val_files
+        dataset = RLHFDataset(parquet_files=parquet_file,
+                              tokenizer=tokenizer,
+                              prompt_key=args.prompt_key,
+                              max_prompt_length=args.max_prompt_length,
+                              cache_dir=args.cache_dir,
+                              compile_cache=True)
+        print(f'{parquet_file}: {len(dataset)} prompts compiled')
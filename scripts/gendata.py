@@ -1,5 +1,7 @@
 import datasets
 
+from verl.utils.dataset.wordle_dataset import build_wordle_prompt
+
 
 def gen_gen(words, split):
     def gen():
@@ -7,28 +9,7 @@ def gen_gen(words, split):
             # 转大写
             word = word.upper()
             word_length = len(word)
-            prompt = f"""
-Let's play Wordle. Your goal is to guess the secret {word_length}-letter word. You can query a word using the following format:
-
-<query>YOURWORD</query>
-
-Where 'YOURWORD' is the {word_length}-letter word you want to guess. The response will immediately follow your query and will be in this format:
-
-<response>RESPONSE</response>
-
-Where 'RESPONSE' describes the result of your guess using a natural-language style explanation for each letter.
-
-For example, if the secret word is "SHAPE" and you query "CRANE", the query would be:
-
-<query>CRANE</query>
-
-the response would be:
-
-<response>The first letter, C, is not in the word. The second letter, R, is in the word but in the wrong position. The third letter, A, is in the word but in the wrong position. The fourth letter, N, is not in the word. The fifth letter, E, is in the correct position.</response>
-
-You should make your queries one at a time, and only query one word at a time. It should only contains the word itself, no other text.
-Your objective is to guess the secret word in as few queries as possible.
-    """
+            prompt = build_wordle_prompt(word_length)
             print(prompt)
             data = {
                     "data_source": "gen",
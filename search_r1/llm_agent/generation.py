@@ -2,6 +2,7 @@ import torch
 import re
 from collections import defaultdict
 import os
+import time
 from typing import List, Dict, Any, Tuple
 from dataclasses import dataclass
 from .tensor_helper import TensorHelper, TensorConfig
@@ -12,6 +13,7 @@ from .tensor_helper import TensorHelper, TensorConfig
 # )
 from verl import DataProto
 from verl.utils.tracking import Tracking
+from verl.utils.debug.profiler import DriverProfiler
 import shutil
 import requests
 
@@ -27,6 +29,7 @@ class GenerationConfig:
     no_think_rl: bool=False
     search_url: str = None
     topk: int = 3
+    search_protocol: str = 'json' # 'json' or 'msgpack'
 
 class LLMGenerationManager:
     def __init__(
@@ -36,12 +39,22 @@ class LLMGenerationManager:
         config: GenerationConfig,
         # logger: Tracking,
         is_validation: bool = False,
+        record_turns: bool = False,
+        profiler: DriverProfiler = None,
     ):
         self.tokenizer = tokenizer
         self.actor_rollout_wg = actor_rollout_wg
         self.config = config
         # self.logger = logger
         self.is_validation = is_validation
+        # if set, run_llm_loop keeps the text of every turn in self.turn_history
+        self.record_turns = record_turns
+        self.turn_history = []
+        # spans of every turn and its phases, a disabled profiler records nothing
+        self.profiler = profiler if profiler is not None else DriverProfiler(enable=False)
+        # keep-alive connections reused across turns instead of one connection per requests.post
+        self.search_session = requests.Session()
+        self.search_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
 
         self.tensor_fn = TensorHelper(TensorConfig(
             pad_token_id=tokenizer.pad_token_id,
@@ -200,52 +213,126 @@ class LLMGenerationManager:
         rollings = gen_batch
 
         ground_truth = [gen_batch[i].non_tensor_batch['reward_model']['ground_truth']['target'] for i in range(len(gen_batch))]
+        self.turn_history = []
+        turn_stats = []
 
         # Main generation loop
         for step in range(self.config.max_turns):
             if not active_mask.sum():
                 break
-            rollings.batch = self.tensor_fn.cut_to_effective_len(
-                rollings.batch,
-                keys=['input_ids', 'attention_mask', 'position_ids']
-            )
-            # gen_output = self.actor_rollout_wg.generate_sequences(rollings)
-            rollings_active = DataProto.from_dict({
-                k: v[active_mask] for k, v in rollings.batch.items() # mask是bool
-            })            
-            gen_output = self._generate_with_gpu_padding(rollings_active)
-
-            meta_info = gen_output.meta_info
-            responses_ids, responses_str = self._postprocess_responses(gen_output.batch['responses'])
-            responses_ids, responses_str = self.tensor_fn._example_level_pad(responses_ids, responses_str, active_mask) # 恢复成之前的格式
-            # Execute in environment and process observations
-            # shape?
-            next_obs, dones = self.execute_predictions(
-                responses_str, ground_truth, self.tokenizer.pad_token, active_mask
-            )
+            with self.profiler.span('turn', turn=step, active=int(active_mask.sum())):
+                with self.profiler.span('generate'):
+                    rollings.batch = self.tensor_fn.cut_to_effective_len(
+                        rollings.batch,
+                        keys=['input_ids', 'attention_mask', 'position_ids']
+                    )
+                    # gen_output = self.actor_rollout_wg.generate_sequences(rollings)
+                    rollings_active = DataProto.from_dict({
+                        k: v[active_mask] for k, v in rollings.batch.items() # mask是bool
+                    })            
+                    gen_start = time.perf_counter()
+                    gen_output = self._generate_with_gpu_padding(rollings_active)
+                    gen_time = time.perf_counter() - gen_start
+
+                meta_info = gen_output.meta_info
+                with self.profiler.span('decode'):
+                    responses_ids, responses_str = self._postprocess_responses(gen_output.batch['responses'])
+                    responses_ids, responses_str = self.tensor_fn._example_level_pad(responses_ids, responses_str, active_mask) # 恢复成之前的格式
+                # Execute in environment and process observations
+                # shape?
+                with self.profiler.span('env_step'):
+                    next_obs, dones, valid_action = self.execute_predictions(
+                        responses_str, ground_truth, self.tokenizer.pad_token, active_mask
+                    )
+                turn_stats.append(self._turn_stats(rollings_active, gen_output, gen_time, active_mask, dones, valid_action))
+                if self.record_turns:
+                    self.turn_history.append({
+                        'active': active_mask.tolist(),
+                        'responses': responses_str,
+                        'observations': next_obs,
+                    })
 
             
-            curr_active_mask = torch.tensor([not done for done in dones], dtype=torch.bool)
-            active_mask = active_mask * curr_active_mask
-            active_num_list.append(active_mask.sum().item())
+                curr_active_mask = torch.tensor([not done for done in dones], dtype=torch.bool)
+                active_mask = active_mask * curr_active_mask
+                active_num_list.append(active_mask.sum().item())
 
-            next_obs_ids = self._process_next_obs(next_obs)
+                with self.profiler.span('tokenize'):
+                    next_obs_ids = self._process_next_obs(next_obs)
             
-            # Update states
-            rollings = self._update_rolling_state(
-                rollings,
-                responses_ids,
-                next_obs_ids
-            )
-            original_right_side = self._update_right_side(
-                original_right_side,
-                responses_ids,
-                next_obs_ids
-            )
+                # Update states
+                with self.profiler.span('state_update'):
+                    rollings = self._update_rolling_state(
+                        rollings,
+                        responses_ids,
+                        next_obs_ids
+                    )
+                    original_right_side = self._update_right_side(
+                        original_right_side,
+                        responses_ids,
+                        next_obs_ids
+                    )
         
         print("ACTIVE_TRAJ_NUM:", active_num_list)
         
-        return self._compose_final_output(original_left_side, original_right_side, meta_info)
+        with self.profiler.span('compose'):
+            final_output = self._compose_final_output(original_left_side, original_right_side, meta_info)
+        final_output.meta_info['metrics'] = self._rollout_metrics(turn_stats, num_trajectories=len(active_mask))
+        return final_output
+
+    def _turn_stats(self, active_batch: DataProto, gen_output: DataProto, gen_time: float,
+                    active_mask: torch.Tensor, dones: List[int], valid_action: List[int]) -> Dict:
+        """Token counts and outcomes of one turn, ``active_mask`` being the trajectories active during the turn."""
+        attention_mask = active_batch.batch['attention_mask']
+        num_active = attention_mask.shape[0]
+        num_gpus = self.config.num_gpus
+        # sequences added by _generate_with_gpu_padding so that every GPU gets the same number
+        padding_sequences = (num_gpus - num_active % num_gpus) % num_gpus if num_gpus > 1 else 0
+        responses = gen_output.batch['responses']
+        active = active_mask.tolist()
+        return {
+            'active': num_active,
+            'prefill_tokens': int(attention_mask.sum()),
+            'left_padding_tokens': int(attention_mask.numel() - attention_mask.sum()),
+            'gpu_padding_tokens': padding_sequences * (attention_mask.shape[1] + responses.shape[1]),
+            'generated_tokens': int((responses != self.tokenizer.pad_token_id).sum()),
+            'gen_time': gen_time,
+            'invalid_actions': sum(1 for a, valid in zip(active, valid_action) if a and not valid),
+            # a trajectory active during the turn is only done when it guessed the word
+            'solved': sum(1 for a, done in zip(active, dones) if a and done),
+        }
+
+    def _rollout_metrics(self, turn_stats: List[Dict], num_trajectories: int) -> Dict[str, float]:
+        """Per turn and aggregated rollout metrics, logged as rollout/*"""
+        metrics = {}
+        for turn, stats in enumerate(turn_stats):
+            prefix = f'rollout/turn_{turn}'
+            metrics[f'{prefix}/active_fraction'] = stats['active'] / num_trajectories
+            metrics[f'{prefix}/prefill_tokens'] = stats['prefill_tokens']
+            metrics[f'{prefix}/generated_tokens'] = stats['generated_tokens']
+            metrics[f'{prefix}/left_padding_tokens'] = stats['left_padding_tokens']
+            metrics[f'{prefix}/gpu_padding_tokens'] = stats['gpu_padding_tokens']
+            metrics[f'{prefix}/invalid_action_rate'] = stats['invalid_actions'] / stats['active']
+            metrics[f'{prefix}/solve_rate'] = stats['solved'] / stats['active']
+
+        if not turn_stats:
+            return metrics
+        totals = {key: sum(stats[key] for stats in turn_stats) for key in turn_stats[0]}
+        real_tokens = totals['prefill_tokens'] + totals['generated_tokens']
+        padding_tokens = totals['left_padding_tokens'] + totals['gpu_padding_tokens']
+        metrics.update({
+            'rollout/num_turns': len(turn_stats),
+            'rollout/prefill_tokens': totals['prefill_tokens'],
+            'rollout/generated_tokens': totals['generated_tokens'],
+            'rollout/padding_fraction': padding_tokens / max(real_tokens + padding_tokens, 1),
+            'rollout/invalid_action_rate': totals['invalid_actions'] / totals['active'],
+            'rollout/solve_rate': totals['solved'] / num_trajectories,
+            # a generate call does both, the rates split its wall time by token kind
+            'rollout/prefill_tokens_per_s': totals['prefill_tokens'] / max(totals['gen_time'], 1e-6),
+            'rollout/decode_tokens_per_s': totals['generated_tokens'] / max(totals['gen_time'], 1e-6),
+            'rollout/gen_time_s': totals['gen_time'],
+        })
+        return metrics
 
     def _compose_final_output(self, left_side: Dict,
                             right_side: Dict,
@@ -287,10 +374,10 @@ class LLMGenerationManager:
             pad_token: Token to use for padding
             
         Returns:
-            List of observation strings
+            List of observation strings, done flags and valid action flags
         """
         cur_actions, contents = self.postprocess_predictions(predictions)
-        next_obs, dones = [], []
+        next_obs, dones, valid_action = [], [], []
         
 
         for i, (action, active, content) in enumerate(zip(cur_actions, active_mask, contents)):
@@ -298,14 +385,18 @@ class LLMGenerationManager:
             if not active:
                 next_obs.append('')
                 dones.append(1)
+                valid_action.append(0)
             else:
                 if action != 'query':
                     next_obs.append(f'\n<response>Your previous action is invalid. Your query *must* adhere strictly to the following format: <query>WORD</query>, where WORD is a {len(gt)}-letter word. Please try again.</response>\n')
                     dones.append(0)
+                    valid_action.append(0)
                 elif len(content) != len(gt):
                     next_obs.append(f'\n<response>Your query is {len(content)} letters long, but the target word is {len(gt)} letters long. Please provide a {len(gt)}-letter word.</response>\n')
                     dones.append(0)
+                    valid_action.append(0)
                 else:
+                    valid_action.append(1)
                     if content != gt:
                         next_obs.append(f'\n<response>{gen_res(content, gt)}</response>\n')
                         dones.append(0)
@@ -314,7 +405,7 @@ class LLMGenerationManager:
                         dones.append(1)
             
             
-        return next_obs, dones
+        return next_obs, dones, valid_action
 
     def postprocess_predictions(self, predictions: List[Any]) -> Tuple[List[int], List[bool]]:
         """
@@ -355,6 +446,10 @@ class LLMGenerationManager:
         Returns:
             search results which is concatenated into a string
         """
+        if self.config.search_protocol == 'msgpack':
+            # the server returns the passages already formatted by _passages2string
+            return self._batch_search(queries)['passages']
+
         results = self._batch_search(queries)['result']
         
         return [self._passages2string(result) for result in results]
@@ -366,8 +461,15 @@ class LLMGenerationManager:
             "topk": self.config.topk,
             "return_scores": True
         }
-        
-        return requests.post(self.config.search_url, json=payload).json()
+
+        if self.config.search_protocol == 'msgpack':
+            import msgpack
+            response = self.search_session.post(self.config.search_url, json=payload,
+                                                headers={'Accept': 'application/msgpack'})
+            response.raise_for_status()
+            return msgpack.unpackb(response.content, raw=False)
+
+        return self.search_session.post(self.config.search_url, json=payload).json()
 
     def _passages2string(self, retrieval_result):
         format_reference = ''
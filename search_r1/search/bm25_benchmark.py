@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+from retrieval import BM25Retriever
+
+
+def build_bm25_index(corpus_path: str, index_dir: str, threads: int = 1):
+    r"""Build a pyserini index that stores the raw documents, as expected by BM25Retriever."""
+    input_dir = tempfile.mkdtemp()
+    shutil.copyfile(corpus_path, os.path.join(input_dir, "corpus.jsonl"))
+    subprocess.run(["python", "-m", "pyserini.index.lucene",
+                    "--collection", "JsonCollection",
+                    "--input", input_dir,
+                    "--index", index_dir,
+                    "--generator", "DefaultLuceneDocumentGenerator",
+                    "--threads", str(threads),
+                    "--storeRaw"], check=True)
+    shutil.rmtree(input_dir)
+
+
+def make_queries(corpus_path: str, num_queries: int):
+    r"""Use document titles and leading words as queries, cycled up to ``num_queries``."""
+    base_queries = []
+    with open(corpus_path, "r") as f:
+        for line in f:
+            content = json.loads(line)['contents']
+            title, text = content.split("\n")[0].strip("\""), " ".join(content.split("\n")[1:])
+            base_queries.append(title)
+            base_queries.append(" ".join(text.split()[:8]))
+    return [base_queries[i % len(base_queries)] for i in range(num_queries)]
+
+
+def time_it(fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - start) / repeat, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial and batched BM25 search.")
+    parser.add_argument('--corpus_path', type=str, default='example/corpus.jsonl')
+    parser.add_argument('--index_path', type=str, default=None, help="Existing pyserini index, built from corpus_path if not given.")
+    parser.add_argument('--num_queries', type=int, default=512)
+    parser.add_argument('--topk', type=int, default=3)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    index_path = args.index_path
+    if index_path is None:
+        index_path = tempfile.mkdtemp()
+        build_bm25_index(args.corpus_path, index_path)
+
+    config = SimpleNamespace(retrieval_method='bm25', retrieval_topk=args.topk, index_path=index_path,
+                             corpus_path=args.corpus_path, bm25_threads=1, bm25_doc_cache_size=100000)
+    retriever = BM25Retriever(config)
+    queries = make_queries(args.corpus_path, args.num_queries)
+
+    def serial_search():
+        # the loop BM25Retriever._batch_search used before: one search per query and one parse per hit, bypassing
+        # the document cache (_load_doc instead of _get_doc)
+        out = []
+        for query in queries:
+            hits = retriever.searcher.search(query, args.topk)[:args.topk]
+            out.append(([retriever._load_doc(hit.docid) for hit in hits], [hit.score for hit in hits]))
+        return out
+
+    serial_time, serial_out = time_it(serial_search, args.repeat)
+    serial_docs = [[doc['contents'] for doc in docs] for docs, _ in serial_out]
+    print(f"{'mode':<24}{'threads':>8}{'time(s)':>10}{'QPS':>10}{'speedup':>10}")
+    print(f"{'serial':<24}{1:>8}{serial_time:>10.4f}{len(queries) / serial_time:>10.1f}{1.0:>10.2f}")
+
+    for threads in args.threads:
+        retriever.max_process_num = threads
+
+        def batch_search(cold=True):
+            if cold:
+                retriever._get_doc.cache_clear()
+            return retriever._batch_search(queries, args.topk, True)
+
+        for mode, cold in [('batch (cold cache)', True), ('batch (warm cache)', False)]:
+            batch_time, (results, _) = time_it(lambda: batch_search(cold), args.repeat)
+            assert [[doc['contents'] for doc in docs] for docs in results] == serial_docs, \
+                "batched search returned different documents"
+            print(f"{mode:<24}{threads:>8}{batch_time:>10.4f}{len(queries) / batch_time:>10.1f}"
+                  f"{serial_time / batch_time:>10.2f}")
+
+    if args.index_path is None:
+        shutil.rmtree(index_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ corpus_file=/your/corpus/jsonl/file # jsonl
 save_dir=/the/path/to/save/index
 retriever_name=e5 # this is for indexing naming
 retriever_model=intfloat/e5-base-v2
+faiss_type=Flat # or HNSW32, IVF4096,PQ64, OPQ64,IVF4096,PQ64 for faster CPU serving
 
 CUDA_VISIBLE_DEVICES=0,1,2,3,4,5,6,7 python index_builder.py \
     --retrieval_method $retriever_name \
@@ -13,5 +14,14 @@ CUDA_VISIBLE_DEVICES=0,1,2,3,4,5,6,7 python index_builder.py \
     --max_length 256 \
     --batch_size 512 \
     --pooling_method mean \
-    --faiss_type Flat \
+    --faiss_type $faiss_type \
+    --train_sample_size 1000000 \
     --save_embedding
+
+# compare approximate indexes with the Flat index (recall@k, QPS, size), reusing the saved embeddings
+# python index_benchmark.py \
+#     --flat_index_path $save_dir/${retriever_name}_Flat.index \
+#     --index_paths $save_dir/${retriever_name}_HNSW32.index $save_dir/${retriever_name}_IVF4096_PQ64.index \
+#     --embedding_path $save_dir/emb_${retriever_name}.memmap \
+#     --num_queries 1000 \
+#     --topk 3
@@ -0,0 +1,102 @@
+import os
+import time
+import argparse
+import itertools
+
+import faiss
+import numpy as np
+
+from index_builder import set_search_params
+
+
+def load_embeddings(embedding_path: str, hidden_size: int):
+    all_embeddings = np.memmap(embedding_path, mode="r", dtype=np.float32)
+    return all_embeddings.reshape(-1, hidden_size)
+
+
+def sample_queries(all_embeddings, num_queries: int, seed: int = 0):
+    r"""Sample corpus vectors as pseudo queries when no real query embeddings are given."""
+    rng = np.random.default_rng(seed)
+    idxs = np.sort(rng.choice(all_embeddings.shape[0], size=num_queries, replace=False))
+    return np.ascontiguousarray(all_embeddings[idxs], dtype=np.float32)
+
+
+def recall_at_k(approx_idxs: np.ndarray, exact_idxs: np.ndarray) -> float:
+    r"""Fraction of the exact top-k neighbours that the approximate index also returns."""
+    k = exact_idxs.shape[1]
+    hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx_idxs, exact_idxs))
+    return hits / (k * exact_idxs.shape[0])
+
+
+def timed_search(index, queries: np.ndarray, k: int, batch_size: int):
+    start = time.perf_counter()
+    all_idxs = []
+    for start_idx in range(0, len(queries), batch_size):
+        _, idxs = index.search(queries[start_idx:start_idx + batch_size], k)
+        all_idxs.append(idxs)
+    elapsed = time.perf_counter() - start
+    return np.concatenate(all_idxs, axis=0), len(queries) / elapsed
+
+
+def search_param_grid(index, nprobe_list, efsearch_list):
+    r"""Yield the (nprobe, efSearch) settings that apply to ``index``."""
+    space = faiss.ParameterSpace()
+    space.initialize(index)
+    param_names = {space.parameter_ranges.at(i).name for i in range(space.parameter_ranges.size())}
+    is_ivf = 'nprobe' in param_names
+    is_hnsw = 'efSearch' in param_names
+    nprobes = nprobe_list if is_ivf else [None]
+    efsearches = efsearch_list if is_hnsw else [None]
+    return itertools.product(nprobes, efsearches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark approximate faiss indexes against the Flat index.")
+    parser.add_argument('--flat_index_path', type=str, required=True, help="Exact index used as ground truth.")
+    parser.add_argument('--index_paths', type=str, nargs='+', required=True, help="Candidate indexes to benchmark.")
+    parser.add_argument('--embedding_path', type=str, default=None, help="Corpus embedding memmap to sample queries from.")
+    parser.add_argument('--query_embedding_path', type=str, default=None, help="Query embedding memmap.")
+    parser.add_argument('--hidden_size', type=int, default=768)
+    parser.add_argument('--num_queries', type=int, default=1000)
+    parser.add_argument('--topk', type=int, default=3)
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--efsearch', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--omp_threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.omp_threads is not None:
+        faiss.omp_set_num_threads(args.omp_threads)
+
+    if args.query_embedding_path is not None:
+        queries = np.ascontiguousarray(load_embeddings(args.query_embedding_path, args.hidden_size)[:args.num_queries])
+    elif args.embedding_path is not None:
+        queries = sample_queries(load_embeddings(args.embedding_path, args.hidden_size), args.num_queries, args.seed)
+    else:
+        raise ValueError("Either --query_embedding_path or --embedding_path must be given.")
+
+    flat_index = faiss.read_index(args.flat_index_path)
+    exact_idxs, flat_qps = timed_search(flat_index, queries, args.topk, args.batch_size)
+    flat_size = os.path.getsize(args.flat_index_path) / 1024**2
+    del flat_index
+
+    header = f"{'index':<40}{'nprobe':>8}{'efSearch':>10}{f'recall@{args.topk}':>12}{'QPS':>12}{'size(MB)':>12}"
+    print(header)
+    print("-" * len(header))
+    print(f"{os.path.basename(args.flat_index_path):<40}{'-':>8}{'-':>10}{1.0:>12.4f}{flat_qps:>12.1f}{flat_size:>12.1f}")
+
+    for index_path in args.index_paths:
+        index = faiss.read_index(index_path)
+        index_size = os.path.getsize(index_path) / 1024**2
+        for nprobe, efsearch in search_param_grid(index, args.nprobe, args.efsearch):
+            set_search_params(index, nprobe=nprobe, ef_search=efsearch)
+            approx_idxs, qps = timed_search(index, queries, args.topk, args.batch_size)
+            recall = recall_at_k(approx_idxs, exact_idxs)
+            print(f"{os.path.basename(index_path):<40}{str(nprobe or '-'):>8}{str(efsearch or '-'):>10}"
+                  f"{recall:>12.4f}{qps:>12.1f}{index_size:>12.1f}")
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ from tqdm import tqdm
 import datasets
 from transformers import AutoTokenizer, AutoModel, AutoConfig
 
+from sharded_index import shard_index_path
+
 
 def load_model(
         model_path: str, 
@@ -46,6 +48,41 @@ def pooling(
         raise NotImplementedError("Pooling method not implemented!")
 
 
+def index_file_name(retrieval_method: str, faiss_type: str) -> str:
+    r"""File name of a dense index, e.g. ``e5_Flat.index`` or ``e5_IVF4096_PQ64.index``."""
+    return f"{retrieval_method}_{faiss_type.replace(',', '_')}.index"
+
+
+def select_training_samples(all_embeddings, train_sample_size: int = None, seed: int = 0):
+    r"""Pick the vectors used to train quantizers (IVF centroids, PQ/OPQ codebooks).
+
+    A sorted random subset is taken so that a memmap only pages in the selected rows.
+    """
+    corpus_size = all_embeddings.shape[0]
+    if train_sample_size is None or train_sample_size >= corpus_size:
+        return np.ascontiguousarray(all_embeddings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    sample_idxs = np.sort(rng.choice(corpus_size, size=train_sample_size, replace=False))
+    return np.ascontiguousarray(all_embeddings[sample_idxs], dtype=np.float32)
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    r"""Set query-time knobs of IVF (``nprobe``) and HNSW (``efSearch``) indexes.
+
+    Knobs that do not apply to the loaded index (e.g. ``nprobe`` on a Flat index) are ignored with a warning.
+    """
+    params = {'nprobe': nprobe, 'efSearch': ef_search}
+    # GpuParameterSpace falls back to the CPU implementation for CPU indexes
+    space = faiss.GpuParameterSpace() if hasattr(faiss, 'GpuParameterSpace') else faiss.ParameterSpace()
+    for name, value in params.items():
+        if value is None:
+            continue
+        try:
+            space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            warnings.warn(f"{name} is not supported by index {type(index).__name__}, ignored.", UserWarning)
+
+
 def load_corpus(corpus_path: str):
     corpus = datasets.load_dataset(
             'json', 
@@ -72,7 +109,10 @@ class Index_Builder:
             faiss_type=None,
             embedding_path=None,
             save_embedding=False,
-            faiss_gpu=False
+            faiss_gpu=False,
+            train_sample_size=None,
+            seed=0,
+            num_shards=1
         ):
         
         self.retrieval_method = retrieval_method.lower()
@@ -87,6 +127,9 @@ class Index_Builder:
         self.embedding_path = embedding_path
         self.save_embedding = save_embedding
         self.faiss_gpu = faiss_gpu
+        self.train_sample_size = train_sample_size
+        self.seed = seed
+        self.num_shards = num_shards
 
         self.gpu_num = torch.cuda.device_count()
         # prepare save dir
@@ -97,7 +140,7 @@ class Index_Builder:
             if not self._check_dir(self.save_dir):
                 warnings.warn("Some files already exists in save dir and may be overwritten.", UserWarning)
 
-        self.index_save_path = os.path.join(self.save_dir, f"{self.retrieval_method}_{self.faiss_type}.index")
+        self.index_save_path = os.path.join(self.save_dir, index_file_name(self.retrieval_method, self.faiss_type))
 
         self.embedding_save_path = os.path.join(self.save_dir, f"emb_{self.retrieval_method}.memmap")
 
@@ -266,24 +309,52 @@ class Index_Builder:
         print("Creating index")
         dim = all_embeddings.shape[-1]
         faiss_index = faiss.index_factory(dim, self.faiss_type, faiss.METRIC_INNER_PRODUCT)
-        
-        if self.faiss_gpu:
-            co = faiss.GpuMultipleClonerOptions()
-            co.useFloat16 = True
-            co.shard = True
-            faiss_index = faiss.index_cpu_to_all_gpus(faiss_index, co)
-            if not faiss_index.is_trained:
-                faiss_index.train(all_embeddings)
-            faiss_index.add(all_embeddings)
-            faiss_index = faiss.index_gpu_to_cpu(faiss_index)
-        else:
-            if not faiss_index.is_trained:
-                faiss_index.train(all_embeddings)
-            faiss_index.add(all_embeddings)
 
-        faiss.write_index(faiss_index, self.index_save_path)
+        if self.faiss_gpu and "HNSW" in self.faiss_type:
+            warnings.warn("HNSW indexes cannot be built on GPU, falling back to CPU.", UserWarning)
+            self.faiss_gpu = False
+
+        if not faiss_index.is_trained:
+            train_embeddings = select_training_samples(all_embeddings, self.train_sample_size, self.seed)
+            print(f"Training index on {train_embeddings.shape[0]} samples")
+            faiss_index = self._train_index(faiss_index, train_embeddings)
+            del train_embeddings
+
+        if self.num_shards <= 1:
+            faiss_index = self._add_to_index(faiss_index, all_embeddings)
+            faiss.write_index(faiss_index, self.index_save_path)
+        else:
+            # contiguous shards sharing the trained quantizer, searched in parallel by ShardedIndex
+            shard_size = (len(all_embeddings) + self.num_shards - 1) // self.num_shards
+            for shard_id in range(self.num_shards):
+                shard_embeddings = all_embeddings[shard_id * shard_size: (shard_id + 1) * shard_size]
+                shard_index = self._add_to_index(faiss.clone_index(faiss_index), shard_embeddings)
+                faiss.write_index(shard_index, shard_index_path(self.index_save_path, shard_id))
+                del shard_index
         print("Finish!")
 
+    def _to_gpu(self, faiss_index):
+        co = faiss.GpuMultipleClonerOptions()
+        co.useFloat16 = True
+        co.shard = True
+        return faiss.index_cpu_to_all_gpus(faiss_index, co)
+
+    def _train_index(self, faiss_index, train_embeddings):
+        if self.faiss_gpu:
+            faiss_index = self._to_gpu(faiss_index)
+            faiss_index.train(train_embeddings)
+            return faiss.index_gpu_to_cpu(faiss_index)
+        faiss_index.train(train_embeddings)
+        return faiss_index
+
+    def _add_to_index(self, faiss_index, embeddings):
+        if self.faiss_gpu:
+            faiss_index = self._to_gpu(faiss_index)
+            faiss_index.add(embeddings)
+            return faiss.index_gpu_to_cpu(faiss_index)
+        faiss_index.add(embeddings)
+        return faiss_index
+
 
 MODEL2POOLING = {
     "e5": "mean",
@@ -307,7 +378,13 @@ def main():
     parser.add_argument('--batch_size', type=int, default=512)
     parser.add_argument('--use_fp16', default=False, action='store_true')
     parser.add_argument('--pooling_method', type=str, default=None)
-    parser.add_argument('--faiss_type',default=None,type=str)
+    parser.add_argument('--faiss_type', default=None, type=str,
+                        help="faiss index factory string, e.g. Flat, HNSW32, IVF4096,PQ64 or OPQ64,IVF4096,PQ64")
+    parser.add_argument('--train_sample_size', default=1000000, type=int,
+                        help="number of embeddings sampled to train IVF/PQ/OPQ quantizers, -1 for all")
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--num_shards', default=1, type=int,
+                        help="split the dense index into shards that are searched in parallel on CPU")
     parser.add_argument('--embedding_path', default=None, type=str)
     parser.add_argument('--save_embedding', action='store_true', default=False)
     parser.add_argument('--faiss_gpu', default=False, action='store_true')
@@ -339,7 +416,10 @@ def main():
                         faiss_type = args.faiss_type,
                         embedding_path = args.embedding_path,
                         save_embedding = args.save_embedding,
-                        faiss_gpu = args.faiss_gpu
+                        faiss_gpu = args.faiss_gpu,
+                        train_sample_size = args.train_sample_size if args.train_sample_size > 0 else None,
+                        seed = args.seed,
+                        num_shards = args.num_shards
                     )
     index_builder.build_index()
 
@@ -172,52 +172,58 @@ class BM25Retriever(BaseRetriever):
         self.contain_doc = self._check_contain_doc()
         if not self.contain_doc:
             self.corpus = load_corpus(self.corpus_path)
-        self.max_process_num = 8
-        
+        self.max_process_num = config.bm25_threads
+        # parsed documents keyed by docid, popular documents are hit by many queries
+        self._get_doc = functools.lru_cache(maxsize=config.bm25_doc_cache_size)(self._load_doc)
+
     def _check_contain_doc(self):
         r"""Check if the index contains document content
         """
         return self.searcher.doc(0).raw() is not None
 
-    def _search(self, query: str, num: int = None, return_score = False) -> List[Dict[str, str]]:
-        if num is None:
-            num = self.topk
-        
-        hits = self.searcher.search(query, num)
-        if len(hits) < 1:
-            if return_score:
-                return [],[]
-            else:
-                return []
-            
-        scores = [hit.score for hit in hits]
+    def _load_doc(self, docid: str) -> Dict[str, str]:
+        if not self.contain_doc:
+            return self.corpus[int(docid)]
+        content = json.loads(self.searcher.doc(docid).raw())['contents']
+        return {
+            'id': docid,
+            'title': content.split("\n")[0].strip("\""),
+            'text': "\n".join(content.split("\n")[1:]),
+            'contents': content
+        }
+
+    def _hits_to_results(self, hits, num: int):
         if len(hits) < num:
             warnings.warn('Not enough documents retrieved!')
         else:
             hits = hits[:num]
+        return [self._get_doc(hit.docid) for hit in hits], [hit.score for hit in hits]
 
-        if self.contain_doc:
-            all_contents = [json.loads(self.searcher.doc(hit.docid).raw())['contents'] for hit in hits]
-            results = [{'title': content.split("\n")[0].strip("\""), 
-                        'text': "\n".join(content.split("\n")[1:]),
-                        'contents': content} for content in all_contents]
-        else:
-            results = load_docs(self.corpus, [hit.docid for hit in hits])
-
+    def _search(self, query: str, num: int = None, return_score: bool = False):
+        if num is None:
+            num = self.topk
+        hits = self.searcher.search(query, num)
+        results, scores = self._hits_to_results(hits, num) if len(hits) > 0 else ([], [])
         if return_score:
             return results, scores
         else:
             return results
 
-    def _batch_search(self, query_list, num: int = None, return_score = False):
-        # TODO: modify batch method
+    def _batch_search(self, query_list: List[str], num: int = None, return_score: bool = False):
+        r"""Search all queries with pyserini's multi-threaded ``batch_search``."""
+        if isinstance(query_list, str):
+            query_list = [query_list]
+        if num is None:
+            num = self.topk
+        qids = [str(i) for i in range(len(query_list))]
+        batch_hits = self.searcher.batch_search(query_list, qids, k=num, threads=self.max_process_num)
         results = []
         scores = []
-        for query in query_list:
-            item_result, item_score = self._search(query, num,True)
+        for qid in qids:
+            hits = batch_hits.get(qid, [])
+            item_result, item_score = self._hits_to_results(hits, num) if len(hits) > 0 else ([], [])
             results.append(item_result)
             scores.append(item_score)
-
         if return_score:
             return results, scores
         else:
@@ -349,6 +355,8 @@ if __name__ == '__main__':
     parser.add_argument('--retrieval_query_max_length', default=256, type=str)
     parser.add_argument('--retrieval_use_fp16', action='store_true', default=False)
     parser.add_argument('--retrieval_batch_size', default=512, type=int)
+    parser.add_argument('--bm25_threads', default=8, type=int)
+    parser.add_argument('--bm25_doc_cache_size', default=100000, type=int)
     
     args = parser.parse_args()
 
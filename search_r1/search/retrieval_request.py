@@ -21,3 +21,15 @@ retrieved_data = response.json()
 
 print("Response from server:")
 print(retrieved_data)
+
+# The same request with the columnar msgpack response (doc ids, scores, preformatted passages)
+import msgpack
+
+with requests.Session() as session:
+    response = session.post(url, json=payload, headers={"Accept": "application/msgpack"})
+    response.raise_for_status()
+    packed = msgpack.unpackb(response.content, raw=False)
+
+print("Packed response from server:")
+print(packed["doc_ids"][:2], packed["scores"][:2])
+print(packed["passages"][0])
@@ -3,6 +3,12 @@ import os
 import warnings
 from typing import List, Dict, Optional
 import argparse
+import threading
+import functools
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import faiss
 import torch
@@ -12,15 +18,28 @@ from tqdm import tqdm
 import datasets
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Response
 from pydantic import BaseModel
 
+from index_builder import set_search_params
+from sharded_index import ShardedIndex
+
 
 parser = argparse.ArgumentParser(description="Launch the local faiss retriever.")
 parser.add_argument("--index_path", type=str, default="/home/peterjin/mnt/index/wiki-18/e5_Flat.index", help="Corpus indexing file.")
 parser.add_argument("--corpus_path", type=str, default="/home/peterjin/mnt/data/retrieval-corpus/wiki-18.jsonl", help="Local corpus file.")
 parser.add_argument("--topk", type=int, default=3, help="Number of retrieved passages for one query.")
 parser.add_argument("--retriever_model", type=str, default="intfloat/e5-base-v2", help="Name of the retriever model.")
+parser.add_argument("--nprobe", type=int, default=None, help="Default number of IVF lists probed per query.")
+parser.add_argument("--efsearch", type=int, default=None, help="Default HNSW search depth.")
+parser.add_argument("--faiss_cpu", action="store_true", help="Serve the index on CPU instead of all GPUs.")
+parser.add_argument("--cpu_threads", type=int, default=None, help="Search threads on CPU, one per shard for sharded indexes.")
+parser.add_argument("--omp_threads_per_shard", type=int, default=None, help="OpenMP threads used by each search thread.")
+parser.add_argument("--no_mmap", action="store_true", help="Load the CPU index into memory instead of memory-mapping it.")
+parser.add_argument("--bm25_index_path", type=str, default=None, help="Pyserini index; if given, BM25 and dense results are fused.")
+parser.add_argument("--fusion", type=str, default="rrf", choices=["rrf", "weighted"], help="How hybrid results are fused.")
+parser.add_argument("--rrf_k", type=int, default=60, help="Rank offset of reciprocal rank fusion.")
+parser.add_argument("--dense_weight", type=float, default=0.5, help="Weight of the dense ranking in hybrid fusion.")
 
 args = parser.parse_args()
 
@@ -44,12 +63,12 @@ def load_docs(corpus, doc_idxs):
     results = [corpus[int(idx)] for idx in doc_idxs]
     return results
 
-def load_model(model_path: str, use_fp16: bool = False):
+def load_model(model_path: str, use_fp16: bool = False, device: str = "cuda"):
     model_config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
     model = AutoModel.from_pretrained(model_path, trust_remote_code=True)
     model.eval()
-    model.cuda()
-    if use_fp16: 
+    model.to(device)
+    if use_fp16 and device != "cpu": 
         model = model.half()
     tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True, trust_remote_code=True)
     return model, tokenizer
@@ -77,8 +96,9 @@ class Encoder:
         self.pooling_method = pooling_method
         self.max_length = max_length
         self.use_fp16 = use_fp16
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
-        self.model, self.tokenizer = load_model(model_path=model_path, use_fp16=use_fp16)
+        self.model, self.tokenizer = load_model(model_path=model_path, use_fp16=use_fp16, device=self.device)
         self.model.eval()
 
     @torch.no_grad()
@@ -103,7 +123,7 @@ class Encoder:
                                 truncation=True,
                                 return_tensors="pt"
                                 )
-        inputs = {k: v.cuda() for k, v in inputs.items()}
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
 
         if "T5" in type(self.model).__name__:
             # T5-based retrieval model
@@ -139,16 +159,58 @@ class BaseRetriever:
     def _search(self, query: str, num: int, return_score: bool):
         raise NotImplementedError
 
-    def _batch_search(self, query_list: List[str], num: int, return_score: bool):
+    def _batch_search(self, query_list: List[str], num: int, return_score: bool, **search_params):
         raise NotImplementedError
 
     def search(self, query: str, num: int = None, return_score: bool = False):
         return self._search(query, num, return_score)
     
-    def batch_search(self, query_list: List[str], num: int = None, return_score: bool = False):
-        return self._batch_search(query_list, num, return_score)
+    def batch_search(self, query_list: List[str], num: int = None, return_score: bool = False, **search_params):
+        """``search_params`` (nprobe, efsearch) override the index defaults for this call, dense retrievers only."""
+        return self._batch_search(query_list, num, return_score, **search_params)
+
+
+class SearchParamsLock:
+    """Searches with the default nprobe/efSearch share the index. A search overriding them sets them on the shared
+    index, so it runs alone, and waiting overrides go before new default searches."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
 
 class BM25Retriever(BaseRetriever):
+    r"""BM25 retriever based on pre-built pyserini index."""
+
     def __init__(self, config):
         super().__init__(config)
         from pyserini.search.lucene import LuceneSearcher
@@ -156,52 +218,56 @@ class BM25Retriever(BaseRetriever):
         self.contain_doc = self._check_contain_doc()
         if not self.contain_doc:
             self.corpus = load_corpus(self.corpus_path)
-        self.max_process_num = 8
-    
+        self.max_process_num = config.bm25_threads
+        # parsed documents keyed by docid, popular documents are hit by many queries
+        self._get_doc = functools.lru_cache(maxsize=config.bm25_doc_cache_size)(self._load_doc)
+
     def _check_contain_doc(self):
+        r"""Check if the index contains document content
+        """
         return self.searcher.doc(0).raw() is not None
 
-    def _search(self, query: str, num: int = None, return_score: bool = False):
-        if num is None:
-            num = self.topk
-        hits = self.searcher.search(query, num)
-        if len(hits) < 1:
-            if return_score:
-                return [], []
-            else:
-                return []
-        scores = [hit.score for hit in hits]
+    def _load_doc(self, docid: str) -> Dict[str, str]:
+        if not self.contain_doc:
+            return self.corpus[int(docid)]
+        content = json.loads(self.searcher.doc(docid).raw())['contents']
+        return {
+            'id': docid,
+            'title': content.split("\n")[0].strip("\""),
+            'text': "\n".join(content.split("\n")[1:]),
+            'contents': content
+        }
+
+    def _hits_to_results(self, hits, num: int):
         if len(hits) < num:
             warnings.warn('Not enough documents retrieved!')
         else:
             hits = hits[:num]
+        return [self._get_doc(hit.docid) for hit in hits], [hit.score for hit in hits]
 
-        if self.contain_doc:
-            all_contents = [
-                json.loads(self.searcher.doc(hit.docid).raw())['contents'] 
-                for hit in hits
-            ]
-            results = [
-                {
-                    'title': content.split("\n")[0].strip("\""),
-                    'text': "\n".join(content.split("\n")[1:]),
-                    'contents': content
-                } 
-                for content in all_contents
-            ]
-        else:
-            results = load_docs(self.corpus, [hit.docid for hit in hits])
-
+    def _search(self, query: str, num: int = None, return_score: bool = False):
+        if num is None:
+            num = self.topk
+        hits = self.searcher.search(query, num)
+        results, scores = self._hits_to_results(hits, num) if len(hits) > 0 else ([], [])
         if return_score:
             return results, scores
         else:
             return results
 
     def _batch_search(self, query_list: List[str], num: int = None, return_score: bool = False):
+        r"""Search all queries with pyserini's multi-threaded ``batch_search``."""
+        if isinstance(query_list, str):
+            query_list = [query_list]
+        if num is None:
+            num = self.topk
+        qids = [str(i) for i in range(len(query_list))]
+        batch_hits = self.searcher.batch_search(query_list, qids, k=num, threads=self.max_process_num)
         results = []
         scores = []
-        for query in query_list:
-            item_result, item_score = self._search(query, num, True)
+        for qid in qids:
+            hits = batch_hits.get(qid, [])
+            item_result, item_score = self._hits_to_results(hits, num) if len(hits) > 0 else ([], [])
             results.append(item_result)
             scores.append(item_score)
         if return_score:
@@ -212,12 +278,23 @@ class BM25Retriever(BaseRetriever):
 class DenseRetriever(BaseRetriever):
     def __init__(self, config):
         super().__init__(config)
-        self.index = faiss.read_index(self.index_path)
         if config.faiss_gpu:
+            self.index = faiss.read_index(self.index_path)
             co = faiss.GpuMultipleClonerOptions()
             co.useFloat16 = True
             co.shard = True
             self.index = faiss.index_cpu_to_all_gpus(self.index, co=co)
+        else:
+            self.index = ShardedIndex(
+                self.index_path,
+                num_threads=config.faiss_cpu_threads,
+                omp_threads_per_shard=config.faiss_omp_threads_per_shard,
+                use_mmap=config.faiss_mmap
+            )
+        self.nprobe = config.faiss_nprobe
+        self.efsearch = config.faiss_efsearch
+        self.set_search_params()
+        self.search_params_lock = SearchParamsLock()
 
         self.corpus = load_corpus(self.corpus_path)
         self.encoder = Encoder(
@@ -234,7 +311,7 @@ class DenseRetriever(BaseRetriever):
         if num is None:
             num = self.topk
         query_emb = self.encoder.encode(query)
-        scores, idxs = self.index.search(query_emb, k=num)
+        scores, idxs = self.index_search(query_emb, num)
         idxs = idxs[0]
         scores = scores[0]
         results = load_docs(self.corpus, idxs)
@@ -243,7 +320,29 @@ class DenseRetriever(BaseRetriever):
         else:
             return results
 
-    def _batch_search(self, query_list: List[str], num: int = None, return_score: bool = False):
+    def set_search_params(self, nprobe: int = None, efsearch: int = None):
+        """Set nprobe/efSearch on the index, falling back to the configured defaults. Not thread safe, the
+        per-request overrides go through ``index_search``."""
+        nprobe = nprobe if nprobe is not None else self.nprobe
+        efsearch = efsearch if efsearch is not None else self.efsearch
+        indexes = self.index.shards if isinstance(self.index, ShardedIndex) else [self.index]
+        for index in indexes:
+            set_search_params(index, nprobe=nprobe, ef_search=efsearch)
+
+    def index_search(self, query_emb: np.ndarray, num: int, nprobe: int = None, efsearch: int = None):
+        """``index.search`` with nprobe/efSearch overridden for this call only"""
+        if (nprobe is None or nprobe == self.nprobe) and (efsearch is None or efsearch == self.efsearch):
+            with self.search_params_lock.shared():
+                return self.index.search(query_emb, k=num)
+        with self.search_params_lock.exclusive():
+            self.set_search_params(nprobe=nprobe, efsearch=efsearch)
+            try:
+                return self.index.search(query_emb, k=num)
+            finally:
+                self.set_search_params()
+
+    def _batch_search(self, query_list: List[str], num: int = None, return_score: bool = False,
+                      nprobe: int = None, efsearch: int = None):
         if isinstance(query_list, str):
             query_list = [query_list]
         if num is None:
@@ -254,7 +353,7 @@ class DenseRetriever(BaseRetriever):
         for start_idx in tqdm(range(0, len(query_list), self.batch_size), desc='Retrieval process: '):
             query_batch = query_list[start_idx:start_idx + self.batch_size]
             batch_emb = self.encoder.encode(query_batch)
-            batch_scores, batch_idxs = self.index.search(batch_emb, k=num)
+            batch_scores, batch_idxs = self.index_search(batch_emb, num, nprobe=nprobe, efsearch=efsearch)
             batch_scores = batch_scores.tolist()
             batch_idxs = batch_idxs.tolist()
 
@@ -271,9 +370,108 @@ class DenseRetriever(BaseRetriever):
         else:
             return results
 
+class HybridRetriever(BaseRetriever):
+    """Runs BM25 and dense retrieval concurrently in one process and fuses their rankings.
+
+    Fusion is either reciprocal rank fusion (``rrf``) or a weighted sum of per-query min-max normalized
+    scores (``weighted``). Documents returned by both backends are merged by doc id.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        bm25_config = copy.copy(config)
+        bm25_config.retrieval_method = "bm25"
+        bm25_config.index_path = config.bm25_index_path
+        self.bm25 = BM25Retriever(bm25_config)
+        self.dense = DenseRetriever(config)
+        self.fusion_method = config.fusion_method
+        self.rrf_k = config.rrf_k
+        self.dense_weight = config.dense_weight
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        # requests are served concurrently, each thread reads the timings of its own last search
+        self._local = threading.local()
+
+    @property
+    def last_timings(self) -> Dict[str, float]:
+        return getattr(self._local, "timings", {})
+
+    @staticmethod
+    def _timed(fn, *args):
+        start = time.perf_counter()
+        out = fn(*args)
+        return out, time.perf_counter() - start
+
+    @staticmethod
+    def _normalize(scores: List[float]) -> List[float]:
+        if len(scores) == 0:
+            return []
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(score - low) / (high - low) for score in scores]
+
+    def _fuse(self, ranked_lists, num: int):
+        """Fuse ``[(docs, scores, weight), ...]`` of one query into the top ``num`` documents."""
+        fused_scores, docs_by_id = {}, {}
+        for docs, scores, weight in ranked_lists:
+            if self.fusion_method == "rrf":
+                contributions = [weight / (self.rrf_k + rank + 1) for rank in range(len(docs))]
+            else:
+                contributions = [weight * score for score in self._normalize(scores)]
+            for doc, contribution in zip(docs, contributions):
+                doc_id = str(doc.get("id", doc["contents"]))
+                docs_by_id.setdefault(doc_id, doc)
+                fused_scores[doc_id] = fused_scores.get(doc_id, 0.0) + contribution
+        top_ids = sorted(fused_scores, key=fused_scores.get, reverse=True)[:num]
+        return [docs_by_id[doc_id] for doc_id in top_ids], [fused_scores[doc_id] for doc_id in top_ids]
+
+    def _search(self, query: str, num: int = None, return_score: bool = False):
+        results, scores = self._batch_search([query], num, True)
+        if return_score:
+            return results[0], scores[0]
+        else:
+            return results[0]
+
+    def _batch_search(self, query_list: List[str], num: int = None, return_score: bool = False, **search_params):
+        if isinstance(query_list, str):
+            query_list = [query_list]
+        if num is None:
+            num = self.topk
+        # retrieve deeper than topk so that fusion can promote documents ranked low by one backend
+        depth = 2 * num
+        start = time.perf_counter()
+        bm25_future = self.pool.submit(self._timed, self.bm25.batch_search, query_list, depth, True)
+        dense_future = self.pool.submit(self._timed, functools.partial(self.dense.batch_search, **search_params),
+                                        query_list, depth, True)
+        (bm25_results, bm25_scores), bm25_time = bm25_future.result()
+        (dense_results, dense_scores), dense_time = dense_future.result()
+
+        fusion_start = time.perf_counter()
+        results, scores = [], []
+        for i in range(len(query_list)):
+            item_result, item_score = self._fuse([
+                (bm25_results[i], bm25_scores[i], 1.0 - self.dense_weight),
+                (dense_results[i], dense_scores[i], self.dense_weight),
+            ], num)
+            results.append(item_result)
+            scores.append(item_score)
+        end = time.perf_counter()
+        self._local.timings = {
+            "bm25": bm25_time,
+            "dense": dense_time,
+            "fusion": end - fusion_start,
+            "total": end - start,
+        }
+        if return_score:
+            return results, scores
+        else:
+            return results
+
 def get_retriever(config):
     if config.retrieval_method == "bm25":
         return BM25Retriever(config)
+    elif config.bm25_index_path is not None:
+        return HybridRetriever(config)
     else:
         return DenseRetriever(config)
 
@@ -300,7 +498,18 @@ class Config:
         retrieval_pooling_method: str = "mean",
         retrieval_query_max_length: int = 256,
         retrieval_use_fp16: bool = False,
-        retrieval_batch_size: int = 128
+        retrieval_batch_size: int = 128,
+        faiss_nprobe: Optional[int] = None,
+        faiss_efsearch: Optional[int] = None,
+        faiss_cpu_threads: Optional[int] = None,
+        faiss_omp_threads_per_shard: Optional[int] = None,
+        faiss_mmap: bool = True,
+        bm25_threads: int = 8,
+        bm25_doc_cache_size: int = 100000,
+        bm25_index_path: Optional[str] = None,
+        fusion_method: str = "rrf",
+        rrf_k: int = 60,
+        dense_weight: float = 0.5
     ):
         self.retrieval_method = retrieval_method
         self.retrieval_topk = retrieval_topk
@@ -314,12 +523,25 @@ class Config:
         self.retrieval_query_max_length = retrieval_query_max_length
         self.retrieval_use_fp16 = retrieval_use_fp16
         self.retrieval_batch_size = retrieval_batch_size
+        self.faiss_nprobe = faiss_nprobe
+        self.faiss_efsearch = faiss_efsearch
+        self.faiss_cpu_threads = faiss_cpu_threads
+        self.faiss_omp_threads_per_shard = faiss_omp_threads_per_shard
+        self.faiss_mmap = faiss_mmap
+        self.bm25_threads = bm25_threads
+        self.bm25_doc_cache_size = bm25_doc_cache_size
+        self.bm25_index_path = bm25_index_path
+        self.fusion_method = fusion_method
+        self.rrf_k = rrf_k
+        self.dense_weight = dense_weight
 
 
 class QueryRequest(BaseModel):
     queries: List[str]
     topk: Optional[int] = None
     return_scores: bool = False
+    nprobe: Optional[int] = None
+    efSearch: Optional[int] = None
 
 
 app = FastAPI()
@@ -331,38 +553,85 @@ config = Config(
     index_path=args.index_path,
     corpus_path=args.corpus_path,
     retrieval_topk=args.topk,
-    faiss_gpu=True,
+    faiss_gpu=not args.faiss_cpu,
     retrieval_model_path=args.retriever_model,
     retrieval_pooling_method="mean",
     retrieval_query_max_length=256,
     retrieval_use_fp16=True,
     retrieval_batch_size=512,
+    faiss_nprobe=args.nprobe,
+    faiss_efsearch=args.efsearch,
+    faiss_cpu_threads=args.cpu_threads,
+    faiss_omp_threads_per_shard=args.omp_threads_per_shard,
+    faiss_mmap=not args.no_mmap,
+    bm25_index_path=args.bm25_index_path,
+    fusion_method=args.fusion,
+    rrf_k=args.rrf_k,
+    dense_weight=args.dense_weight,
 )
 
 # 2) Instantiate a global retriever so it is loaded once and reused.
 retriever = get_retriever(config)
 
+def passages2string(retrieval_result: List[Dict]) -> str:
+    """Format the documents retrieved for one query the way the LLM sees them."""
+    format_reference = ''
+    for idx, doc_item in enumerate(retrieval_result):
+        content = doc_item['contents']
+        title = content.split("\n")[0]
+        text = "\n".join(content.split("\n")[1:])
+        format_reference += f"Doc {idx+1}(Title: {title}) {text}\n"
+    return format_reference
+
+
+def pack_results(results, scores, timings: Optional[Dict[str, float]] = None) -> bytes:
+    """Columnar msgpack response: doc ids, scores and preformatted passages per query."""
+    import msgpack
+    packed = {
+        "doc_ids": [[str(doc.get("id", "")) for doc in single_result] for single_result in results],
+        "scores": [[float(score) for score in single_scores] for single_scores in scores],
+        "passages": [passages2string(single_result) for single_result in results],
+    }
+    if timings is not None:
+        packed["timings"] = timings
+    return msgpack.packb(packed, use_bin_type=True)
+
+
 @app.post("/retrieve")
-def retrieve_endpoint(request: QueryRequest):
+def retrieve_endpoint(request: QueryRequest, accept: Optional[str] = Header(None)):
     """
     Endpoint that accepts queries and performs retrieval.
     Input format:
     {
       "queries": ["What is Python?", "Tell me about neural networks."],
       "topk": 3,
-      "return_scores": true
+      "return_scores": true,
+      "nprobe": 32,      # optional, IVF indexes only
+      "efSearch": 128    # optional, HNSW indexes only
     }
+    With "Accept: application/msgpack" the response is a msgpack map
+    {"doc_ids": [[...]], "scores": [[...]], "passages": ["Doc 1(Title: ...) ...", ...]}
+    instead of the nested JSON documents.
+    A hybrid retriever (--bm25_index_path) also returns per-backend "timings" in seconds.
     """
     if not request.topk:
         request.topk = config.retrieval_topk  # fallback to default
 
     # Perform batch retrieval
+    search_params = {}
+    if isinstance(retriever, (DenseRetriever, HybridRetriever)):
+        search_params = {"nprobe": request.nprobe, "efsearch": request.efSearch}
     results, scores = retriever.batch_search(
         query_list=request.queries,
         num=request.topk,
-        return_score=request.return_scores
+        return_score=True,
+        **search_params
     )
-    
+    timings = getattr(retriever, "last_timings", None)
+
+    if accept is not None and "application/msgpack" in accept:
+        return Response(content=pack_results(results, scores, timings), media_type="application/msgpack")
+
     # Format response
     resp = []
     for i, single_result in enumerate(results):
@@ -374,6 +643,8 @@ def retrieve_endpoint(request: QueryRequest):
             resp.append(combined)
         else:
             resp.append(single_result)
+    if timings is not None:
+        return {"result": resp, "timings": timings}
     return {"result": resp}
 
 
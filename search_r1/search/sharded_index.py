@@ -0,0 +1,101 @@
+import os
+import glob
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+
+def shard_index_path(index_path: str, shard_id: int) -> str:
+    r"""Path of one shard of a sharded index, e.g. ``e5_Flat.shard0.index`` for ``e5_Flat.index``."""
+    root, ext = os.path.splitext(index_path)
+    return f"{root}.shard{shard_id}{ext}"
+
+
+def find_shard_paths(index_path: str):
+    r"""Return the shard files written for ``index_path``, or ``[index_path]`` if it was not sharded."""
+    root, ext = os.path.splitext(index_path)
+    shard_paths = glob.glob(f"{glob.escape(root)}.shard*{ext}")
+    if not shard_paths:
+        return [index_path]
+    return [shard_index_path(index_path, i) for i in range(len(shard_paths))]
+
+
+def read_index(index_path: str, use_mmap: bool = True):
+    r"""Read a faiss index, memory-mapping it when the index type supports it.
+
+    Memory-mapped indexes are shared through the page cache by every process serving the same file.
+    """
+    if use_mmap:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            warnings.warn(f"{index_path} cannot be memory-mapped, loading it into memory.", UserWarning)
+    return faiss.read_index(index_path)
+
+
+def merge_topk(all_scores: np.ndarray, all_idxs: np.ndarray, k: int, descending: bool = True):
+    r"""Merge per-shard results of shape ``(num_shards, nq, k)`` into the global top-k of shape ``(nq, k)``."""
+    scores = np.concatenate(list(all_scores), axis=1)
+    idxs = np.concatenate(list(all_idxs), axis=1)
+    # missing results are reported by faiss as id -1 and must rank last
+    fill = -np.inf if descending else np.inf
+    scores = np.where(idxs < 0, fill, scores)
+    order = np.argsort(-scores if descending else scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(idxs, order, axis=1)
+
+
+class ShardedIndex:
+    r"""CPU faiss index served by a thread pool.
+
+    If the index was built in shards, every shard is searched by its own thread and the per-shard top-k
+    are merged. Otherwise the query batch is split across threads that share the (memory-mapped) index.
+    Each thread pins its OpenMP pool to ``omp_threads_per_shard`` so that the shards do not oversubscribe
+    the cores.
+    """
+
+    def __init__(self, index_path: str, num_threads: int = None, omp_threads_per_shard: int = None,
+                 use_mmap: bool = True):
+        self.shard_paths = find_shard_paths(index_path)
+        self.shards = [read_index(path, use_mmap) for path in self.shard_paths]
+        self.offsets = np.cumsum([0] + [shard.ntotal for shard in self.shards[:-1]])
+        self.d = self.shards[0].d
+        self.ntotal = sum(shard.ntotal for shard in self.shards)
+        self.descending = self.shards[0].metric_type == faiss.METRIC_INNER_PRODUCT
+
+        self.num_threads = num_threads or len(self.shards)
+        if len(self.shards) > 1 and self.num_threads != len(self.shards):
+            warnings.warn(f"Index has {len(self.shards)} shards, using one thread per shard.", UserWarning)
+            self.num_threads = len(self.shards)
+        if omp_threads_per_shard is None:
+            omp_threads_per_shard = max(1, (os.cpu_count() or 1) // self.num_threads)
+        self.omp_threads_per_shard = omp_threads_per_shard
+        self.pool = ThreadPoolExecutor(max_workers=self.num_threads,
+                                       initializer=faiss.omp_set_num_threads,
+                                       initargs=(omp_threads_per_shard,))
+        print(f"[ShardedIndex] {self.ntotal} vectors in {len(self.shards)} shard(s), "
+              f"{self.num_threads} threads x {omp_threads_per_shard} OMP threads")
+
+    def _search_shards(self, query_emb: np.ndarray, k: int):
+        futures = [self.pool.submit(shard.search, query_emb, k) for shard in self.shards]
+        all_scores, all_idxs = [], []
+        for future, offset in zip(futures, self.offsets):
+            scores, idxs = future.result()
+            all_scores.append(scores)
+            all_idxs.append(np.where(idxs < 0, idxs, idxs + offset))
+        return merge_topk(np.stack(all_scores), np.stack(all_idxs), k, self.descending)
+
+    def _search_queries(self, query_emb: np.ndarray, k: int):
+        index = self.shards[0]
+        chunks = np.array_split(query_emb, min(self.num_threads, len(query_emb)))
+        futures = [self.pool.submit(index.search, np.ascontiguousarray(chunk), k) for chunk in chunks]
+        results = [future.result() for future in futures]
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    def search(self, query_emb: np.ndarray, k: int):
+        if len(self.shards) > 1:
+            return self._search_shards(query_emb, k)
+        if self.num_threads > 1 and len(query_emb) > 1:
+            return self._search_queries(query_emb, k)
+        return self.shards[0].search(query_emb, k)
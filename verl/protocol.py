@@ -592,6 +592,15 @@ class DataProto:
 import ray
 
 
+def _union_delta(data: DataProto, delta: DataProto) -> DataProto:
+    # the delta is computed after data was stored, so its meta_info is the most recent
+    batch = data.batch
+    if delta.batch is not None:
+        batch = delta.batch if batch is None else union_tensor_dict(batch.clone(recurse=False), delta.batch)
+    non_tensor_batch = union_numpy_dict(dict(data.non_tensor_batch), delta.non_tensor_batch)
+    return DataProto(batch=batch, non_tensor_batch=non_tensor_batch, meta_info={**data.meta_info, **delta.meta_info})
+
+
 @dataclass
 class DataProtoFuture:
     """
@@ -601,22 +610,60 @@ class DataProtoFuture:
     - collect_fn is a Callable that reduces the list of futures to a DataProto
     - dispatch_fn is a Callable that partitions the DataProto into a list of DataProto of size world_size and then select
 
-    Potential issue: we can optimize dispatch_fn(collect_fn) such that only needed data is fetched on destination
-    - DataProtoFuture only supports directly passing from the output of a method to another input. You can't perform any
-    operation on the DataProtoFuture in driver.
+    - aligned means that the futures are the equal sized shards of the DataProto in order, e.g. the outputs of a
+    DP_COMPUTE_PROTO call or ``DataProtoFuture.put``. Chunking it into len(futures) chunks then gives each rank
+    only its own shard, so that the rank never fetches the others.
+    - deltas are small DataProtos, one per future, unioned into the shards after fetching (see ``union``)
+
+    - Passing a DataProtoFuture to another worker group method lets the workers fetch the data themselves, it never goes
+    through the driver. ``then`` chains such calls.
+    - Reading an attribute of the DataProto (e.g. ``batch``, ``meta_info``) or calling ``get`` materializes the
+    future on the driver. The result is cached and never sent to the workers.
     """
     collect_fn: Callable
     futures: List[ray.ObjectRef]
     dispatch_fn: Callable = None
+    aligned: bool = False
+    deltas: List['DataProto'] = None
+    _result: 'DataProto' = field(default=None, repr=False, compare=False)
 
     @staticmethod
-    def concat(data: List[ray.ObjectRef]) -> 'DataProtoFuture':
-        output = DataProtoFuture(collect_fn=DataProto.concat, futures=data)
+    def concat(data: List[ray.ObjectRef], aligned: bool = False) -> 'DataProtoFuture':
+        output = DataProtoFuture(collect_fn=DataProto.concat, futures=data, aligned=aligned)
         return output
 
+    @staticmethod
+    def put(data: DataProto, chunks: int) -> 'DataProtoFuture':
+        """Put ``data`` in the object store as ``chunks`` shards, once.
+
+        Passing the result to several DP_COMPUTE_PROTO calls of worker groups with ``chunks`` ranks sends only the
+        object refs, instead of serializing the batch again for every call.
+        """
+        return DataProtoFuture.concat([ray.put(shard) for shard in data.chunk(chunks=chunks)], aligned=True)
+
+    def union(self, other: DataProto) -> 'DataProtoFuture':
+        """Add the keys of ``other`` (e.g. the advantages computed on the driver) to the stored shards, lazily.
+
+        ``other`` is chunked like the shards and travels with the refs. Its meta_info takes precedence.
+        """
+        assert self.aligned and self.dispatch_fn is None, 'union is only supported on aligned futures'
+        deltas = other.chunk(chunks=len(self.futures))
+        if self.deltas is not None:
+            deltas = [_union_delta(old, new) for old, new in zip(self.deltas, deltas)]
+        return DataProtoFuture(collect_fn=self.collect_fn, futures=self.futures, aligned=True, deltas=deltas)
+
     def chunk(self, chunks: int) -> List['DataProtoFuture']:
         from functools import partial
 
+        if self.aligned and self.dispatch_fn is None and chunks == len(self.futures):
+            return [
+                DataProtoFuture(collect_fn=self.collect_fn,
+                                futures=[future],
+                                aligned=True,
+                                deltas=None if self.deltas is None else [self.deltas[i]])
+                for i, future in enumerate(self.futures)
+            ]
+
         arg_future_lst = []
         for i in range(chunks):
             # note that we can't directly pass i and chunks
@@ -625,15 +672,64 @@ class DataProtoFuture:
 
             arg_future = DataProtoFuture(collect_fn=self.collect_fn,
                                          dispatch_fn=partial(dispatch_fn, i=i, chunks=chunks),
-                                         futures=self.futures)
+                                         futures=self.futures,
+                                         deltas=self.deltas)
             arg_future_lst.append(arg_future)
         return arg_future_lst
 
     def get(self):
+        if self._result is not None:
+            return self._result
         output = ray.get(self.futures)  # dp_size.
         for o in output:
             assert isinstance(o, DataProto)
+        if self.deltas is not None:
+            output = [_union_delta(o, delta) for o, delta in zip(output, self.deltas)]
         output = self.collect_fn(output)  # select dp, concat
         if self.dispatch_fn is not None:
             output = self.dispatch_fn(output)  # split in batch dim, select using dp
+        self._result = output
         return output
+
+    def done(self) -> bool:
+        """Whether all the futures are ready, without blocking"""
+        if self._result is not None:
+            return True
+        _, not_ready = ray.wait(self.futures, num_returns=len(self.futures), timeout=0)
+        return len(not_ready) == 0
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until all the futures are ready or ``timeout`` seconds passed, without fetching the data"""
+        if self._result is not None:
+            return True
+        _, not_ready = ray.wait(self.futures, num_returns=len(self.futures), timeout=timeout, fetch_local=False)
+        return len(not_ready) == 0
+
+    def then(self, fn: Callable, *args, **kwargs):
+        """Call ``fn(self, *args, **kwargs)`` on the workers once this future is ready.
+
+        ``fn`` is usually a worker group method, e.g. ``actor_future.then(critic_wg.compute_values)``. Its
+        non-blocking variant is used, so the call returns a DataProtoFuture immediately and the data goes from
+        worker to worker.
+        """
+        submit = getattr(fn, 'submit', None)
+        if submit is not None:
+            return submit(self, *args, **kwargs)
+        return fn(self, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # only reached for attributes that DataProtoFuture doesn't have, e.g. batch, meta_info or union
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __len__(self):
+        return len(self.get())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_result'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
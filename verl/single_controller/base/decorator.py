@@ -139,7 +139,8 @@ def _concat_data_proto_or_future(output: List):
     if isinstance(o, DataProto):
         return DataProto.concat(output)
     elif isinstance(o, ray.ObjectRef):
-        return DataProtoFuture.concat(output)
+        # every rank returns the output of its equal chunk of the input
+        return DataProtoFuture.concat(output, aligned=True)
     else:
         raise NotImplementedError
 
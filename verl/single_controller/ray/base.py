@@ -35,7 +35,7 @@ def get_random_string(length: int) -> str:
 
 def func_generator(self, method_name, dispatch_fn, collect_fn, execute_fn, blocking):
 
-    def func(*args, **kwargs):
+    def call(blocking, *args, **kwargs):
         args, kwargs = dispatch_fn(self, *args, **kwargs)
         output = execute_fn(method_name, *args, **kwargs)
         if blocking:
@@ -43,6 +43,14 @@ def func_generator(self, method_name, dispatch_fn, collect_fn, execute_fn, block
         output = collect_fn(self, output)
         return output
 
+    def func(*args, **kwargs):
+        return call(blocking, *args, **kwargs)
+
+    def submit(*args, **kwargs):
+        # never waits for the workers, DataProto outputs are collected into a DataProtoFuture
+        return call(False, *args, **kwargs)
+
+    func.submit = submit
     return func
 
 
@@ -333,7 +333,8 @@ class FSDPSFTTrainer(object):
             self.tokenizer.save_pretrained(path)
             if self.config.trainer.default_hdfs_dir:
                 hdfs_io.makedirs(self.config.trainer.default_hdfs_dir, exist_ok=True)
-                hdfs_io.copy(src=path, dst=self.config.trainer.default_hdfs_dir, dirs_exist_ok=True)
+                hdfs_io.copy(src=path,
+                             dst=os.path.join(self.config.trainer.default_hdfs_dir, os.path.basename(path)))
         torch.distributed.barrier()
 
     def fit(self):
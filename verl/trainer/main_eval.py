@@ -15,54 +15,142 @@
 Offline evaluate the performance of a generated file using reward model and ground truth verifier.
 The input is a parquet file that contains N generated sequences and (optional) the ground truth.
 
+The file is streamed in record batches and scored by a process pool, so memory stays bounded by
+``data.batch_size`` rows regardless of the file size. For every data_source it reports the mean score,
+the unbiased pass@k for each k in ``eval.ks`` and, for multi-turn tasks, the average number of turns
+of the solved responses.
 """
 
+import json
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
 import hydra
-from verl.utils.fs import copy_local_path_from_hdfs
-from verl.utils.reward_score import math, gsm8k
-import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
+from omegaconf import OmegaConf
+from verl.utils.fs import copy_local_path_from_hdfs
+from verl.utils.reward_score import select_score_fn, select_turns_fn
 
 
-def select_reward_fn(data_source):
-    if data_source == 'lighteval/MATH':
-        return math.compute_score
-    else:
-        raise NotImplementedError
+def pass_at_k(n, c, k):
+    """Unbiased estimator of pass@k from n samples of which c are correct (Chen et al., 2021)."""
+    if n - c < k:
+        return 1.0
+    return 1.0 - np.prod(1.0 - k / np.arange(n - c + 1, n + 1))
+
+
+def score_chunk(rows, success_threshold):
+    """Score a list of (data_source, responses, ground_truth) in a worker process.
+
+    Returns a list of (data_source, scores, num_correct, turns), turns holding one entry per solved response.
+    """
+    results = []
+    for data_source, responses, ground_truth in rows:
+        score_fn = select_score_fn(data_source)
+        turns_fn = select_turns_fn(data_source)
+        scores = [float(score_fn(r, ground_truth)) for r in responses]
+        correct = [score >= success_threshold for score in scores]
+        turns = []
+        if turns_fn is not None:
+            for r, is_correct in zip(responses, correct):
+                if is_correct:
+                    num_turns = turns_fn(r, ground_truth)
+                    if num_turns is not None:
+                        turns.append(num_turns)
+        results.append((data_source, scores, sum(correct), turns))
+    return results
+
+
+class EvalAccumulator:
+    """Per data_source running sums, so that nothing but the metrics is kept in memory."""
+
+    def __init__(self, ks):
+        self.ks = ks
+        self.num_prompts = defaultdict(int)
+        self.num_responses = defaultdict(int)
+        self.score_sum = defaultdict(float)
+        self.pass_sum = defaultdict(lambda: defaultdict(float))
+        # prompts with at least k responses, the only ones pass@k is defined for
+        self.pass_count = defaultdict(lambda: defaultdict(int))
+        self.turns_sum = defaultdict(int)
+        self.turns_count = defaultdict(int)
+
+    def update(self, results):
+        for data_source, scores, num_correct, turns in results:
+            n = len(scores)
+            if n == 0:
+                continue
+            self.num_prompts[data_source] += 1
+            self.num_responses[data_source] += n
+            self.score_sum[data_source] += sum(scores)
+            for k in self.ks:
+                if k <= n:
+                    self.pass_sum[data_source][k] += pass_at_k(n, num_correct, k)
+                    self.pass_count[data_source][k] += 1
+            self.turns_sum[data_source] += sum(turns)
+            self.turns_count[data_source] += len(turns)
+
+    def metrics(self):
+        metrics = {}
+        for data_source, num_prompts in self.num_prompts.items():
+            source_metrics = {
+                'num_prompts': num_prompts,
+                'mean_score': self.score_sum[data_source] / self.num_responses[data_source],
+            }
+            for k, pass_sum in self.pass_sum[data_source].items():
+                # prompts with fewer than k responses are left out of pass@k
+                source_metrics[f'pass@{k}'] = pass_sum / self.pass_count[data_source][k]
+            if self.turns_count[data_source] > 0:
+                source_metrics['avg_turns_to_solve'] = self.turns_sum[data_source] / self.turns_count[data_source]
+            metrics[data_source] = source_metrics
+        return metrics
+
+
+def iter_chunks(local_path, config):
+    """Yield lists of (data_source, responses, ground_truth), reading the parquet file batch by batch."""
+    columns = [config.data.response_key, config.data.data_source_key, config.data.reward_model_key]
+    parquet_file = pq.ParquetFile(local_path)
+    for record_batch in parquet_file.iter_batches(batch_size=config.data.batch_size, columns=columns):
+        responses = record_batch.column(config.data.response_key).to_pylist()
+        data_sources = record_batch.column(config.data.data_source_key).to_pylist()
+        reward_model_data = record_batch.column(config.data.reward_model_key).to_pylist()
+        rows = [(data_source, response_lst, reward_data['ground_truth'])
+                for data_source, response_lst, reward_data in zip(data_sources, responses, reward_model_data)]
+        for start in range(0, len(rows), config.eval.chunk_size):
+            yield rows[start:start + config.eval.chunk_size]
 
 
 @hydra.main(config_path='config', config_name='evaluation', version_base=None)
 def main(config):
     local_path = copy_local_path_from_hdfs(config.data.path)
-    dataset = pd.read_parquet(local_path)
-    prompts = dataset[config.data.prompt_key]
-    responses = dataset[config.data.response_key]
-    data_sources = dataset[config.data.data_source_key]
-    reward_model_data = dataset[config.data.reward_model_key]
-
-    passes = 0
-
-    total = len(dataset)
-
-    for i in range(total):
-        response_lst = responses[i]
-        data_source = data_sources[i]
-        # select reward score based on data_source
-        prompt = prompts[i]
-        reward_data = reward_model_data[i]
-        reward_fn = select_reward_fn(data_source)
-        ground_truth = reward_data['ground_truth']
-        score_lst = []
-        for r in response_lst:
-            score = reward_fn(r, ground_truth)
-            score_lst.append(score)
-
-        max_score = np.max(score_lst)
-
-        if max_score == 1:
-            passes += 1
-
-    print(f'pass@5: {passes / total}')
+    ks = sorted(config.eval.ks)
+    accumulator = EvalAccumulator(ks)
+
+    if config.eval.num_workers <= 1:
+        for rows in iter_chunks(local_path, config):
+            accumulator.update(score_chunk(rows, config.eval.success_threshold))
+    else:
+        max_in_flight = 2 * config.eval.num_workers
+        with ProcessPoolExecutor(max_workers=config.eval.num_workers) as pool:
+            futures = []
+            for rows in iter_chunks(local_path, config):
+                futures.append(pool.submit(score_chunk, rows, config.eval.success_threshold))
+                # bound the number of pending chunks so that the reader does not run ahead of the scorers
+                if len(futures) >= max_in_flight:
+                    accumulator.update(futures.pop(0).result())
+            for future in futures:
+                accumulator.update(future.result())
+
+    metrics = accumulator.metrics()
+    for data_source, source_metrics in metrics.items():
+        print(f'[{data_source}] ' + ', '.join(
+            f'{name}: {value:.4f}' if isinstance(value, float) else f'{name}: {value}'
+            for name, value in source_metrics.items()))
+
+    if config.eval.get('output_path', None):
+        with open(config.eval.output_path, 'w') as f:
+            json.dump({'config': OmegaConf.to_container(config, resolve=True), 'metrics': metrics}, f, indent=2)
 
 
 if __name__ == '__main__':
@@ -13,9 +13,12 @@
 # limitations under the License.
 """
 Generate responses given a dataset of prompts
+
+With multi_turn.enable, every prompt is played as a multi-turn Wordle episode by LLMGenerationManager,
+e.g. to evaluate a checkpoint offline. The n_samples responses of a prompt are generated in the same
+batch, and the outputs are appended to the output parquet batch by batch.
 """
 import ray
-import numpy as np
 import hydra
 import os
 
@@ -23,19 +26,75 @@ os.environ['NCCL_DEBUG'] = 'WARN'
 os.environ['TOKENIZERS_PARALLELISM'] = 'true'
 # os.environ['TORCH_COMPILE_DISABLE'] = '1'
 
-from verl.utils.model import compute_position_id_with_mask
-
 import pandas as pd
-
-from transformers import AutoTokenizer
+import pyarrow as pa
+import pyarrow.parquet as pq
+from torch.utils.data import DataLoader
 
 from verl import DataProto
+from verl.protocol import pad_dataproto_to_divisor, unpad_dataproto
 from verl.utils.fs import copy_local_path_from_hdfs
+from verl.utils.dataset.rl_dataset import RLHFDataset, collate_fn
 from verl.workers.fsdp_workers import ActorRolloutRefWorker
 from verl.utils.hdfs_io import makedirs
 from verl.single_controller.ray import RayClassWithInitArgs, RayResourcePool, RayWorkerGroup
 
 
+class IncrementalParquetWriter:
+    """Append the rows of every batch to one parquet file, so that outputs never accumulate in memory."""
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.writer = None
+
+    def write(self, rows: pd.DataFrame):
+        if self.writer is None:
+            table = pa.Table.from_pandas(rows, preserve_index=False)
+            self.writer = pq.ParquetWriter(self.output_path, table.schema)
+        else:
+            table = pa.Table.from_pandas(rows, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def decode_responses(tokenizer, responses):
+    output_text = tokenizer.batch_decode(responses, skip_special_tokens=False)
+    # remove the padding
+    pad_token = tokenizer.pad_token
+    return [text.replace(pad_token, '') for text in output_text]
+
+
+def group_samples(values, n_samples):
+    """Split a list interleaved as [prompt0_sample0, prompt0_sample1, ...] into one list per prompt."""
+    return [values[i:i + n_samples] for i in range(0, len(values), n_samples)]
+
+
+def generate_single_turn(wg, tokenizer, gen_batch, n_samples, dp_size):
+    gen_batch_padded, pad_size = pad_dataproto_to_divisor(gen_batch, dp_size)
+    output = wg.generate_sequences(gen_batch_padded)
+    output = unpad_dataproto(output, pad_size=pad_size)
+    return {'responses': group_samples(decode_responses(tokenizer, output.batch['responses']), n_samples)}
+
+
+def generate_multi_turn(generation_manager, tokenizer, gen_batch, n_samples):
+    first_input_ids = gen_batch.batch['input_ids'][:, -generation_manager.config.max_start_length:].clone()
+    output = generation_manager.run_llm_loop(gen_batch=gen_batch, initial_input_ids=first_input_ids)
+
+    turns = [[] for _ in range(len(gen_batch))]
+    for turn in generation_manager.turn_history:
+        for i, active in enumerate(turn['active']):
+            if active:
+                turns[i].append({'response': turn['responses'][i], 'observation': turn['observations'][i]})
+    return {
+        'responses': group_samples(decode_responses(tokenizer, output.batch['responses']), n_samples),
+        'turns': group_samples(turns, n_samples),
+        'num_turns': group_samples([len(t) for t in turns], n_samples),
+    }
+
+
 @hydra.main(config_path='config', config_name='generation', version_base=None)
 def main(config):
     from pprint import pprint
@@ -49,88 +108,76 @@ def main(config):
     if config.rollout.temperature == 0.:
         assert config.data.n_samples == 1, 'When temperature=0, n_samples must be 1.'
 
-    # read dataset. Note that the dataset should directly contain chat template format (e.g., a list of dictionary)
-    dataset = pd.read_parquet(config.data.path)
-    chat_lst = dataset[config.data.prompt_key].tolist()
-
-    chat_lst = [chat.tolist() for chat in chat_lst]
-
     tokenizer.padding_side = 'left'
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
+    # read dataset. Note that the dataset should directly contain chat template format (e.g., a list of dictionary)
+    # prompts are tokenized once per row by the dataset instead of re-applying the chat template per batch
+    dataset = RLHFDataset(parquet_files=config.data.path,
+                          tokenizer=tokenizer,
+                          prompt_key=config.data.prompt_key,
+                          max_prompt_length=config.rollout.prompt_length,
+                          filter_prompts=False,
+                          return_raw_chat=True,
+                          truncation=config.data.get('truncation', 'right'))
+    dataloader = DataLoader(dataset=dataset, batch_size=config.data.batch_size, shuffle=False, collate_fn=collate_fn)
+
     ray_cls_with_init = RayClassWithInitArgs(cls=ray.remote(ActorRolloutRefWorker), config=config, role='rollout')
     resource_pool = RayResourcePool(process_on_nodes=[config.trainer.n_gpus_per_node] * config.trainer.nnodes)
     wg = RayWorkerGroup(resource_pool=resource_pool, ray_cls_with_init=ray_cls_with_init)
     wg.init_model()
-
-    total_samples = len(dataset)
-    # real_batch_size = data.batch['input_ids'].shape[0]
-    config_batch_size = config.data.batch_size
     dp_size = wg.world_size // config.rollout.tensor_model_parallel_size
-    num_batch = (total_samples // config_batch_size) + 1
-    output_lst = [[] for _ in range(config.data.n_samples)]
-
-    for batch_idx in range(num_batch):
-        print(f'[{batch_idx+1}/{num_batch}] Start to process.')
-        batch_chat_lst = chat_lst[batch_idx * config_batch_size:(batch_idx + 1) * config_batch_size]
-        inputs = tokenizer.apply_chat_template(batch_chat_lst,
-                                               add_generation_prompt=True,
-                                               padding=True,
-                                               truncation=True,
-                                               max_length=config.rollout.prompt_length,
-                                               return_tensors='pt',
-                                               return_dict=True,
-                                               tokenize=True)
-        input_ids = inputs['input_ids']
-        attention_mask = inputs['attention_mask']
-        position_ids = compute_position_id_with_mask(attention_mask)
-
-        batch_dict = {'input_ids': input_ids, 'attention_mask': attention_mask, 'position_ids': position_ids}
-
-        data = DataProto.from_dict(batch_dict)
-        real_batch_size = data.batch['input_ids'].shape[0]
-        if real_batch_size % dp_size != 0:
-            dummy_data_size = dp_size - real_batch_size % dp_size
-            dummy_data = data[:dummy_data_size]
-            data = DataProto.concat([data, dummy_data])
-            print(
-                f'dp_size {dp_size} is not divisible by real_batch_size {real_batch_size}, add {dummy_data_size} dummy data'
-            )
-
-        batch_size = data.batch['input_ids'].shape[0]
-        assert batch_size % dp_size == 0, f'batch_size {batch_size} is not divisible by dp_size {dp_size}'
-
-        print(f'[{batch_idx+1}/{num_batch}] Start to generate.')
-        # START TO GENERATE FOR n_samples TIMES
-        for i in range(config.data.n_samples):
-            output = wg.generate_sequences(data)
-            # remove dummy data
-            output = output[:real_batch_size]
-            output_text = tokenizer.batch_decode(output.batch['input_ids'][:, -config.rollout.response_length:],
-                                                 skip_special_tokens=False)
-
-            # remove the padding
-            pad_token = tokenizer.pad_token
-            output_text_unpad = []
-            for text in output_text:
-                output_text_unpad.append(text.replace(pad_token, ''))
-
-            output_lst[i].extend(output_text_unpad)
-
-    # convert output_lst from (n_samples, n_data) to (n_data, n_sampels)
-    output_lst = np.array(output_lst, dtype=object)
-    output_lst = np.transpose(output_lst, axes=(1, 0)).tolist()
-
-    # add to the data frame
-    dataset[f'responses'] = output_lst
-
-    # write to a new parquet
+
+    multi_turn = config.get('multi_turn', {}).get('enable', False)
+    if multi_turn:
+        from search_r1.llm_agent.generation import LLMGenerationManager, GenerationConfig
+        gen_config = GenerationConfig(
+            max_turns=config.multi_turn.max_turns,
+            max_start_length=config.multi_turn.max_start_length,
+            max_prompt_length=config.rollout.prompt_length,
+            max_response_length=config.rollout.response_length,
+            max_obs_length=config.multi_turn.max_obs_length,
+            num_gpus=wg.world_size,
+        )
+        generation_manager = LLMGenerationManager(
+            tokenizer=tokenizer,
+            actor_rollout_wg=wg,
+            config=gen_config,
+            is_validation=True,
+            record_turns=True,
+        )
+
     output_dir = os.path.dirname(config.data.output_path)
     makedirs(output_dir, exist_ok=True)
-    dataset.to_parquet(config.data.output_path)
-
-    return output_text
+    writer = IncrementalParquetWriter(config.data.output_path)
+
+    n_samples = config.data.n_samples
+    num_batch = len(dataloader)
+    try:
+        for batch_idx, batch_dict in enumerate(dataloader):
+            print(f'[{batch_idx+1}/{num_batch}] Start to generate.')
+            batch = DataProto.from_single_dict(batch_dict)
+            real_batch_size = len(batch)
+
+            gen_batch = batch.select(batch_keys=['input_ids', 'attention_mask', 'position_ids'],
+                                     non_tensor_batch_keys=['reward_model'] if multi_turn else [])
+            gen_batch.meta_info = {'recompute_log_prob': False}
+            # all the samples of a prompt are generated in the same batch
+            gen_batch = gen_batch.repeat(repeat_times=n_samples, interleave=True)
+
+            if multi_turn:
+                outputs = generate_multi_turn(generation_manager, tokenizer, gen_batch, n_samples)
+            else:
+                outputs = generate_single_turn(wg, tokenizer, gen_batch, n_samples, dp_size)
+
+            rows = {key: list(value) for key, value in batch.non_tensor_batch.items() if key != 'raw_prompt'}
+            rows[config.data.prompt_key] = list(batch.non_tensor_batch['raw_prompt'])
+            rows.update(outputs)
+            assert all(len(value) == real_batch_size for value in rows.values())
+            writer.write(pd.DataFrame(rows))
+    finally:
+        writer.close()
 
 
 if __name__ == '__main__':
@@ -150,7 +150,6 @@ def main_task(config):
 
     role_worker_mapping = {
         Role.ActorRollout: ray.remote(ActorRolloutRefWorker),
-        Role.Critic: ray.remote(CriticWorker),
         Role.RefPolicy: ray.remote(ActorRolloutRefWorker),
     }
 
@@ -160,10 +159,14 @@ def main_task(config):
     }
     mapping = {
         Role.ActorRollout: global_pool_id,
-        Role.Critic: global_pool_id,
         Role.RefPolicy: global_pool_id,
     }
 
+    # grpo estimates the baseline from the group of responses, the critic is never built
+    if config.algorithm.adv_estimator == 'gae':
+        role_worker_mapping[Role.Critic] = ray.remote(CriticWorker)
+        mapping[Role.Critic] = global_pool_id
+
     # we should adopt a multi-source reward function here
     # - for rule-based rm, we directly call a reward score
     # - for model-based rm, we call a model
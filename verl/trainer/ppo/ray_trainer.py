@@ -17,8 +17,11 @@ This trainer supports model-agonistic model initialization with huggingface
 """
 
 import os
+import time
 import uuid
-from contextlib import contextmanager
+import functools
+import itertools
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass, field
 from enum import Enum
 from pprint import pprint
@@ -29,15 +32,18 @@ import json
 from collections import defaultdict
 
 import numpy as np
+import ray
 from codetiming import Timer
-from omegaconf import OmegaConf, open_dict
+from omegaconf import OmegaConf, open_dict, ListConfig
 from verl import DataProto
-from verl.protocol import pad_dataproto_to_divisor, unpad_dataproto
+from verl.protocol import DataProtoFuture, pad_dataproto_to_divisor, unpad_dataproto
 from verl.single_controller.base import Worker
 from verl.single_controller.ray import RayResourcePool, RayWorkerGroup, RayClassWithInitArgs
 from verl.single_controller.ray.base import create_colocated_worker_cls
 from verl.trainer.ppo import core_algos
 from verl.utils.seqlen_balancing import get_seqlen_balanced_partitions, log_seqlen_unbalance
+from verl.utils.debug.profiler import DriverProfiler
+from verl.utils.fsdp_checkpoint import get_rng_state, set_rng_state, is_complete_checkpoint, upload_files
 
 import re
 from search_r1.llm_agent.generation import LLMGenerationManager, GenerationConfig
@@ -176,6 +182,14 @@ def _compute_response_info(batch):
     )
 
 
+def _to_floats(tensors: Dict[str, torch.Tensor]) -> Dict[str, float]:
+    """Scalar tensors -> floats, with one stack and copy to host instead of an .item() per tensor"""
+    if not tensors:
+        return {}
+    values = torch.stack([tensor.detach().float().reshape(()) for tensor in tensors.values()]).cpu().tolist()
+    return dict(zip(tensors.keys(), values))
+
+
 def compute_data_metrics(batch, use_critic=True):
     # TODO: add response length
     sequence_score = batch.batch['token_level_scores'].sum(-1)
@@ -204,62 +218,63 @@ def compute_data_metrics(batch, use_critic=True):
         return_diff_var = torch.var(valid_returns - valid_values)
         return_var = torch.var(valid_returns)
 
+    # gather every statistic in one tensor, so that a single copy to host (sync) is needed
     metrics = {
         # score
         'critic/score/mean':
-            torch.mean(sequence_score).detach().item(),
+            torch.mean(sequence_score),
         'critic/score/max':
-            torch.max(sequence_score).detach().item(),
+            torch.max(sequence_score),
         'critic/score/min':
-            torch.min(sequence_score).detach().item(),
+            torch.min(sequence_score),
         # reward
         'critic/rewards/mean':
-            torch.mean(sequence_reward).detach().item(),
+            torch.mean(sequence_reward),
         'critic/rewards/max':
-            torch.max(sequence_reward).detach().item(),
+            torch.max(sequence_reward),
         'critic/rewards/min':
-            torch.min(sequence_reward).detach().item(),
+            torch.min(sequence_reward),
         # adv
         'critic/advantages/mean':
-            torch.mean(valid_adv).detach().item(),
+            torch.mean(valid_adv),
         'critic/advantages/max':
-            torch.max(valid_adv).detach().item(),
+            torch.max(valid_adv),
         'critic/advantages/min':
-            torch.min(valid_adv).detach().item(),
+            torch.min(valid_adv),
         # returns
         'critic/returns/mean':
-            torch.mean(valid_returns).detach().item(),
+            torch.mean(valid_returns),
         'critic/returns/max':
-            torch.max(valid_returns).detach().item(),
+            torch.max(valid_returns),
         'critic/returns/min':
-            torch.min(valid_returns).detach().item(),
+            torch.min(valid_returns),
         **({
             # values
-            'critic/values/mean': torch.mean(valid_values).detach().item(),
-            'critic/values/max': torch.max(valid_values).detach().item(),
-            'critic/values/min': torch.min(valid_values).detach().item(),
+            'critic/values/mean': torch.mean(valid_values),
+            'critic/values/max': torch.max(valid_values),
+            'critic/values/min': torch.min(valid_values),
             # vf explained var
-            'critic/vf_explained_var': (1.0 - return_diff_var / (return_var + 1e-5)).detach().item(),
+            'critic/vf_explained_var': (1.0 - return_diff_var / (return_var + 1e-5)),
         } if use_critic else {}),
 
         # response length
         'response_length/mean':
-            torch.mean(response_length).detach().item(),
+            torch.mean(response_length),
         'response_length/max':
-            torch.max(response_length).detach().item(),
+            torch.max(response_length),
         'response_length/min':
-            torch.min(response_length).detach().item(),
+            torch.min(response_length),
         'response_length/clip_ratio':
-            torch.mean(torch.eq(response_length, max_response_length).float()).detach().item(),
+            torch.mean(torch.eq(response_length, max_response_length).float()),
         # prompt length
         'prompt_length/mean':
-            torch.mean(prompt_length).detach().item(),
+            torch.mean(prompt_length),
         'prompt_length/max':
-            torch.max(prompt_length).detach().item(),
+            torch.max(prompt_length),
         'prompt_length/min':
-            torch.min(prompt_length).detach().item(),
+            torch.min(prompt_length),
         'prompt_length/clip_ratio':
-            torch.mean(torch.eq(prompt_length, max_prompt_length).float()).detach().item(),
+            torch.mean(torch.eq(prompt_length, max_prompt_length).float()),
 
         # metrics for actions
         # 'metric/total_env':
@@ -276,13 +291,14 @@ def compute_data_metrics(batch, use_critic=True):
         #     float(np.array(batch.non_tensor_batch['effective_action_ratio'], dtype=np.float32).mean()),
     }
 
-    return metrics
+    return _to_floats(metrics)
 
 
 def compute_timing_metrics(batch, timing_raw):
     response_info = _compute_response_info(batch)
-    num_prompt_tokens = torch.sum(response_info['prompt_length']).item()
-    num_response_tokens = torch.sum(response_info['response_length']).item()
+    num_prompt_tokens, num_response_tokens = torch.stack(
+        [torch.sum(response_info['prompt_length']),
+         torch.sum(response_info['response_length'])]).tolist()
     num_overall_tokens = num_prompt_tokens + num_response_tokens
 
     num_tokens_of_section = {
@@ -304,8 +320,8 @@ def compute_timing_metrics(batch, timing_raw):
 
 
 @contextmanager
-def _timer(name: str, timing_raw: Dict[str, float]):
-    with Timer(name=name, logger=None) as timer:
+def _timer(name: str, timing_raw: Dict[str, float], profiler: DriverProfiler = None):
+    with (profiler.span(name) if profiler is not None else nullcontext()), Timer(name=name, logger=None) as timer:
         yield
     timing_raw[name] = timer.last
 
@@ -342,6 +358,8 @@ class RayPPOTrainer(object):
         self.role_worker_mapping = role_worker_mapping
         self.resource_pool_manager = resource_pool_manager
         self.use_reference_policy = Role.RefPolicy in role_worker_mapping
+        # the ref policy is a frozen copy inside the actor workers instead of a worker group of its own
+        self.ref_in_actor = self.use_reference_policy and config.actor_rollout_ref.ref.get('fuse_with_actor', False)
         self.use_rm = Role.RewardModel in role_worker_mapping
         self.ray_worker_group_cls = ray_worker_group_cls
 
@@ -361,37 +379,96 @@ class RayPPOTrainer(object):
 
         self._create_dataloader()
         self._init_logger()
+        # filled by init_workers, logged at the start of fit
+        self.startup_metrics = {}
     
     def _init_logger(self):
         from verl.utils.tracking import Tracking
         self.logger = Tracking(project_name=self.config.trainer.project_name,
                           experiment_name=self.config.trainer.experiment_name,
                           default_backend=self.config.trainer.logger,
-                          config=OmegaConf.to_container(self.config, resolve=True))
+                          config=OmegaConf.to_container(self.config, resolve=True),
+                          async_logging=self.config.trainer.get('async_logging', False),
+                          log_dir=self.config.trainer.get('log_dir', None))
+
+    def _create_wordle_dataset(self, wordle_config):
+        """Procedurally generated Wordle episodes, used instead of data.train_files."""
+        from verl.utils.dataset.wordle_dataset import WordleDataset, read_target_words
+        from verl.utils.fs import copy_local_path_from_hdfs
+        exclude_words = None
+        if wordle_config.get('exclude_val_words', True):
+            val_files = self.config.data.val_files
+            if not isinstance(val_files, (list, ListConfig)):
+                val_files = [val_files]
+            exclude_words = read_target_words([copy_local_path_from_hdfs(f) for f in val_files])
+        return WordleDataset(word_list_path=wordle_config.word_list,
+                             tokenizer=self.tokenizer,
+                             word_lengths=wordle_config.word_lengths,
+                             samples_per_epoch=wordle_config.samples_per_epoch,
+                             max_prompt_length=self.config.data.max_prompt_length,
+                             exclude_words=exclude_words,
+                             seed=wordle_config.get('seed', 0),
+                             dynamic_padding=self.config.data.get('dynamic_padding', False))
 
     def _create_dataloader(self):
-        from torch.utils.data import DataLoader
+        from torch.utils.data import DataLoader, IterableDataset
         # TODO: we have to make sure the batch size is divisible by the dp size
-        from verl.utils.dataset.rl_dataset import RLHFDataset, collate_fn
-        self.train_dataset = RLHFDataset(parquet_files=self.config.data.train_files,
-                                         tokenizer=self.tokenizer,
-                                         prompt_key=self.config.data.prompt_key,
-                                         max_prompt_length=self.config.data.max_prompt_length,
-                                         filter_prompts=True,
-                                         return_raw_chat=self.config.data.get('return_raw_chat', False),
-                                         truncation='error')
-        if self.config.data.train_data_num is not None:
-            if self.config.data.train_data_num > len(self.train_dataset.dataframe):
-                print(f"[WARNING] training dataset size is smaller than desired size. Using the dataset as the original size {len(self.train_dataset.dataframe)}")
-            else:
-                self.train_dataset.dataframe = self.train_dataset.dataframe.sample(self.config.data.train_data_num, random_state=42)
-        print(f"filtered training dataset size: {len(self.train_dataset.dataframe)}")
-
-        self.train_dataloader = DataLoader(dataset=self.train_dataset,
-                                           batch_size=self.config.data.train_batch_size,
-                                           shuffle=self.config.data.shuffle_train_dataloader,
-                                           drop_last=True,
-                                           collate_fn=collate_fn)
+        from verl.utils.dataset.rl_dataset import (RLHFDataset, LengthBucketBatchSampler, ShuffledBatchSampler, collate_fn,
+                                                   padded_collate_fn)
+        wordle_config = self.config.data.get('wordle', None)
+        if wordle_config is not None and wordle_config.get('enable', False):
+            self.train_dataset = self._create_wordle_dataset(wordle_config)
+        else:
+            self.train_dataset = RLHFDataset(parquet_files=self.config.data.train_files,
+                                             tokenizer=self.tokenizer,
+                                             prompt_key=self.config.data.prompt_key,
+                                             max_prompt_length=self.config.data.max_prompt_length,
+                                             filter_prompts=True,
+                                             return_raw_chat=self.config.data.get('return_raw_chat', False),
+                                             truncation='error',
+                                             compile_cache=self.config.data.get('compile_cache', False),
+                                             dynamic_padding=self.config.data.get('dynamic_padding', False))
+            if self.config.data.train_data_num is not None:
+                if self.config.data.train_data_num > len(self.train_dataset.dataframe):
+                    print(f"[WARNING] training dataset size is smaller than desired size. Using the dataset as the original size {len(self.train_dataset.dataframe)}")
+                else:
+                    self.train_dataset.sample(self.config.data.train_data_num, random_state=42)
+        print(f"filtered training dataset size: {len(self.train_dataset)}")
+
+        dynamic_padding = self.config.data.get('dynamic_padding', False)
+        if dynamic_padding:
+            # pad each batch to its longest prompt instead of max_prompt_length
+            batch_collate_fn = functools.partial(padded_collate_fn, pad_token_id=self.tokenizer.pad_token_id)
+        else:
+            batch_collate_fn = collate_fn
+
+        if isinstance(self.train_dataset, IterableDataset):
+            # episodes are generated in a random order already
+            self.train_dataloader = DataLoader(dataset=self.train_dataset,
+                                               batch_size=self.config.data.train_batch_size,
+                                               drop_last=True,
+                                               collate_fn=batch_collate_fn)
+        elif self.config.data.get('length_bucketing', False):
+            train_batch_sampler = LengthBucketBatchSampler(
+                lengths=self.train_dataset.get_prompt_lengths(),
+                batch_size=self.config.data.train_batch_size,
+                shuffle=self.config.data.shuffle_train_dataloader,
+                drop_last=True,
+                bucket_size_multiplier=self.config.data.get('bucket_size_multiplier', 16),
+                seed=self.config.data.get('seed', 0))
+            self.train_dataloader = DataLoader(dataset=self.train_dataset,
+                                               batch_sampler=train_batch_sampler,
+                                               collate_fn=batch_collate_fn)
+        else:
+            # the order of every epoch only depends on the seed, so that a resumed run sees the same batches
+            train_batch_sampler = ShuffledBatchSampler(num_samples=len(self.train_dataset),
+                                                       batch_size=self.config.data.train_batch_size,
+                                                       shuffle=self.config.data.shuffle_train_dataloader,
+                                                       drop_last=True,
+                                                       seed=self.config.data.get('seed', 0))
+            self.train_dataloader = DataLoader(dataset=self.train_dataset,
+                                               batch_sampler=train_batch_sampler,
+                                               collate_fn=batch_collate_fn)
 
         self.val_dataset = RLHFDataset(parquet_files=self.config.data.val_files,
                                        tokenizer=self.tokenizer,
@@ -399,19 +476,21 @@ class RayPPOTrainer(object):
                                        max_prompt_length=self.config.data.max_prompt_length,
                                        filter_prompts=True,
                                        return_raw_chat=self.config.data.get('return_raw_chat', False),
-                                       truncation='error')
+                                       truncation='error',
+                                       compile_cache=self.config.data.get('compile_cache', False),
+                                       dynamic_padding=self.config.data.get('dynamic_padding', False))
         if self.config.data.val_data_num is not None:
             if self.config.data.val_data_num > len(self.val_dataset.dataframe):
                 print(f"[WARNING] validation dataset size is smaller than desired size. Using the dataset as the original size {len(self.val_dataset.dataframe)}")
             else:
-                self.val_dataset.dataframe = self.val_dataset.dataframe.sample(self.config.data.val_data_num, random_state=42)
+                self.val_dataset.sample(self.config.data.val_data_num, random_state=42)
         print(f"filtered validation dataset size: {len(self.val_dataset.dataframe)}")
 
         self.val_dataloader = DataLoader(dataset=self.val_dataset,
                                          batch_size=self.config.data.val_batch_size,
                                          shuffle=True,
                                          drop_last=True,
-                                         collate_fn=collate_fn)
+                                         collate_fn=batch_collate_fn)
 
         print(f'Size of train dataloader: {len(self.train_dataloader)}')
         print(f'Size of val dataloader: {len(self.val_dataloader)}')
@@ -452,6 +531,7 @@ class RayPPOTrainer(object):
             no_think_rl=self.config.algorithm.no_think_rl,
             search_url = self.config.retriever.url,
             topk = self.config.retriever.topk,
+            search_protocol = self.config.retriever.get('protocol', 'json'),
         )
 
         # Agent config preparation
@@ -520,6 +600,8 @@ class RayPPOTrainer(object):
                             gen_batch=test_gen_batch,
                             initial_input_ids=first_input_ids,
                         )
+                    # rollout metrics are only logged for training
+                    final_gen_batch_output.meta_info.pop('metrics', None)
                     
                     test_batch = test_batch.union(final_gen_batch_output)
                     
@@ -567,13 +649,14 @@ class RayPPOTrainer(object):
             resource_pool = self.resource_pool_manager.get_resource_pool(Role.ActorRollout)
             actor_rollout_cls = RayClassWithInitArgs(cls=self.role_worker_mapping[Role.ActorRollout],
                                                      config=self.config.actor_rollout_ref,
-                                                     role='actor_rollout')
+                                                     role='actor_rollout_ref' if self.ref_in_actor else 'actor_rollout')
             self.resource_pool_to_cls[resource_pool]['actor_rollout'] = actor_rollout_cls
         else:
             raise NotImplementedError
 
         # create critic
         if self.config.algorithm.adv_estimator == 'gae':
+            assert Role.Critic in self.role_worker_mapping, 'gae requires a critic worker'
             resource_pool = self.resource_pool_manager.get_resource_pool(Role.Critic)
             critic_cls = RayClassWithInitArgs(cls=self.role_worker_mapping[Role.Critic], config=self.config.critic)
             self.resource_pool_to_cls[resource_pool]['critic'] = critic_cls
@@ -585,7 +668,7 @@ class RayPPOTrainer(object):
             raise NotImplementedError
 
         # create reference policy if needed
-        if self.use_reference_policy:
+        if self.use_reference_policy and not self.ref_in_actor:
             resource_pool = self.resource_pool_manager.get_resource_pool(Role.RefPolicy)
             ref_policy_cls = RayClassWithInitArgs(self.role_worker_mapping[Role.RefPolicy],
                                                   config=self.config.actor_rollout_ref,
@@ -613,35 +696,152 @@ class RayPPOTrainer(object):
             # keep the referece of WorkerDict to support ray >= 2.31. Ref: https://github.com/ray-project/ray/pull/45699
             self.wg_dicts.append(wg_dict)
 
+        # the roles load their models concurrently. The roles colocated in one WorkerDict actor still run one after
+        # the other, in submission order, so the rollout is created at the end and vllm can have a better estimation
+        # of kv cache memory
+        start = time.perf_counter()
+        init_refs = {}
         if self.use_critic:
             self.critic_wg = all_wg['critic']
-            self.critic_wg.init_model()
+            init_refs['critic'] = self.critic_wg.init_model.submit()
 
-        if self.use_reference_policy:
+        if self.use_reference_policy and not self.ref_in_actor:
             self.ref_policy_wg = all_wg['ref']
-            self.ref_policy_wg.init_model()
+            init_refs['ref'] = self.ref_policy_wg.init_model.submit()
 
         if self.use_rm:
             self.rm_wg = all_wg['rm']
-            self.rm_wg.init_model()
+            init_refs['rm'] = self.rm_wg.init_model.submit()
 
-        # we should create rollout at the end so that vllm can have a better estimation of kv cache memory
         self.actor_rollout_wg = all_wg['actor_rollout']
-        self.actor_rollout_wg.init_model()
+        init_refs['actor_rollout'] = self.actor_rollout_wg.init_model.submit()
+        if self.ref_in_actor:
+            self.ref_policy_wg = self.actor_rollout_wg
+
+        self.startup_metrics = {}
+        for role, refs in init_refs.items():
+            self._add_startup_metrics(role, ray.get(refs))
+        self.startup_metrics['startup/init_model_s'] = time.perf_counter() - start
+
+    def _add_startup_metrics(self, role: str, rank_timings):
+        """The slowest rank of every step of init_model, e.g. startup/actor_rollout/actor/model_load_s"""
+        for timing in rank_timings:
+            for name, seconds in (timing or {}).items():
+                key = f'startup/{role}/{name}_s'
+                self.startup_metrics[key] = max(self.startup_metrics.get(key, 0.), seconds)
 
     def _save_checkpoint(self):
+        checkpoint_config = self.config.trainer.get('checkpoint', {})
+        sharded = checkpoint_config.get('sharded', False)
+        # only the fsdp workers support sharded checkpoints
+        save_kwargs = {'sharded': True, 'async_save': checkpoint_config.get('async_save', True)} if sharded else {}
+
         actor_local_path = os.path.join(self.config.trainer.default_local_dir, 'actor',
                                         f'global_step_{self.global_steps}')
         actor_remote_path = None if self.config.trainer.default_hdfs_dir is None else os.path.join(
             self.config.trainer.default_hdfs_dir, 'actor')
-        self.actor_rollout_wg.save_checkpoint(actor_local_path, actor_remote_path)
+        self.actor_rollout_wg.save_checkpoint(actor_local_path, actor_remote_path, **save_kwargs)
 
         if self.use_critic:
             critic_local_path = os.path.join(self.config.trainer.default_local_dir, 'critic',
                                              f'global_step_{self.global_steps}')
             critic_remote_path = None if self.config.trainer.default_hdfs_dir is None else os.path.join(
                 self.config.trainer.default_hdfs_dir, 'critic')
-            self.critic_wg.save_checkpoint(critic_local_path, critic_remote_path)
+            self.critic_wg.save_checkpoint(critic_local_path, critic_remote_path, **save_kwargs)
+
+        if sharded:
+            trainer_remote_path = None if self.config.trainer.default_hdfs_dir is None else os.path.join(
+                self.config.trainer.default_hdfs_dir, 'trainer', f'global_step_{self.global_steps}')
+            self._save_trainer_state(
+                os.path.join(self.config.trainer.default_local_dir, 'trainer', f'global_step_{self.global_steps}'),
+                trainer_remote_path)
+
+    def _trainer_state(self) -> dict:
+        """Driver state needed to resume: the step, the position of the train dataloader, the kl coefficient
+        and the rng states"""
+        return {
+            'global_steps': self.global_steps,
+            'epoch': self.epoch,
+            'batches_in_epoch': self.batches_in_epoch,
+            'kl_coef': self.kl_ctrl.value,
+            'rng': get_rng_state(),
+        }
+
+    def _find_latest_checkpoint(self):
+        """The latest step whose trainer state and actor/critic shards are all written, or None.
+
+        The ranks write their shards in the background, so the most recent step may be incomplete after a crash.
+        With several nodes, default_local_dir has to be on a filesystem shared by the driver and the workers.
+        """
+        default_local_dir = self.config.trainer.default_local_dir
+        trainer_dir = os.path.join(default_local_dir, 'trainer')
+        if not os.path.isdir(trainer_dir):
+            return None
+        prefix = 'global_step_'
+        steps = [int(name[len(prefix):]) for name in os.listdir(trainer_dir) if name.startswith(prefix) and name[len(prefix):].isdigit()]
+        for step in sorted(steps, reverse=True):
+            name = f'{prefix}{step}'
+            if not os.path.exists(os.path.join(trainer_dir, name, 'trainer_state.pt')):
+                continue
+            if not is_complete_checkpoint(os.path.join(default_local_dir, 'actor', name), self.actor_rollout_wg.world_size):
+                continue
+            if self.use_critic and not is_complete_checkpoint(os.path.join(default_local_dir, 'critic', name),
+                                                              self.critic_wg.world_size):
+                continue
+            return step
+        return None
+
+    def _load_checkpoint(self) -> bool:
+        """Resume from the latest complete sharded checkpoint in default_local_dir. Returns whether one was found."""
+        step = self._find_latest_checkpoint()
+        if step is None:
+            print(f'No complete checkpoint in {self.config.trainer.default_local_dir}, training from scratch')
+            return False
+
+        start = time.perf_counter()
+        default_local_dir = self.config.trainer.default_local_dir
+        print(f'Resuming from {default_local_dir} at step {step}')
+        self.actor_rollout_wg.load_checkpoint(os.path.join(default_local_dir, 'actor', f'global_step_{step}'))
+        if self.use_critic:
+            self.critic_wg.load_checkpoint(os.path.join(default_local_dir, 'critic', f'global_step_{step}'))
+
+        state = torch.load(os.path.join(default_local_dir, 'trainer', f'global_step_{step}', 'trainer_state.pt'),
+                           weights_only=False)
+        self.global_steps = state['global_steps']
+        self.epoch = state['epoch']
+        self.batches_in_epoch = state['batches_in_epoch']
+        self.kl_ctrl.value = state['kl_coef']
+        set_rng_state(state['rng'])
+        print(f'Resumed in {time.perf_counter() - start:.1f}s, epoch {self.epoch}, '
+              f'{self.batches_in_epoch} batches into the epoch')
+        return True
+
+    def _train_batches(self, epoch: int, skip_batches: int = 0):
+        """The train batches of ``epoch`` without its first ``skip_batches`` batches"""
+        from verl.utils.dataset.rl_dataset import EpochBatchSampler
+        if hasattr(self.train_dataset, 'set_epoch'):
+            self.train_dataset.set_epoch(epoch)
+        batch_sampler = self.train_dataloader.batch_sampler
+        if isinstance(batch_sampler, EpochBatchSampler):
+            # skipped by the sampler, without loading the samples
+            batch_sampler.set_epoch(epoch)
+            batch_sampler.skip_batches = skip_batches
+            return iter(self.train_dataloader)
+        return itertools.islice(self.train_dataloader, skip_batches, None)
+
+    def _save_trainer_state(self, local_path, hdfs_path=None):
+        os.makedirs(local_path, exist_ok=True)
+        torch.save(self._trainer_state(), os.path.join(local_path, 'trainer_state.pt'))
+        if hdfs_path is not None:
+            upload_files(local_path, hdfs_path)
+
+    def _wait_for_checkpoint(self):
+        """Wait for the sharded checkpoints written in the background by the workers"""
+        if not self.config.trainer.get('checkpoint', {}).get('sharded', False):
+            return
+        self.actor_rollout_wg.wait_for_checkpoint()
+        if self.use_critic:
+            self.critic_wg.wait_for_checkpoint()
 
     def _balance_batch(self, batch: DataProto, metrics, logging_prefix='global_seqlen'):
         """Reorder the data on single controller such that each dp rank gets similar total tokens"""
@@ -669,9 +869,15 @@ class RayPPOTrainer(object):
 
         logger = self.logger
         self.global_steps = 0
-        # perform validation before training
+        self.epoch = 0
+        self.batches_in_epoch = 0
+        resumed = self.config.trainer.get('resume', False) and self._load_checkpoint()
+        if self.startup_metrics:
+            pprint(f'Startup time: {self.startup_metrics}')
+            logger.log(data=self.startup_metrics, step=self.global_steps)
+        # perform validation before training, a resumed run did it already
         # currently, we only support validation using the reward_function.
-        if self.val_reward_fn is not None and self.config.trainer.get('val_before_train', True):
+        if not resumed and self.val_reward_fn is not None and self.config.trainer.get('val_before_train', True):
             val_metrics = self._validate()
             pprint(f'Initial validation metrics: {val_metrics}')
             logger.log(data=val_metrics, step=self.global_steps)
@@ -692,20 +898,28 @@ class RayPPOTrainer(object):
             no_think_rl=self.config.algorithm.no_think_rl,
             search_url = self.config.retriever.url,
             topk = self.config.retriever.topk,
+            search_protocol = self.config.retriever.get('protocol', 'json'),
         )
 
+        profiler = DriverProfiler(**self.config.trainer.get('profile', {}))
         generation_manager = LLMGenerationManager(
             tokenizer=self.tokenizer,
             actor_rollout_wg=self.actor_rollout_wg,
             config=gen_config,
+            profiler=profiler,
         )
 
         # start training loop
-        for epoch in range(self.config.trainer.total_epochs):
-            for batch_dict in self.train_dataloader:
+        start_epoch, start_batch = self.epoch, self.batches_in_epoch
+        for epoch in range(start_epoch, self.config.trainer.total_epochs):
+            self.epoch = epoch
+            skip_batches = start_batch if epoch == start_epoch else 0
+            for batch_in_epoch, batch_dict in enumerate(self._train_batches(epoch, skip_batches), start=skip_batches):
+                self.batches_in_epoch = batch_in_epoch + 1
                 print(f'epoch {epoch}, step {self.global_steps}')
                 metrics = {}
                 timing_raw = {}
+                profiler.start_step(self.global_steps)
 
                 batch: DataProto = DataProto.from_single_dict(batch_dict)
 
@@ -721,9 +935,10 @@ class RayPPOTrainer(object):
                 ####################
                 # original code here
 
-                with _timer('step', timing_raw):
+                with _timer('step', timing_raw, profiler):
                     if not self.config.do_search:
                         gen_batch_output = self.actor_rollout_wg.generate_sequences(gen_batch)
+                        metrics.update(gen_batch_output.meta_info.pop('metrics', {}))
 
                         batch.non_tensor_batch['uid'] = np.array([str(uuid.uuid4()) for _ in range(len(batch.batch))],
                                                                 dtype=object)
@@ -738,12 +953,13 @@ class RayPPOTrainer(object):
                     else:
                         first_input_ids = gen_batch.batch['input_ids'][:, -gen_config.max_start_length:].clone().long()
 
-                        with _timer('gen', timing_raw):
+                        with _timer('gen', timing_raw, profiler):
                             generation_manager.timing_raw = timing_raw
                             final_gen_batch_output = generation_manager.run_llm_loop(
                                 gen_batch=gen_batch,
                                 initial_input_ids=first_input_ids,
                             )
+                        metrics.update(final_gen_batch_output.meta_info.pop('metrics', {}))
 
                         # final_gen_batch_output.batch.apply(lambda x: x.long(), inplace=True)
                         for key in final_gen_batch_output.batch.keys():
@@ -752,6 +968,7 @@ class RayPPOTrainer(object):
                         with torch.no_grad():
                             try:
                                 output = self.actor_rollout_wg.compute_log_prob(final_gen_batch_output)
+                                metrics.update(output.meta_info.pop('metrics', {}))
                                 final_gen_batch_output = final_gen_batch_output.union(output)
                             except:
                                 print('############### here ###################')
@@ -768,7 +985,8 @@ class RayPPOTrainer(object):
                     # balance the number of valid tokens on each dp rank.
                     # Note that this breaks the order of data inside the batch.
                     # Please take care when you implement group based adv computation such as GRPO and rloo
-                    self._balance_batch(batch, metrics=metrics)
+                    with profiler.span('balance_batch'):
+                        self._balance_batch(batch, metrics=metrics)
 
                     # compute global_valid tokens
                     batch.meta_info['global_token_num'] = torch.sum(batch.batch['attention_mask'], dim=-1).tolist()
@@ -778,11 +996,28 @@ class RayPPOTrainer(object):
                         if key != 'old_log_probs':
                             batch.batch[key] = batch.batch[key].long()
 
+                    # store the batch once as per-rank shards, the workers then only receive object refs
+                    if self.config.trainer.get('resident_batch', False):
+                        worker_batch = DataProtoFuture.put(batch, chunks=self.actor_rollout_wg.world_size)
+                        resident_keys = (set(batch.batch.keys()), set(batch.non_tensor_batch.keys()))
+                    else:
+                        worker_batch, resident_keys = batch, None
+
+                    # submit the ref, critic and reward model calls before waiting on any of them, so that
+                    # roles placed on different resource pools compute at the same time
+                    if self.use_reference_policy:
+                        ref_log_prob_future = self.ref_policy_wg.compute_ref_log_prob.submit(worker_batch)
+                    if self.use_critic:
+                        values_future = self.critic_wg.compute_values.submit(worker_batch)
+                    if self.use_rm:
+                        reward_tensor_future = self.rm_wg.compute_rm_score.submit(worker_batch)
+
                     if self.use_reference_policy:
                         # compute reference log_prob
-                        with _timer('ref', timing_raw):
+                        with _timer('ref', timing_raw, profiler):
                             try:
-                                ref_log_prob = self.ref_policy_wg.compute_ref_log_prob(batch)
+                                ref_log_prob = ref_log_prob_future.get()
+                                metrics.update(ref_log_prob.meta_info.pop('metrics', {}))
                                 batch = batch.union(ref_log_prob)
                             except:
                                 print('################## herehere ################')
@@ -790,71 +1025,79 @@ class RayPPOTrainer(object):
 
                     # compute values
                     if self.use_critic:
-                        with _timer('values', timing_raw):
-                            values = self.critic_wg.compute_values(batch)
+                        with _timer('values', timing_raw, profiler):
+                            values = values_future.get()
                             batch = batch.union(values)
 
-                    with _timer('adv', timing_raw):
+                    with _timer('adv', timing_raw, profiler):
                         # compute scores. Support both model and function-based.
                         # We first compute the scores using reward model. Then, we call reward_fn to combine
                         # the results from reward model and rule-based results.
                         if self.use_rm:
                             # we first compute reward model score
-                            reward_tensor = self.rm_wg.compute_rm_score(batch)
+                            reward_tensor = reward_tensor_future.get()
                             batch = batch.union(reward_tensor)
 
                         # we combine with rule-based rm
-                        reward_tensor = self.reward_fn(batch)
+                        with profiler.span('reward_fn'):
+                            reward_tensor = self.reward_fn(batch)
                         batch.batch['token_level_scores'] = reward_tensor
 
                         # compute rewards. apply_kl_penalty if available
                         if not self.config.actor_rollout_ref.actor.use_kl_loss:
-                            batch, kl_metrics = apply_kl_penalty(batch,
-                                                                 kl_ctrl=self.kl_ctrl,
-                                                                 kl_penalty=self.config.algorithm.kl_penalty)
+                            with profiler.span('kl_penalty'):
+                                batch, kl_metrics = apply_kl_penalty(batch,
+                                                                     kl_ctrl=self.kl_ctrl,
+                                                                     kl_penalty=self.config.algorithm.kl_penalty)
                             metrics.update(kl_metrics)
                         else:
                             batch.batch['token_level_rewards'] = batch.batch['token_level_scores']
 
                         # compute advantages, executed on the driver process
-                        batch = compute_advantage(batch,
-                                                  adv_estimator=self.config.algorithm.adv_estimator,
-                                                  gamma=self.config.algorithm.gamma,
-                                                  lam=self.config.algorithm.lam,
-                                                  num_repeat=self.config.actor_rollout_ref.rollout.n)
+                        with profiler.span('advantage'):
+                            batch = compute_advantage(batch,
+                                                      adv_estimator=self.config.algorithm.adv_estimator,
+                                                      gamma=self.config.algorithm.gamma,
+                                                      lam=self.config.algorithm.lam,
+                                                      num_repeat=self.config.actor_rollout_ref.rollout.n)
 
                     # update critic
                     if self.use_critic:
-                        with _timer('update_critic', timing_raw):
-                            critic_output = self.critic_wg.update_critic(batch)
+                        with _timer('update_critic', timing_raw, profiler):
+                            critic_output = self.critic_wg.update_critic(
+                                self._to_workers(batch, worker_batch, resident_keys))
                         critic_output_metrics = reduce_metrics(critic_output.meta_info['metrics'])
                         metrics.update(critic_output_metrics)
 
                     # implement critic warmup
                     if self.config.trainer.critic_warmup <= self.global_steps:
                         # update actor
-                        with _timer('update_actor', timing_raw):
+                        with _timer('update_actor', timing_raw, profiler):
                             if self.config.do_search and self.config.actor_rollout_ref.actor.state_masking:
-                                batch, metrics = self._create_loss_mask(batch, metrics)
-                            actor_output = self.actor_rollout_wg.update_actor(batch)
+                                with profiler.span('loss_mask'):
+                                    batch, metrics = self._create_loss_mask(batch, metrics)
+                            actor_output = self.actor_rollout_wg.update_actor(
+                                self._to_workers(batch, worker_batch, resident_keys))
                         actor_output_metrics = reduce_metrics(actor_output.meta_info['metrics'])
                         metrics.update(actor_output_metrics)
 
                     # validate
                     if self.val_reward_fn is not None and self.config.trainer.test_freq > 0 and \
                         self.global_steps % self.config.trainer.test_freq == 0:
-                        with _timer('testing', timing_raw):
+                        with _timer('testing', timing_raw, profiler):
                             val_metrics: dict = self._validate()
                         metrics.update(val_metrics)
 
                     if self.config.trainer.save_freq > 0 and \
                             self.global_steps % self.config.trainer.save_freq == 0:
-                        with _timer('save_checkpoint', timing_raw):
+                        with _timer('save_checkpoint', timing_raw, profiler):
                             self._save_checkpoint()
 
                 # collect metrics
-                metrics.update(compute_data_metrics(batch=batch, use_critic=self.use_critic))
-                metrics.update(compute_timing_metrics(batch=batch, timing_raw=timing_raw))
+                with profiler.span('metrics'):
+                    metrics.update(compute_data_metrics(batch=batch, use_critic=self.use_critic))
+                    metrics.update(compute_timing_metrics(batch=batch, timing_raw=timing_raw))
+                metrics.update(profiler.end_step())
 
                 # TODO: make a canonical logger that supports various backend
                 logger.log(data=metrics, step=self.global_steps)
@@ -868,8 +1111,23 @@ class RayPPOTrainer(object):
                         val_metrics = self._validate()
                         pprint(f'Final validation metrics: {val_metrics}')
                         logger.log(data=val_metrics, step=self.global_steps)
+                    self._wait_for_checkpoint()
+                    logger.flush()
                     return
+
+        self._wait_for_checkpoint()
+        logger.flush()
     
+    def _to_workers(self, batch: DataProto, worker_batch, resident_keys):
+        """The batch to pass to a worker group. With resident shards, only the keys added on the driver since the
+        shards were stored are sent along with the refs."""
+        if resident_keys is None:
+            return batch
+        batch_keys, non_tensor_batch_keys = resident_keys
+        delta = batch.select(batch_keys=[key for key in batch.batch.keys() if key not in batch_keys],
+                             non_tensor_batch_keys=[key for key in batch.non_tensor_batch if key not in non_tensor_batch_keys])
+        return worker_batch.union(delta)
+
     def _create_loss_mask(self, batch, metrics):
         """Create loss mask for state tokens."""
         response_length = batch.batch['responses'].shape[-1]
@@ -13,4 +13,5 @@
 # limitations under the License.
 
 from .rl_dataset import RLHFDataset
-from .rm_dataset import RMDataset
\ No newline at end of file
+from .rm_dataset import RMDataset
+from .wordle_dataset import WordleDataset
@@ -14,13 +14,16 @@
 
 from omegaconf import ListConfig
 import os
+import json
+import hashlib
+import shutil
 from typing import List, Union
 
 import pandas as pd
 
 import torch
 import numpy as np
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Sampler
 from transformers import AutoTokenizer, PreTrainedTokenizer
 from verl.utils.fs import copy_local_path_from_hdfs
 
@@ -55,6 +58,103 @@ def collate_fn(data_list: list[dict]) -> dict:
     return output
 
 
+def padded_collate_fn(data_list: list[dict], pad_token_id: int) -> dict:
+    """collate_fn for ``RLHFDataset(dynamic_padding=True)``: left-pads the unpadded prompts once, to the
+    longest prompt of the batch, and computes position_ids on the padded batch.
+    Use ``functools.partial(padded_collate_fn, pad_token_id=...)`` as the DataLoader collate_fn.
+    """
+    max_length = max(len(data['input_ids']) for data in data_list)
+    for data in data_list:
+        pad_length = max_length - len(data['input_ids'])
+        data['input_ids'] = torch.nn.functional.pad(data['input_ids'], (pad_length, 0), value=pad_token_id)
+        data['attention_mask'] = torch.nn.functional.pad(data['attention_mask'], (pad_length, 0), value=0)
+    output = collate_fn(data_list)
+    output['position_ids'] = compute_position_id_with_mask(output['attention_mask'])
+    return output
+
+
+class EpochBatchSampler(Sampler):
+    """
+    Base of the batch samplers whose batches only depend on ``seed`` and the epoch, so that a resumed run
+    sees the same batches. ``skip_batches`` drops the first batches of the next epoch only, to resume in the
+    middle of an epoch without loading the skipped samples. Every epoch reshuffles.
+    """
+
+    def __init__(self, batch_size: int, shuffle=True, drop_last=True, seed=0):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.skip_batches = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _batches(self, rng: np.random.RandomState) -> List[np.ndarray]:
+        raise NotImplementedError
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        skip_batches, self.skip_batches = self.skip_batches, 0
+        for batch in self._batches(rng)[skip_batches:]:
+            yield batch.tolist()
+
+
+class ShuffledBatchSampler(EpochBatchSampler):
+    """Batches of a random permutation of the samples, like ``DataLoader(shuffle=True)``."""
+
+    def __init__(self, num_samples: int, batch_size: int, shuffle=True, drop_last=True, seed=0):
+        super().__init__(batch_size=batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+        self.num_samples = num_samples
+
+    def _batches(self, rng):
+        indices = rng.permutation(self.num_samples) if self.shuffle else np.arange(self.num_samples)
+        batches = [indices[i:i + self.batch_size] for i in range(0, self.num_samples, self.batch_size)]
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+        return batches
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+
+class LengthBucketBatchSampler(EpochBatchSampler):
+    """
+    Batch sampler that groups prompts of similar length, so that dynamically padded batches carry little padding.
+    Indices are shuffled, cut into buckets of ``batch_size * bucket_size_multiplier``, sorted by length inside
+    each bucket and split into batches; the batch order is shuffled again. Every epoch reshuffles.
+    """
+
+    def __init__(self, lengths, batch_size: int, shuffle=True, drop_last=True, bucket_size_multiplier=16, seed=0):
+        super().__init__(batch_size=batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+        self.lengths = np.asarray(lengths)
+        self.bucket_size = batch_size * bucket_size_multiplier
+
+    def _batches(self, rng):
+        num_samples = len(self.lengths)
+        indices = rng.permutation(num_samples) if self.shuffle else np.arange(num_samples)
+
+        batches = []
+        for start in range(0, num_samples, self.bucket_size):
+            bucket = indices[start:start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
 class RLHFDataset(Dataset):
     """
     We assume the dataset contains a column that contains prompts and other information
@@ -69,7 +169,9 @@ class RLHFDataset(Dataset):
                  cache_dir='~/.cache/verl/rlhf',
                  chat_template_func=None,
                  return_raw_chat=False,
-                 truncation='error'):
+                 truncation='error',
+                 compile_cache=False,
+                 dynamic_padding=False):
         if not isinstance(parquet_files, (List, ListConfig)):
             parquet_files = [parquet_files]
 
@@ -84,10 +186,18 @@ class RLHFDataset(Dataset):
         self.return_raw_chat = return_raw_chat
         self.chat_template_func = chat_template_func
         self.truncation = truncation
+        self.compile_cache = compile_cache
+        # return unpadded prompts, to be padded per batch by padded_collate_fn
+        self.dynamic_padding = dynamic_padding
 
         self._download()
         self._read_files_and_tokenize()
 
+        # position of each dataframe row in the compiled arrays
+        self._row_index = np.arange(len(self.dataframe))
+        if self.compile_cache:
+            self._compile()
+
     def _download(self):
         from verl.utils.fs import copy_local_path_from_hdfs
         for i, parquet_file in enumerate(self.parquet_files):
@@ -114,17 +224,7 @@ class RLHFDataset(Dataset):
 
         print(f'filter dataset len: {len(self.dataframe)}')
 
-    def __len__(self):
-        return len(self.dataframe)
-
-    def __getitem__(self, item):
-        """
-        Note that we also return the raw_input_ids so that it can be combined with other chat template
-        """
-        row_dict = self.dataframe.iloc[item].to_dict()
-
-        chat = row_dict.pop(self.prompt_key)
-
+    def _tokenize_prompt(self, chat):
         if self.tokenizer.chat_template:
             prompt_with_chat_template = self.tokenizer.apply_chat_template(chat, add_generation_prompt=True, tokenize=False)
         else:
@@ -139,10 +239,101 @@ class RLHFDataset(Dataset):
                                                                          truncation=self.truncation)
 
         position_ids = compute_position_id_with_mask(attention_mask)
+        return input_ids[0], attention_mask[0], position_ids[0]
+
+    def _cache_key(self) -> str:
+        """Hash of everything that determines the tokenized prompts."""
+        file_stats = [(f, os.path.getsize(f), os.path.getmtime(f)) for f in self.parquet_files]
+        key = {
+            'files': file_stats,
+            'tokenizer': self.tokenizer.name_or_path,
+            'vocab_size': len(self.tokenizer),
+            'chat_template': self.tokenizer.chat_template,
+            'pad_token_id': self.tokenizer.pad_token_id,
+            'prompt_key': self.prompt_key,
+            'max_prompt_length': self.max_prompt_length,
+            'truncation': self.truncation,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def _compile(self):
+        """Apply the chat template, tokenize and left-pad all prompts once into memory-mapped arrays.
+
+        The arrays live under ``cache_dir/compiled/<key>`` and are reused by every run with the same data,
+        tokenizer and template. Rows are served as zero-copy slices; the remaining columns are kept in a
+        side table of row dicts.
+        """
+        compiled_dir = os.path.join(self.cache_dir, 'compiled', self._cache_key())
+        keys = ['input_ids', 'attention_mask', 'position_ids']
+
+        if not os.path.exists(os.path.join(compiled_dir, 'DONE')):
+            print(f'compiling {len(self.dataframe)} prompts to {compiled_dir}')
+            tmp_dir = f'{compiled_dir}.tmp{os.getpid()}'
+            os.makedirs(tmp_dir, exist_ok=True)
+            arrays = {
+                key: np.lib.format.open_memmap(os.path.join(tmp_dir, f'{key}.npy'),
+                                               mode='w+',
+                                               dtype=np.int64,
+                                               shape=(len(self.dataframe), self.max_prompt_length)) for key in keys
+            }
+            for i, chat in enumerate(self.dataframe[self.prompt_key]):
+                for key, tensor in zip(keys, self._tokenize_prompt(chat)):
+                    arrays[key][i] = tensor.numpy()
+            for array in arrays.values():
+                array.flush()
+            del arrays
+            open(os.path.join(tmp_dir, 'DONE'), 'w').close()
+            try:
+                os.rename(tmp_dir, compiled_dir)
+            except OSError:
+                # another process finished compiling the same data first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # copy-on-write mapping so that torch.from_numpy gets a writable, zero-copy view
+        self._compiled = {key: np.load(os.path.join(compiled_dir, f'{key}.npy'), mmap_mode='c') for key in keys}
+        columns = [c for c in self.dataframe.columns if c != self.prompt_key or self.return_raw_chat]
+        self._rows = self.dataframe[columns].to_dict('records')
+        self._lengths = self._compiled['attention_mask'].sum(axis=-1)
+
+    def get_prompt_lengths(self) -> np.ndarray:
+        """Number of (unpadded) prompt tokens of every row, e.g. for LengthBucketBatchSampler."""
+        if self.compile_cache:
+            return self._lengths[self._row_index]
+        return np.array([int(self._tokenize_prompt(chat)[1].sum()) for chat in self.dataframe[self.prompt_key]])
+
+    def sample(self, num: int, random_state=None):
+        """Keep a random subset of ``num`` rows."""
+        positions = np.random.RandomState(random_state).permutation(len(self.dataframe))[:num]
+        self.dataframe = self.dataframe.iloc[positions]
+        self._row_index = self._row_index[positions]
+
+    def __len__(self):
+        return len(self.dataframe)
 
-        row_dict['input_ids'] = input_ids[0]
-        row_dict['attention_mask'] = attention_mask[0]
-        row_dict['position_ids'] = position_ids[0]
+    def __getitem__(self, item):
+        """
+        Note that we also return the raw_input_ids so that it can be combined with other chat template
+        """
+        if self.compile_cache:
+            row = self._row_index[item]
+            row_dict = dict(self._rows[row])
+            chat = row_dict.pop(self.prompt_key, None)
+            # prompts are left-padded, so the unpadded prompt is the tail of the row
+            start = self.max_prompt_length - self._lengths[row] if self.dynamic_padding else 0
+            for key, array in self._compiled.items():
+                row_dict[key] = torch.from_numpy(array[row, start:])
+        else:
+            row_dict = self.dataframe.iloc[item].to_dict()
+            chat = row_dict.pop(self.prompt_key)
+            row_dict['input_ids'], row_dict['attention_mask'], row_dict['position_ids'] = self._tokenize_prompt(chat)
+            if self.dynamic_padding:
+                length = int(row_dict['attention_mask'].sum())
+                for key in ['input_ids', 'attention_mask', 'position_ids']:
+                    row_dict[key] = row_dict[key][-length:]
+
+        if self.dynamic_padding:
+            # recomputed on the padded batch by padded_collate_fn
+            row_dict.pop('position_ids')
 
         # encode prompts without chat template
         if self.return_raw_chat:
@@ -0,0 +1,210 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Procedural Wordle episodes generated on the fly from a word list.
+"""
+
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import torch
+from omegaconf import ListConfig
+from torch.utils.data import IterableDataset, get_worker_info
+from transformers import PreTrainedTokenizer
+
+from verl.utils.model import compute_position_id_with_mask
+import verl.utils.torch_functional as verl_F
+
+
+def build_wordle_prompt(word_length: int) -> str:
+    """The Wordle instruction. It only depends on the word length, never on the secret word."""
+    return f"""
+Let's play Wordle. Your goal is to guess the secret {word_length}-letter word. You can query a word using the following format:
+
+<query>YOURWORD</query>
+
+Where 'YOURWORD' is the {word_length}-letter word you want to guess. The response will immediately follow your query and will be in this format:
+
+<response>RESPONSE</response>
+
+Where 'RESPONSE' describes the result of your guess using a natural-language style explanation for each letter.
+
+For example, if the secret word is "SHAPE" and you query "CRANE", the query would be:
+
+<query>CRANE</query>
+
+the response would be:
+
+<response>The first letter, C, is not in the word. The second letter, R, is in the word but in the wrong position. The third letter, A, is in the word but in the wrong position. The fourth letter, N, is not in the word. The fifth letter, E, is in the correct position.</response>
+
+You should make your queries one at a time, and only query one word at a time. It should only contains the word itself, no other text.
+Your objective is to guess the secret word in as few queries as possible.
+    """
+
+
+def build_wordle_chat(word_length: int) -> List[dict]:
+    return [{"role": "user", "content": build_wordle_prompt(word_length)}]
+
+
+def read_word_list(word_list_path: str, word_lengths: Iterable[int]) -> Dict[int, List[str]]:
+    """Group the alphabetic words of a one-word-per-line file by length, upper-cased and deduplicated."""
+    words_by_length = {length: set() for length in word_lengths}
+    with open(os.path.expanduser(word_list_path), 'r', encoding='utf-8') as f:
+        for line in f:
+            word = line.strip().upper()
+            if word.isalpha() and len(word) in words_by_length:
+                words_by_length[len(word)].add(word)
+    return {length: sorted(words) for length, words in words_by_length.items()}
+
+
+def read_target_words(parquet_files: Union[str, List[str]]) -> set:
+    """Secret words of an existing Wordle parquet split, e.g. to keep validation words out of training."""
+    if not isinstance(parquet_files, (list, ListConfig)):
+        parquet_files = [parquet_files]
+    words = set()
+    for parquet_file in parquet_files:
+        dataframe = pd.read_parquet(parquet_file, columns=['reward_model'])
+        words.update(row['ground_truth']['target'].upper() for row in dataframe['reward_model'])
+    return words
+
+
+class WordleDataset(IterableDataset):
+    """
+    Streams Wordle episodes sampled from a word list, with the same fields as RLHFDataset rows.
+
+    Only the secret word differs between episodes of the same word length, so the prompt of every word
+    length is tokenized once at construction and shared by all episodes. Start-up time and memory only
+    depend on the word list, not on the number of episodes.
+
+    Sampling is deterministic given ``seed``, the epoch, the (distributed) rank and the dataloader worker.
+    Every pass over the dataset advances the epoch; ``set_epoch`` sets it explicitly.
+    ``curriculum_fn(epoch)`` may return sampling weights per word length, e.g. to start with short words.
+    """
+
+    def __init__(self,
+                 word_list_path: str,
+                 tokenizer: PreTrainedTokenizer,
+                 word_lengths: Iterable[int] = (3, 4, 5),
+                 samples_per_epoch: int = 1024,
+                 max_prompt_length: int = 1024,
+                 exclude_words: Optional[Iterable[str]] = None,
+                 seed: int = 0,
+                 split: str = 'train',
+                 data_source: str = 'gen',
+                 curriculum_fn: Optional[Callable[[int], Dict[int, float]]] = None,
+                 dynamic_padding: bool = False,
+                 truncation: str = 'error'):
+        self.tokenizer = tokenizer
+        self.word_lengths = list(word_lengths)
+        self.samples_per_epoch = samples_per_epoch
+        self.max_prompt_length = max_prompt_length
+        self.seed = seed
+        self.split = split
+        self.data_source = data_source
+        self.curriculum_fn = curriculum_fn
+        self.dynamic_padding = dynamic_padding
+        self.truncation = truncation
+        self.epoch = 0
+
+        exclude_words = {word.upper() for word in (exclude_words or [])}
+        words_by_length = read_word_list(word_list_path, self.word_lengths)
+        self.words = {
+            length: [word for word in words if word not in exclude_words] for length, words in words_by_length.items()
+        }
+        for length, words in self.words.items():
+            assert len(words) > 0, f'no {length}-letter words left in {word_list_path}'
+
+        self.prompts = {length: self._tokenize_prompt(length) for length in self.word_lengths}
+        print(f'wordle dataset: {sum(len(words) for words in self.words.values())} words of lengths '
+              f'{self.word_lengths}, {samples_per_epoch} episodes per epoch')
+
+    def _tokenize_prompt(self, word_length: int) -> Dict[str, torch.Tensor]:
+        chat = build_wordle_chat(word_length)
+        if self.tokenizer.chat_template:
+            prompt_with_chat_template = self.tokenizer.apply_chat_template(chat, add_generation_prompt=True, tokenize=False)
+        else:
+            prompt_with_chat_template = chat[0]['content']
+
+        input_ids, attention_mask = verl_F.tokenize_and_postprocess_data(prompt=prompt_with_chat_template,
+                                                                         tokenizer=self.tokenizer,
+                                                                         max_length=self.max_prompt_length,
+                                                                         pad_token_id=self.tokenizer.pad_token_id,
+                                                                         left_pad=True,
+                                                                         truncation=self.truncation)
+        position_ids = compute_position_id_with_mask(attention_mask)
+        prompt = {'input_ids': input_ids[0], 'attention_mask': attention_mask[0], 'position_ids': position_ids[0]}
+        if self.dynamic_padding:
+            length = int(attention_mask.sum())
+            # position_ids are recomputed on the padded batch by padded_collate_fn
+            prompt = {'input_ids': input_ids[0, -length:], 'attention_mask': attention_mask[0, -length:]}
+        return prompt
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def set_curriculum(self, curriculum_fn: Optional[Callable[[int], Dict[int, float]]]):
+        self.curriculum_fn = curriculum_fn
+
+    def _length_weights(self, epoch: int) -> np.ndarray:
+        if self.curriculum_fn is None:
+            weights = {length: 1.0 for length in self.word_lengths}
+        else:
+            weights = self.curriculum_fn(epoch)
+        weights = np.array([float(weights.get(length, 0.)) for length in self.word_lengths])
+        assert weights.sum() > 0, f'curriculum gives zero weight to every word length at epoch {epoch}'
+        return weights / weights.sum()
+
+    @staticmethod
+    def _rank_and_world_size():
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return int(os.environ.get('RANK', 0)), int(os.environ.get('WORLD_SIZE', 1))
+
+    def __len__(self):
+        return self.samples_per_epoch
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+
+        rank, _ = self._rank_and_world_size()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        rng = np.random.default_rng([self.seed, epoch, rank, worker_id])
+
+        # dataloader workers split the epoch between them
+        num_samples = self.samples_per_epoch // num_workers + (worker_id < self.samples_per_epoch % num_workers)
+        lengths = rng.choice(self.word_lengths, size=num_samples, p=self._length_weights(epoch))
+        for i, length in enumerate(lengths):
+            words = self.words[length]
+            word = words[rng.integers(len(words))]
+            index = i * num_workers + worker_id
+            yield {
+                **self.prompts[length],
+                'data_source': self.data_source,
+                'ability': 'fact-reasoning',
+                'reward_model': {
+                    'style': 'rule',
+                    'ground_truth': {
+                        'target': word,
+                    }
+                },
+                'extra_info': {
+                    'split': self.split,
+                    'index': index,
+                },
+                'index': index,
+            }
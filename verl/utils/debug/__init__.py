@@ -12,4 +12,5 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .performance import log_gpu_memory_usage
\ No newline at end of file
+from .performance import log_gpu_memory_usage
+from .profiler import DriverProfiler
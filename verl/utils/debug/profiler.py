@@ -0,0 +1,151 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Nested time/memory spans for the driver process, exported as metrics and Chrome traces
+"""
+
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict
+
+_NULL_SPAN = nullcontext()
+# python < 3.9 cannot reset the tracemalloc peak, the spans then report the allocated bytes at their end instead
+_HAS_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+
+def _current_rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in KB on linux, only the lifetime peak is available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class DriverProfiler:
+    """Records nested named spans of the driver, e.g. ``step > gen > turn > env_step``.
+
+    Every span records its wall time and the driver RSS when it ends. With ``trace_memory``, tracemalloc also gives
+    the Python bytes allocated by the span and their peak (tracemalloc slows down allocation heavy code, so it is
+    off by default). ``end_step`` returns the step metrics, aggregated by span path, and writes the spans of the step
+    to ``{output_dir}/trace_step_{step}.json``, which can be opened in chrome://tracing or Perfetto.
+
+    When disabled, ``span`` returns a shared null context and nothing is recorded.
+    """
+
+    def __init__(self, enable: bool = False, output_dir: str = None, trace_memory: bool = False,
+                 tracemalloc_frames: int = 1):
+        self.enable = enable
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory and enable
+        self.step = None
+        self._events = []
+        self._stack = []
+        self._peak_rss = 0
+        self._pid = os.getpid()
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(tracemalloc_frames)
+        if enable and output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def span(self, name: str, **args):
+        """Context manager timing ``name`` inside the spans currently open. ``args`` are shown in the trace."""
+        if not self.enable:
+            return _NULL_SPAN
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name: str, args: dict):
+        path = '/'.join([frame['name'] for frame in self._stack] + [name])
+        frame = {'name': name, 'peak_alloc': 0}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if _HAS_RESET_PEAK:
+                # the peak so far belongs to the parent span, reset it to measure this one
+                if self._stack:
+                    self._stack[-1]['peak_alloc'] = max(self._stack[-1]['peak_alloc'], peak)
+                tracemalloc.reset_peak()
+            frame['alloc_start'] = current
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._stack.pop()
+            rss = _current_rss_bytes()
+            self._peak_rss = max(self._peak_rss, rss)
+            event_args = {**args, 'rss_mb': rss / 1024**2}
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                if not _HAS_RESET_PEAK:
+                    peak = current
+                peak = max(peak, frame['peak_alloc'])
+                if self._stack:
+                    self._stack[-1]['peak_alloc'] = max(self._stack[-1]['peak_alloc'], peak)
+                event_args['alloc_mb'] = (current - frame['alloc_start']) / 1024**2
+                event_args['peak_alloc_mb'] = (peak - frame['alloc_start']) / 1024**2
+            self._events.append({
+                'name': name,
+                'path': path,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': self._pid,
+                'tid': threading.get_ident(),
+                'args': event_args,
+            })
+
+    def start_step(self, step: int):
+        self.step = step
+        self._events = []
+        self._peak_rss = _current_rss_bytes() if self.enable else 0
+
+    def end_step(self) -> Dict[str, float]:
+        """Metrics of the spans recorded since ``start_step``, and the Chrome trace of the step"""
+        if not self.enable:
+            return {}
+        time_s = defaultdict(float)
+        count = defaultdict(int)
+        peak_alloc_mb = defaultdict(float)
+        for event in self._events:
+            time_s[event['path']] += event['dur'] / 1e6
+            count[event['path']] += 1
+            if 'peak_alloc_mb' in event['args']:
+                peak_alloc_mb[event['path']] = max(peak_alloc_mb[event['path']], event['args']['peak_alloc_mb'])
+
+        metrics = {'profile/driver_peak_rss_mb': self._peak_rss / 1024**2}
+        for path in time_s:
+            metrics[f'profile/{path}/time_s'] = time_s[path]
+            if count[path] > 1:
+                metrics[f'profile/{path}/count'] = count[path]
+            if path in peak_alloc_mb:
+                metrics[f'profile/{path}/peak_alloc_mb'] = peak_alloc_mb[path]
+
+        if self.output_dir is not None:
+            self.export_chrome_trace(os.path.join(self.output_dir, f'trace_step_{self.step}.json'))
+        self._events = []
+        return metrics
+
+    def export_chrome_trace(self, path: str):
+        events = [{key: value for key, value in event.items() if key != 'path'} for event in self._events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
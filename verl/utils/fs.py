@@ -16,12 +16,16 @@
 # -*- coding: utf-8 -*-
 """File-system agnostic IO APIs"""
 import os
+import json
+import time
+import shutil
 import tempfile
 import hashlib
+from typing import Optional
 
-from .hdfs_io import copy, makedirs, exists
+from .hdfs_io import copy, copy_tree, makedirs, exists, stat_files, MANIFEST_NAME
 
-__all__ = ["copy", "exists", "makedirs"]
+__all__ = ["copy", "copy_tree", "exists", "makedirs"]
 
 _HDFS_PREFIX = "hdfs://"
 
@@ -52,13 +56,31 @@ def get_local_temp_path(hdfs_path: str, cache_dir: str) -> str:
     return dst
 
 
-def copy_local_path_from_hdfs(src: str, cache_dir=None, filelock='.file.lock', verbose=False) -> str:
+def copy_local_path_from_hdfs(src: str,
+                              cache_dir=None,
+                              filelock='.file.lock',
+                              verbose=False,
+                              max_cache_bytes: Optional[int] = None,
+                              revalidate: bool = True) -> str:
     """Copy src from hdfs to local if src is on hdfs or directly return src.
     If cache_dir is None, we will use the default cache dir of the system. Note that this may cause conflicts if
     the src name is the same between calls
 
+    The copies are kept in a managed cache under cache_dir:
+
+    - every copy records the size and modification time of the files of src and of the local copy. A copy is reused
+      if the local files are unchanged and, with ``revalidate``, if src is unchanged (a single ``ls`` of src).
+      When src cannot be listed (e.g. hdfs is unreachable), a valid local copy is reused.
+    - identical files (same md5) of different copies are hard links to one file under ``cache_dir/.objects``, so
+      the cached files must not be modified in place.
+    - with ``max_cache_bytes`` (default: the ``VERL_CACHE_MAX_GB`` environment variable, unbounded if unset), the
+      least recently used copies are removed once the cache is larger. A copy is not removed while another process
+      holds its lock (i.e. is copying or validating it), nor is the copy just returned.
+
     Args:
         src (str): a HDFS path of a local path
+        max_cache_bytes (int): size budget of cache_dir
+        revalidate (bool): check that src did not change since it was copied
 
     Returns:
         a local path of the copied file
@@ -75,14 +97,159 @@ def copy_local_path_from_hdfs(src: str, cache_dir=None, filelock='.file.lock', v
         os.makedirs(cache_dir, exist_ok=True)
         assert os.path.exists(cache_dir)
         local_path = get_local_temp_path(src, cache_dir)
+        entry_dir = os.path.dirname(local_path)
         # get a specific lock
         filelock = md5_encode(src) + '.lock'
         lock_file = os.path.join(cache_dir, filelock)
         with FileLock(lock_file=lock_file):
-            if not os.path.exists(local_path):
+            entry = _read_cache_entry(entry_dir)
+            local_valid = entry is not None and bool(entry['local']) and _stat_local(local_path) == entry['local']
+            source = stat_files(src) if revalidate or not local_valid else entry['source']
+            if not (local_valid and (entry['source'] == source or not source)):
                 if verbose:
                     print(f'Copy from {src} to {local_path}')
+                if os.path.isfile(local_path):
+                    # the file may be hard linked to other copies, do not overwrite it in place
+                    os.remove(local_path)
                 copy(src, local_path)
+                with FileLock(lock_file=os.path.join(cache_dir, _CACHE_LOCK)):
+                    _link_identical_files(cache_dir, local_path)
+                entry = {'src': src, 'source': source, 'local': _stat_local(local_path)}
+            entry['last_used'] = time.time()
+            _write_cache_entry(entry_dir, entry)
+
+        if max_cache_bytes is None and os.environ.get('VERL_CACHE_MAX_GB'):
+            max_cache_bytes = int(float(os.environ['VERL_CACHE_MAX_GB']) * 1024**3)
+        if max_cache_bytes is not None:
+            evict_cache(cache_dir, max_cache_bytes, keep=[entry_dir])
         return local_path
     else:
         return src
+
+
+_CACHE_ENTRY = '.verl_cache_entry.json'
+_CACHE_OBJECTS = '.objects'
+_CACHE_LOCK = '.cache.lock'
+
+
+def _read_cache_entry(entry_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(entry_dir, _CACHE_ENTRY), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache_entry(entry_dir: str, entry: dict):
+    tmp_path = os.path.join(entry_dir, f'{_CACHE_ENTRY}.tmp{os.getpid()}')
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, os.path.join(entry_dir, _CACHE_ENTRY))
+
+
+def _stat_local(local_path: str) -> dict:
+    if not os.path.exists(local_path):
+        return {}
+    stats = stat_files(local_path)
+    if os.path.isdir(local_path) and os.path.exists(os.path.join(local_path, MANIFEST_NAME)):
+        # the manifest is written last by copy_tree, a directory without it is an interrupted copy
+        stats[MANIFEST_NAME] = os.path.getsize(os.path.join(local_path, MANIFEST_NAME))
+    return stats
+
+
+def _file_md5(path: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _link_identical_files(cache_dir: str, local_path: str):
+    """Replace the files of local_path by hard links to the objects with the same md5, or add them as objects"""
+    objects_dir = os.path.join(cache_dir, _CACHE_OBJECTS)
+    os.makedirs(objects_dir, exist_ok=True)
+    manifest = {}
+    if os.path.isdir(local_path):
+        try:
+            with open(os.path.join(local_path, MANIFEST_NAME), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        root = local_path
+    else:
+        root = os.path.dirname(local_path)
+
+    for name in stat_files(local_path):
+        path = os.path.join(root, name)
+        md5 = manifest.get(name, {}).get('md5') or _file_md5(path)
+        object_path = os.path.join(objects_dir, md5)
+        try:
+            if not os.path.exists(object_path):
+                os.link(path, object_path)
+            elif not os.path.samefile(path, object_path) and os.path.getsize(path) == os.path.getsize(object_path):
+                tmp_path = f'{path}.link{os.getpid()}'
+                os.link(object_path, tmp_path)
+                os.replace(tmp_path, path)
+        except OSError:
+            # e.g. hard links are not supported by the file system, keep the copy
+            pass
+
+
+def _cache_size(cache_dir: str) -> int:
+    """Bytes used by the copies and objects of the cache, counting hard linked files once"""
+    inodes = {}
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name != _CACHE_OBJECTS and not os.path.exists(os.path.join(path, _CACHE_ENTRY)):
+            continue
+        for root, _, files in os.walk(path):
+            for file_name in files:
+                try:
+                    stat = os.stat(os.path.join(root, file_name))
+                except OSError:
+                    continue
+                inodes[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(inodes.values())
+
+
+def evict_cache(cache_dir: str, max_bytes: int, keep=()) -> int:
+    """Remove the least recently used copies of copy_local_path_from_hdfs until cache_dir is under ``max_bytes``.
+
+    The copies in ``keep`` and the ones locked by another process are not removed.
+
+    Returns:
+        the number of bytes freed
+    """
+    from filelock import FileLock, Timeout
+
+    with FileLock(lock_file=os.path.join(cache_dir, _CACHE_LOCK)):
+        size = _cache_size(cache_dir)
+        initial_size = size
+        if size <= max_bytes:
+            return 0
+        entries = []
+        for name in os.listdir(cache_dir):
+            entry_dir = os.path.join(cache_dir, name)
+            entry = _read_cache_entry(entry_dir) if os.path.isdir(entry_dir) else None
+            if entry is not None and entry_dir not in keep:
+                entries.append((entry.get('last_used', 0), entry_dir, entry))
+        entries.sort(key=lambda item: item[0])
+
+        objects_dir = os.path.join(cache_dir, _CACHE_OBJECTS)
+        for _, entry_dir, entry in entries:
+            try:
+                with FileLock(lock_file=os.path.join(cache_dir, md5_encode(entry['src']) + '.lock'), timeout=0):
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+            except Timeout:
+                continue
+            # the objects only linked from the cache store are no longer used
+            if os.path.isdir(objects_dir):
+                for name in os.listdir(objects_dir):
+                    object_path = os.path.join(objects_dir, name)
+                    if os.stat(object_path).st_nlink == 1:
+                        os.remove(object_path)
+            size = _cache_size(cache_dir)
+            if size <= max_bytes:
+                break
+    return initial_size - size
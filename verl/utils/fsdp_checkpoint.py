@@ -0,0 +1,163 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Sharded FSDP checkpoints: every rank writes its own shard of the model, optimizer and lr scheduler states
+"""
+
+import os
+import random
+import threading
+from typing import Optional
+
+import numpy as np
+import torch
+import torch.distributed
+from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType
+from torch.distributed.fsdp import ShardedStateDictConfig
+
+import verl.utils.hdfs_io as hdfs_io
+
+
+def shard_file_name(rank: int, world_size: int) -> str:
+    return f'shard_world_size_{world_size}_rank_{rank}.pt'
+
+
+def _done_file_name(rank: int, world_size: int) -> str:
+    return f'shard_world_size_{world_size}_rank_{rank}.done'
+
+
+def is_complete_checkpoint(local_path: str, world_size: int) -> bool:
+    """Whether every rank finished writing its shard to ``local_path``"""
+    return all(os.path.exists(os.path.join(local_path, _done_file_name(rank, world_size))) for rank in range(world_size))
+
+
+def upload_files(local_path: str, hdfs_path: str):
+    """Copy the files of ``local_path`` other than the shards (e.g. the model config and tokenizer, or the trainer
+    state) to ``hdfs_path``, the shards are uploaded by ``ShardedCheckpointer``"""
+    hdfs_io.makedirs(hdfs_path, exist_ok=True)
+    for name in os.listdir(local_path):
+        path = os.path.join(local_path, name)
+        if os.path.isfile(path) and not name.startswith('shard_world_size_'):
+            hdfs_io.copy(src=path, dst=os.path.join(hdfs_path, name))
+
+
+def copy_to_cpu(obj):
+    """Copy the tensors of a (nested) state dict to cpu, so that training can go on while they are written.
+
+    Tensors already on cpu are copied too, e.g. an offloaded optimizer state is updated in place by the next step.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: copy_to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(copy_to_cpu(value) for value in obj)
+    return obj
+
+
+def get_rng_state() -> dict:
+    state = {'cpu': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state()
+    return state
+
+
+def set_rng_state(state: dict):
+    torch.set_rng_state(state['cpu'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state['cuda'])
+
+
+class ShardedCheckpointer:
+    """Saves and loads the local shards of an FSDP module with its optimizer and lr scheduler.
+
+    The shards are taken with ``SHARDED_STATE_DICT`` and copied to host memory, then written by a background
+    thread (with ``async_save``) so that the ranks write in parallel while training goes on. A ``.done`` marker is
+    written per rank after its shard, a checkpoint is complete once all the markers exist. Only one save is in
+    flight, the next save (or load) waits for it.
+
+    The optimizer state is the raw ``optimizer.state_dict()`` of the rank, i.e. the state of its shard of the FSDP
+    flat parameters (not ``FSDP.optim_state_dict``). Like the model shards, loading it requires the same world size
+    and FSDP wrapping as saving.
+    """
+
+    def __init__(self, rank: int, world_size: int, async_save: bool = True):
+        self.rank = rank
+        self.world_size = world_size
+        self.async_save = async_save
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def wait(self):
+        """Block until the pending save is written, re-raising its error"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('saving the sharded checkpoint failed') from error
+
+    def save(self, local_path: str, module: FSDP, optimizer=None, lr_scheduler=None, hdfs_path: str = None):
+        self.wait()
+        with FSDP.state_dict_type(module, StateDictType.SHARDED_STATE_DICT,
+                                  ShardedStateDictConfig(offload_to_cpu=True)):
+            model_state = module.state_dict()
+        state = {
+            'model': model_state,
+            'optimizer': copy_to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+            'lr_scheduler': lr_scheduler.state_dict() if lr_scheduler is not None else None,
+            'rng': get_rng_state(),
+        }
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+        os.makedirs(local_path, exist_ok=True)
+        if self.async_save:
+            self._thread = threading.Thread(target=self._write, args=(local_path, state, hdfs_path), daemon=True)
+            self._thread.start()
+        else:
+            self._write(local_path, state, hdfs_path)
+            self.wait()
+
+    def _write(self, local_path: str, state: dict, hdfs_path: str = None):
+        try:
+            shard_path = os.path.join(local_path, shard_file_name(self.rank, self.world_size))
+            torch.save(state, shard_path)
+            done_path = os.path.join(local_path, _done_file_name(self.rank, self.world_size))
+            with open(done_path, 'w'):
+                pass
+            if hdfs_path is not None:
+                hdfs_io.makedirs(hdfs_path, exist_ok=True)
+                hdfs_io.copy(src=shard_path, dst=hdfs_path)
+                hdfs_io.copy(src=done_path, dst=hdfs_path)
+        except BaseException as e:
+            self._error = e
+
+    def load(self, local_path: str, module: FSDP, optimizer=None, lr_scheduler=None):
+        self.wait()
+        assert is_complete_checkpoint(local_path, self.world_size), \
+            f'{local_path} is not a complete sharded checkpoint for world size {self.world_size}'
+        state = torch.load(os.path.join(local_path, shard_file_name(self.rank, self.world_size)),
+                           map_location='cpu',
+                           weights_only=False)
+        with FSDP.state_dict_type(module, StateDictType.SHARDED_STATE_DICT,
+                                  ShardedStateDictConfig(offload_to_cpu=True)):
+            module.load_state_dict(state['model'])
+        if optimizer is not None and state['optimizer'] is not None:
+            optimizer.load_state_dict(state['optimizer'])
+        if lr_scheduler is not None and state['lr_scheduler'] is not None:
+            lr_scheduler.load_state_dict(state['lr_scheduler'])
+        set_rng_state(state['rng'])
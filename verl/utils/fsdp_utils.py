@@ -20,7 +20,6 @@ import itertools
 import os
 from contextlib import contextmanager
 from torch.distributed.fsdp.wrap import size_based_auto_wrap_policy, transformer_auto_wrap_policy
-from transformers.trainer_pt_utils import get_module_class_from_name
 import torch
 import torch.nn as nn
 import torch.distributed as dist
@@ -85,6 +84,7 @@ def get_fsdp_wrap_policy(module, config=None, is_lora=False):
         size_policy = functools.partial(size_based_auto_wrap_policy, min_num_params=min_num_params)
         policies.append(size_policy)
     elif fsdp_transformer_layer_cls_to_wrap is not None:
+        from transformers.trainer_pt_utils import get_module_class_from_name
         transformer_cls_to_wrap = set()
         for layer_class in fsdp_transformer_layer_cls_to_wrap:
             transformer_cls = get_module_class_from_name(module, layer_class)
@@ -13,8 +13,15 @@
 # limitations under the License.
 
 import os
+import json
+import time
 import shutil
+import hashlib
 import logging
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
 logger = logging.getLogger(__file__)
 logger.setLevel(os.getenv('VERL_SFT_LOGGING_LEVEL', 'WARN'))
@@ -89,25 +96,30 @@ def copy(src: str, dst: str, **kwargs) -> bool:
     If source and destination are the same file, a SameFileError will be
     raised.
 
+    Directories are copied by ``copy_tree``: the content of src is merged into dst, in parallel, skipping the files
+    that are unchanged since the last copy.
+
     Arg:
         src (str): source file path
         dst (str): destination file path
-        kwargs: keyword arguments for hdfs copy
+        kwargs: keyword arguments for hdfs copy, or for ``copy_tree`` when src is a directory
 
     Returns:
         str: destination file path
 
     """
+    if _isdir(src):
+        # directory copies always merge into dst
+        kwargs.pop('dirs_exist_ok', None)
+        copy_tree(src, dst, **kwargs)
+        return dst
     if _is_non_local(src) or _is_non_local(dst):
         # TODO(haibin.lin):
         # - handle SameFileError for hdfs files(?)
         # - return file destination for hdfs files
-        return _copy(src, dst)
+        return _copy(src, dst, **kwargs)
     else:
-        if os.path.isdir(src):
-            return shutil.copytree(src, dst, **kwargs)
-        else:
-            return shutil.copy(src, dst, **kwargs)
+        return shutil.copy(src, dst, **kwargs)
 
 
 def _copy(from_path: str, to_path: str, timeout: int = None) -> bool:
@@ -118,8 +130,7 @@ def _copy(from_path: str, to_path: str, timeout: int = None) -> bool:
             returncode = _run_cmd(_hdfs_cmd(f"-put -f {from_path} {to_path}"), timeout=timeout)
     else:
         if from_path.startswith("hdfs"):
-            returncode = _run_cmd(_hdfs_cmd(f"-get \
-                {from_path} {to_path}"), timeout=timeout)
+            returncode = _run_cmd(_hdfs_cmd(f"-get -f {from_path} {to_path}"), timeout=timeout)
         else:
             try:
                 shutil.copy(from_path, to_path)
@@ -132,8 +143,209 @@ def _copy(from_path: str, to_path: str, timeout: int = None) -> bool:
     return returncode == 0
 
 
+MANIFEST_NAME = '.verl_manifest.json'
+
+
+def copy_tree(src: str,
+              dst: str,
+              num_workers: int = 8,
+              retries: int = 3,
+              timeout: int = None,
+              verify: bool = True,
+              skip_unchanged: bool = True) -> Dict[str, int]:
+    r"""Copy the files of the directory src into dst with a pool of ``num_workers`` threads. Supports hdfs.
+
+    A manifest with the size and md5 of every file is written to dst (``MANIFEST_NAME``). On a later copy, the files
+    whose entry in the dst manifest matches the source are skipped. The md5 of a local source is computed, the one
+    of a remote source is read from its manifest when it has one (e.g. it was uploaded by copy_tree).
+
+    Every file is copied to a temporary name then renamed, and retried ``retries`` times on failure. With ``verify``,
+    a copied file must have the size of the source and, when both are known and dst is local, the same md5.
+
+    Args:
+        src (str): source directory
+        dst (str): destination directory, created if needed
+        num_workers (int): number of files copied concurrently
+        retries (int): attempts per file
+        timeout (int): seconds per hdfs command
+        verify (bool): check the copied files
+        skip_unchanged (bool): do not copy the files already in dst with the same content
+
+    Returns:
+        dict: the number of copied and skipped files and the copied bytes
+    """
+    src_sizes = _list_files(src, timeout=timeout)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        if not _is_non_local(src):
+            md5s = executor.map(lambda path: _md5(os.path.join(src, path)), src_sizes)
+            src_manifest = {path: {'size': size, 'md5': md5} for (path, size), md5 in zip(src_sizes.items(), md5s)}
+        else:
+            remote_manifest = _read_manifest(src, timeout=timeout)
+            src_manifest = {path: {'size': size, 'md5': remote_manifest.get(path, {}).get('md5')}
+                            for path, size in src_sizes.items()}
+
+        dst_manifest = _read_manifest(dst, timeout=timeout) if skip_unchanged else {}
+        dst_sizes = _list_files(dst, timeout=timeout) if skip_unchanged and dst_manifest else {}
+        to_copy = [
+            path for path, entry in src_manifest.items()
+            if not (entry['md5'] is not None and dst_manifest.get(path) == entry and dst_sizes.get(path) == entry['size'])
+        ]
+
+        _makedirs_for(dst, to_copy, timeout=timeout)
+        list(
+            executor.map(lambda path: _copy_file_with_retries(os.path.join(src, path), os.path.join(dst, path),
+                                                              src_manifest[path], retries, timeout, verify), to_copy))
+
+    _write_manifest(dst, src_manifest, timeout=timeout)
+    return {
+        'copied': len(to_copy),
+        'skipped': len(src_manifest) - len(to_copy),
+        'copied_bytes': sum(src_manifest[path]['size'] for path in to_copy),
+    }
+
+
+def _copy_file_with_retries(src: str, dst: str, entry: dict, retries: int, timeout: Optional[int], verify: bool):
+    tmp_dst = f'{dst}.tmp{os.getpid()}'
+    for attempt in range(retries):
+        if _copy(src, tmp_dst, timeout=timeout) and (not verify or _verify(tmp_dst, entry, timeout)) \
+                and _rename(tmp_dst, dst, timeout=timeout):
+            return
+        logger.warning(f'copy {src} to {dst} failed (attempt {attempt + 1}/{retries})')
+        _remove(tmp_dst, timeout=timeout)
+        time.sleep(min(2**attempt, 30))
+    raise IOError(f'failed to copy {src} to {dst} after {retries} attempts')
+
+
+def _verify(path: str, entry: dict, timeout: Optional[int]) -> bool:
+    if _is_non_local(path):
+        return _hdfs_file_size(path, timeout=timeout) == entry['size']
+    if os.path.getsize(path) != entry['size']:
+        return False
+    return entry['md5'] is None or _md5(path) == entry['md5']
+
+
+def _md5(path: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _isdir(path: str) -> bool:
+    if _is_non_local(path):
+        return _run_cmd(_hdfs_cmd(f"-test -d {path}")) == 0
+    return os.path.isdir(path)
+
+
+def stat_files(path: str, timeout: Optional[int] = None) -> Dict[str, list]:
+    """Relative path -> [size, modification time] of the files under the directory path, without the manifest.
+    A file path gives its own basename. Returns an empty dict when path does not exist.
+
+    The modification time is in ns for a local path and is the "date time" string of ``hdfs dfs -ls`` otherwise,
+    it is only meant to be compared with the one of a previous call.
+    """
+    stats = {}
+    if _is_non_local(path):
+        returncode, output = _run_cmd_output(_hdfs_cmd(f"-ls -R {path}"), timeout=timeout)
+        if returncode != 0:
+            return stats
+        path = path.rstrip('/')
+        for line in output.splitlines():
+            fields = line.split(None, 7)
+            # -rw-r--r--   3 user group   1234 2024-01-01 00:00 hdfs://.../file
+            if len(fields) != 8 or not fields[0].startswith('-'):
+                continue
+            if fields[7] == path:
+                stats[os.path.basename(path)] = [int(fields[4]), f'{fields[5]} {fields[6]}']
+            elif fields[7].startswith(path + '/'):
+                stats[fields[7][len(path) + 1:]] = [int(fields[4]), f'{fields[5]} {fields[6]}']
+    elif os.path.isfile(path):
+        stat = os.stat(path)
+        stats[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    elif os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in files:
+                stat = os.stat(os.path.join(root, name))
+                stats[os.path.relpath(os.path.join(root, name), path)] = [stat.st_size, stat.st_mtime_ns]
+    stats.pop(MANIFEST_NAME, None)
+    return stats
+
+
+def _list_files(path: str, timeout: Optional[int] = None) -> Dict[str, int]:
+    """Relative path -> size of the files under the directory path, without the manifest"""
+    return {name: stat[0] for name, stat in stat_files(path, timeout=timeout).items()}
+
+
+def _hdfs_file_size(path: str, timeout: Optional[int] = None) -> int:
+    returncode, output = _run_cmd_output(_hdfs_cmd(f"-stat %b {path}"), timeout=timeout)
+    return int(output.strip()) if returncode == 0 else -1
+
+
+def _read_manifest(path: str, timeout: Optional[int] = None) -> dict:
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    try:
+        if _is_non_local(path):
+            returncode, output = _run_cmd_output(_hdfs_cmd(f"-cat {manifest_path}"), timeout=timeout)
+            return json.loads(output) if returncode == 0 else {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+    except ValueError:
+        logger.warning(f'ignoring the unreadable manifest {manifest_path}')
+    return {}
+
+
+def _write_manifest(path: str, manifest: dict, timeout: Optional[int] = None):
+    # keep the entries of the files of dst that did not come from src
+    manifest = {**_read_manifest(path, timeout=timeout), **manifest}
+    if not _is_non_local(path):
+        with open(os.path.join(path, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_manifest = os.path.join(tmp_dir, MANIFEST_NAME)
+        with open(local_manifest, 'w') as f:
+            json.dump(manifest, f)
+        _copy(local_manifest, os.path.join(path, MANIFEST_NAME), timeout=timeout)
+
+
+def _makedirs_for(dst: str, paths, timeout: Optional[int] = None):
+    dirs = sorted({os.path.dirname(os.path.join(dst, path)) for path in paths} | {dst})
+    if _is_non_local(dst):
+        # a single command for all the directories
+        _run_cmd(_hdfs_cmd(f"-mkdir -p {' '.join(dirs)}"), timeout=timeout)
+    else:
+        for directory in dirs:
+            os.makedirs(directory, exist_ok=True)
+
+
+def _rename(src: str, dst: str, timeout: Optional[int] = None) -> bool:
+    if _is_non_local(dst):
+        _run_cmd(_hdfs_cmd(f"-rm -f {dst}"), timeout=timeout)
+        return _run_cmd(_hdfs_cmd(f"-mv {src} {dst}"), timeout=timeout) == 0
+    os.replace(src, dst)
+    return True
+
+
+def _remove(path: str, timeout: Optional[int] = None):
+    if _is_non_local(path):
+        _run_cmd(_hdfs_cmd(f"-rm -f {path}"), timeout=timeout)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
 def _run_cmd(cmd: str, timeout=None):
-    return os.system(cmd)
+    return _run_cmd_output(cmd, timeout=timeout)[0]
+
+
+def _run_cmd_output(cmd: str, timeout=None):
+    try:
+        result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"{cmd} timed out after {timeout}s")
+        return -1, ''
+    return result.returncode, result.stdout
 
 
 def _hdfs_cmd(cmd: str) -> str:
@@ -16,26 +16,25 @@ Utilities to check if packages are available.
 We assume package availability won't change during runtime.
 """
 
+import importlib.util
 from functools import cache
 from typing import List
 
 
+# the checks look the packages up without importing them, importing vllm or megatron takes seconds
+
+
 @cache
 def is_megatron_core_available():
     try:
-        from megatron.core import parallel_state as mpu
-        return True
+        return importlib.util.find_spec('megatron.core') is not None
     except ImportError:
         return False
 
 
 @cache
 def is_vllm_available():
-    try:
-        import vllm
-        return True
-    except ImportError:
-        return False
+    return importlib.util.find_spec('vllm') is not None
 
 
 def import_external_libs(external_libs=None):
@@ -0,0 +1,141 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Tune the number of tokens per micro batch from the observed peak memory
+"""
+
+from contextlib import contextmanager
+from typing import Callable, List
+
+import torch
+import torch.distributed
+
+
+class TokenBudgetTuner:
+    """Learns a tokens-per-micro-batch budget from the peak memory of the micro batches already run.
+
+    Every measured micro batch gives the activation bytes per token, i.e. (peak - allocated before) / tokens.
+    Once per step, the budget is set so that the memory allocated before the micro batch plus
+    ``budget * bytes_per_token`` stays under ``memory_fraction`` of the device memory. The budget grows by at most
+    ``max_growth`` per step, and is multiplied by ``backoff`` after an OOM.
+    Without cuda the budget keeps its initial value.
+    """
+
+    def __init__(self,
+                 init_tokens: int,
+                 min_tokens: int = 1024,
+                 max_tokens: int = None,
+                 memory_fraction: float = 0.9,
+                 max_growth: float = 1.5,
+                 backoff: float = 0.5,
+                 ema_decay: float = 0.5):
+        self.budget = int(init_tokens)
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.memory_fraction = memory_fraction
+        self.max_growth = max_growth
+        self.backoff_factor = backoff
+        self.ema_decay = ema_decay
+
+        self.bytes_per_token = None
+        self.num_ooms = 0
+        self._step_bytes_per_token = None
+        self._step_base_bytes = 0
+
+    def _clip(self, budget: float) -> int:
+        budget = max(int(budget), self.min_tokens)
+        if self.max_tokens is not None:
+            budget = min(budget, self.max_tokens)
+        return budget
+
+    def get_budget(self, min_tokens: int = 0) -> int:
+        """The budget, at least ``min_tokens`` (e.g. the padded sequence length, as one sequence cannot be split)."""
+        return max(self.budget, min_tokens)
+
+    @contextmanager
+    def measure(self, num_tokens: int):
+        if not torch.cuda.is_available() or num_tokens == 0:
+            yield
+            return
+        torch.cuda.reset_peak_memory_stats()
+        base_bytes = torch.cuda.memory_allocated()
+        yield
+        peak_bytes = torch.cuda.max_memory_allocated()
+        self.observe(num_tokens, base_bytes, peak_bytes)
+
+    def observe(self, num_tokens: int, base_bytes: int, peak_bytes: int):
+        bytes_per_token = max(peak_bytes - base_bytes, 1) / num_tokens
+        # keep the worst micro batch of the step, long sequences cost more per token
+        if self._step_bytes_per_token is None or bytes_per_token > self._step_bytes_per_token:
+            self._step_bytes_per_token = bytes_per_token
+        self._step_base_bytes = max(self._step_base_bytes, base_bytes)
+
+    def step(self) -> int:
+        """Update the budget from the micro batches measured since the last call."""
+        if self._step_bytes_per_token is None:
+            return self.budget
+        if self.bytes_per_token is None:
+            self.bytes_per_token = self._step_bytes_per_token
+        else:
+            self.bytes_per_token = self.ema_decay * self.bytes_per_token + (1 - self.ema_decay) * self._step_bytes_per_token
+
+        total_bytes = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        available_bytes = self.memory_fraction * total_bytes - self._step_base_bytes
+        target = available_bytes / self.bytes_per_token
+        self.budget = self._clip(min(target, self.budget * self.max_growth))
+
+        self._step_bytes_per_token = None
+        self._step_base_bytes = 0
+        return self.budget
+
+    def backoff(self):
+        self.num_ooms += 1
+        self.budget = self._clip(self.budget * self.backoff_factor)
+
+    def metrics(self, prefix: str) -> dict:
+        metrics = {f'{prefix}/token_budget': self.budget, f'{prefix}/num_ooms': self.num_ooms}
+        if self.bytes_per_token is not None:
+            metrics[f'{prefix}/kb_per_token'] = self.bytes_per_token / 1024
+        return metrics
+
+
+def _can_resplit() -> bool:
+    # with several ranks, the other ranks are blocked in the collectives of the failed forward/backward,
+    # re-running a part of the micro batch on this rank only would pair up mismatched collectives
+    return not torch.distributed.is_initialized() or torch.distributed.get_world_size() == 1
+
+
+def run_micro_batch(fn: Callable, micro_batch, tuner: TokenBudgetTuner = None, weight: float = 1.0) -> List:
+    """Run ``fn(micro_batch, weight)`` and return its outputs as a list.
+
+    With a tuner, the peak memory of the micro batch is measured. On OOM the budget is backed off and, in a single
+    process, the micro batch is split in two halves that are run one after the other, each with its share of
+    ``weight`` (to scale the loss). An OOM in the middle of backward may leave partially accumulated gradients.
+    """
+    if tuner is None:
+        return [fn(micro_batch, weight)]
+    try:
+        with tuner.measure(int(micro_batch['attention_mask'].sum())):
+            return [fn(micro_batch, weight)]
+    except torch.cuda.OutOfMemoryError:
+        tuner.backoff()
+        batch_size = micro_batch.batch_size[0]
+        if batch_size == 1 or not _can_resplit():
+            raise
+        torch.cuda.empty_cache()
+        half = (batch_size + 1) // 2
+        print(f'OOM on a micro batch of {batch_size} sequences, retrying as {half} + {batch_size - half}, '
+              f'token budget is now {tuner.budget}')
+        return (run_micro_batch(fn, micro_batch[:half], tuner, weight * half / batch_size) +
+                run_micro_batch(fn, micro_batch[half:], tuner, weight * (batch_size - half) / batch_size))
@@ -11,3 +11,39 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+
+from . import countdown, gsm8k, math, multiply, qa_em, word_guessing
+
+# data_source -> compute_score(solution_str, ground_truth)
+_SCORE_FNS = {
+    'gen': word_guessing.compute_score,
+    'word_guessing': word_guessing.compute_score,
+    'countdown': countdown.compute_score,
+    'multiply': multiply.compute_score,
+    'openai/gsm8k': gsm8k.compute_score,
+    'lighteval/MATH': math.compute_score,
+}
+for _qa_source in ['nq', 'triviaqa', 'popqa', 'hotpotqa', '2wikimultihopqa', 'musique', 'bamboogle']:
+    _SCORE_FNS[_qa_source] = qa_em.compute_score_em
+
+# data_source -> turns_fn(solution_str, ground_truth), the number of turns needed to solve the task or None
+_TURNS_FNS = {
+    'gen': word_guessing.count_turns,
+    'word_guessing': word_guessing.count_turns,
+}
+
+
+def register_score_fn(data_source, score_fn, turns_fn=None):
+    _SCORE_FNS[data_source] = score_fn
+    if turns_fn is not None:
+        _TURNS_FNS[data_source] = turns_fn
+
+
+def select_score_fn(data_source):
+    if data_source not in _SCORE_FNS:
+        raise NotImplementedError(f'no score function registered for data_source {data_source}')
+    return _SCORE_FNS[data_source]
+
+
+def select_turns_fn(data_source):
+    return _TURNS_FNS.get(data_source, None)
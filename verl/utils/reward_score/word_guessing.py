@@ -1,6 +1,6 @@
 import re
 
-def compute_score(solution_str, ground_truth, method='strict', format_score=0.1, score=1.):
+def extract_queries(solution_str):
     
     # 删去solution_str中所有<response> </response>标签内的内容（包括标签）
 
@@ -12,9 +12,22 @@ def compute_score(solution_str, ground_truth, method='strict', format_score=0.1,
     # 用正则表达式提取出所有<query>标签中的内容</query>
     solution_str = re.findall(r'<query>(.*?)</query>', solution_str, re.DOTALL)
 
-    solution_str = [s.upper() for s in solution_str]
+    return [s.upper() for s in solution_str]
+
+
+def compute_score(solution_str, ground_truth, method='strict', format_score=0.1, score=1.):
+
+    solution_str = extract_queries(solution_str)
 
     if ground_truth['target'] in solution_str:
         return 1
         # return len(solution_str) * (-0.01) + 1
-    return 0
\ No newline at end of file
+    return 0
+
+
+def count_turns(solution_str, ground_truth):
+    """Number of queries up to and including the first correct guess, None if the word was not found."""
+    queries = extract_queries(solution_str)
+    if ground_truth['target'] in queries:
+        return queries.index(ground_truth['target']) + 1
+    return None
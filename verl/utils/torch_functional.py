@@ -83,6 +83,70 @@ def logprobs_of_labels_v2(logits: torch.FloatTensor, labels):
     return logprobs_labels.squeeze(-1)
 
 
+class _ChunkedLogprobEntropy(torch.autograd.Function):
+    """Label log-prob and entropy of (num_tokens, vocab_size) logits, computed over blocks of ``chunk_size`` tokens.
+
+    Only the per-token logsumexp and entropy are saved for backward; the probabilities of a block are
+    recomputed from the logits in backward, so no full (num_tokens, vocab_size) softmax is ever kept.
+    """
+
+    @staticmethod
+    def forward(ctx, logits: torch.Tensor, labels: torch.Tensor, chunk_size: int):
+        num_tokens = logits.shape[0]
+        logsumexp = torch.empty(num_tokens, dtype=torch.float32, device=logits.device)
+        log_probs = torch.empty(num_tokens, dtype=torch.float32, device=logits.device)
+        entropy = torch.empty(num_tokens, dtype=torch.float32, device=logits.device)
+        for start in range(0, num_tokens, chunk_size):
+            end = min(start + chunk_size, num_tokens)
+            chunk = logits[start:end].float()
+            chunk_logsumexp = torch.logsumexp(chunk, dim=-1)
+            logsumexp[start:end] = chunk_logsumexp
+            log_probs[start:end] = gather_from_labels(chunk, labels[start:end]) - chunk_logsumexp
+            probs = torch.exp(chunk - chunk_logsumexp.unsqueeze(-1))
+            entropy[start:end] = chunk_logsumexp - torch.sum(probs * chunk, dim=-1)
+        ctx.save_for_backward(logits, labels, logsumexp, entropy)
+        ctx.chunk_size = chunk_size
+        return log_probs, entropy
+
+    @staticmethod
+    def backward(ctx, grad_log_probs, grad_entropy):
+        logits, labels, logsumexp, entropy = ctx.saved_tensors
+        chunk_size = ctx.chunk_size
+        grad_logits = torch.empty_like(logits)
+        for start in range(0, logits.shape[0], chunk_size):
+            end = min(start + chunk_size, logits.shape[0])
+            logp = logits[start:end].float() - logsumexp[start:end].unsqueeze(-1)
+            probs = torch.exp(logp)
+            # d logp_y / dx = onehot(y) - p ; d H / dx = -p * (logp + H)
+            grad = torch.zeros_like(probs)
+            if grad_log_probs is not None:
+                grad_lp = grad_log_probs[start:end].float().unsqueeze(-1)
+                grad -= probs * grad_lp
+                grad.scatter_add_(-1, labels[start:end].unsqueeze(-1), grad_lp)
+            if grad_entropy is not None:
+                grad_ent = grad_entropy[start:end].float().unsqueeze(-1)
+                grad -= probs * (logp + entropy[start:end].unsqueeze(-1)) * grad_ent
+            grad_logits[start:end] = grad.to(logits.dtype)
+        return grad_logits, None, None
+
+
+def logprobs_and_entropy_from_logits_chunked(logits: torch.Tensor, labels: torch.Tensor, chunk_size: int = 1024):
+    """Memory efficient ``(logprobs_from_logits(logits, labels), entropy_from_logits(logits))``.
+
+    Args:
+        logits: (..., vocab_size)
+        labels: (...,)
+        chunk_size: number of tokens whose softmax is materialized at a time
+
+    Returns:
+        log_probs, entropy: (...,) in float32
+    """
+    batch_dim = logits.shape[:-1]
+    log_probs, entropy = _ChunkedLogprobEntropy.apply(logits.reshape(-1, logits.shape[-1]), labels.reshape(-1),
+                                                       chunk_size)
+    return log_probs.view(*batch_dim), entropy.view(*batch_dim)
+
+
 def clip_by_value(x, tensor_min, tensor_max):
     """
     Tensor extenstion to torch.clamp
@@ -14,7 +14,12 @@
 """
 A unified tracking interface that supports logging data to different backend
 """
+import atexit
 import dataclasses
+import json
+import os
+import queue
+import threading
 from enum import Enum
 from functools import partial
 from pathlib import Path
@@ -22,9 +27,25 @@ from typing import List, Union, Dict, Any
 
 
 class Tracking(object):
-    supported_backend = ['wandb', 'mlflow', 'console']
-
-    def __init__(self, project_name, experiment_name, default_backend: Union[str, List[str]] = 'console', config=None):
+    """Logs the metrics of a step to every backend.
+
+    With ``async_logging``, ``log`` only puts a copy of the metrics in a queue of ``queue_size`` steps, and a
+    background thread calls the backends, so that a slow backend (e.g. wandb or mlflow over the network) does not
+    stall the training loop. ``log`` blocks only when the queue is full. The queue is flushed by ``flush``, ``finish``
+    and at exit. Tensor values are converted to python numbers by the logging thread.
+
+    The ``jsonl`` backend appends one json line per step to ``{log_dir}/metrics.jsonl`` for offline runs.
+    """
+    supported_backend = ['wandb', 'mlflow', 'console', 'jsonl']
+
+    def __init__(self,
+                 project_name,
+                 experiment_name,
+                 default_backend: Union[str, List[str]] = 'console',
+                 config=None,
+                 async_logging: bool = False,
+                 queue_size: int = 64,
+                 log_dir: str = None):
         if isinstance(default_backend, str):
             default_backend = [default_backend]
         for backend in default_backend:
@@ -38,7 +59,6 @@ class Tracking(object):
 
         if 'tracking' in default_backend or 'wandb' in default_backend:
             import wandb
-            import os
             WANDB_API_KEY = os.environ.get("WANDB_API_KEY", None)
             if WANDB_API_KEY:
                 wandb.login(key=WANDB_API_KEY)
@@ -56,11 +76,89 @@ class Tracking(object):
             self.console_logger = LocalLogger(print_to_console=True)
             self.logger['console'] = self.console_logger
 
+        if 'jsonl' in default_backend:
+            self.logger['jsonl'] = _JsonlLogger(os.path.join(log_dir or '.', 'metrics.jsonl'))
+
+        self._queue = None
+        self._thread = None
+        if async_logging:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._finished = False
+        atexit.register(self.finish)
+
     def log(self, data, step, backend=None):
+        if self._queue is None:
+            self._log(data, step, backend)
+        else:
+            # the caller may update its dict after logging it
+            self._queue.put((dict(data), step, backend))
+
+    def _log(self, data, step, backend=None):
         for default_backend, logger_instance in self.logger.items():
             if backend is None or default_backend in backend:
                 logger_instance.log(data=data, step=step)
 
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                data, step, backend = item
+                self._log({key: _to_python(value) for key, value in data.items()}, step, backend)
+            except Exception as e:
+                print(f'WARNING: logging the metrics of step {item[1]} failed: {e!r}')
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until the metrics logged so far are sent to every backend"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+        if 'jsonl' in self.logger:
+            self.logger['jsonl'].close()
+        if 'wandb' in self.logger:
+            self.logger['wandb'].finish()
+        if 'mlflow' in self.logger:
+            import mlflow
+            mlflow.end_run()
+
+
+def _to_python(value):
+    # 0-dim tensors and numpy scalars
+    if hasattr(value, 'item') and getattr(value, 'ndim', 0) == 0:
+        return value.item()
+    return value
+
+
+class _JsonlLogger:
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a')
+
+    def log(self, data, step):
+        record = {'step': step}
+        for key, value in data.items():
+            value = _to_python(value)
+            if isinstance(value, (int, float, str, bool)) or value is None:
+                record[key] = value
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
 
 class _MlflowLoggingAdapter:
 
@@ -16,6 +16,8 @@ Single Process Actor
 """
 
 import itertools
+from collections import defaultdict
+from contextlib import contextmanager
 from typing import Iterable, Tuple
 
 import torch
@@ -25,10 +27,12 @@ from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
 from verl import DataProto
 from verl.trainer.ppo import core_algos
 from verl.workers.actor import BasePPOActor
+from verl.workers.actor.prefix_cache import PrefixCache
 from verl.utils.py_functional import append_to_dict
 from verl.utils.torch_functional import logprobs_from_logits, masked_mean
 from verl.utils.ulysses import ulysses_pad_and_slice_inputs, gather_outpus_and_unpad
 from verl.utils.seqlen_balancing import rearrange_micro_batches, get_reverse_idx
+from verl.utils.micro_batch_tuner import TokenBudgetTuner, run_micro_batch
 import verl.utils.torch_functional as verl_F
 
 from flash_attn.bert_padding import pad_input, unpad_input, rearrange, index_first_axis
@@ -52,8 +56,56 @@ class DataParallelPPOActor(BasePPOActor):
         print(f'Actor use_remove_padding={self.use_remove_padding}')
         self.ulysses_sequence_parallel_size = self.config.ulysses_sequence_parallel_size
         self.use_ulysses_sp = self.ulysses_sequence_parallel_size > 1
+        self.response_only_logits = self.config.get('response_only_logits', False)
+        if self.response_only_logits and self.use_ulysses_sp:
+            # with sp each rank only holds a slice of the hidden states, so the response positions cannot be gathered
+            print('response_only_logits is not supported with ulysses sequence parallel, disabling it')
+            self.response_only_logits = False
 
         self.compute_entropy_from_logits = torch.compile(verl_F.entropy_from_logits, dynamic=True)
+        # 0 disables the chunked implementation
+        self.logprob_chunk_size = self.config.get('logprob_chunk_size', 0)
+
+        # the prompt states of a frozen model (the reference policy) can be reused across steps and epochs
+        prefix_cache_mb = self.config.get('prefix_cache_mb', 0)
+        self.prefix_cache = None
+        if prefix_cache_mb > 0 and actor_optimizer is None and not self.use_ulysses_sp:
+            self.prefix_cache = PrefixCache(max_bytes=int(prefix_cache_mb * 1024**2))
+
+        # learn the tokens per micro batch from the observed peak memory instead of the static config values
+        self.micro_batch_autotune = self.config.get('micro_batch_autotune', False)
+        self.log_prob_tuner = None
+        self.update_tuner = None
+        if self.micro_batch_autotune and actor_optimizer is not None:
+            self.update_tuner = TokenBudgetTuner(init_tokens=self.config.ppo_max_token_len_per_gpu *
+                                                 self.ulysses_sequence_parallel_size)
+
+    def _logprobs_and_entropy(self, logits, labels, compile_entropy=True):
+        """(log_probs, entropy) of the labels, by blocks of logprob_chunk_size tokens if enabled."""
+        if self.logprob_chunk_size > 0:
+            return verl_F.logprobs_and_entropy_from_logits_chunked(logits, labels, chunk_size=self.logprob_chunk_size)
+        if compile_entropy:
+            entropy = self.compute_entropy_from_logits(logits)
+        else:
+            entropy = verl_F.entropy_from_logits(logits)
+        return logprobs_from_logits(logits=logits, labels=labels), entropy
+
+    @contextmanager
+    def _gather_before_lm_head(self, positions):
+        """Feed only ``hidden_states[:, positions]`` to the lm head, so that logits are computed for those positions only.
+
+        The prompt positions are dropped before the (seq_len, vocab_size) projection instead of after it.
+        """
+
+        def pre_hook(module, args):
+            return (args[0][:, positions],) + tuple(args[1:])
+
+        lm_head = self.actor_module.get_output_embeddings()
+        handle = lm_head.register_forward_pre_hook(pre_hook)
+        try:
+            yield
+        finally:
+            handle.remove()
 
     def _forward_micro_batch(self, micro_batch, temperature) -> Tuple[torch.Tensor, torch.Tensor]:
         """
@@ -90,6 +142,29 @@ class DataParallelPPOActor(BasePPOActor):
 
                 input_ids_rmpad_rolled = input_ids_rmpad_rolled.squeeze(0)  # ((total_nnz / sp) + pad)
 
+                if self.response_only_logits:
+                    # positions of the rmpad sequence whose next token is a response token
+                    response_mask = torch.zeros_like(attention_mask, dtype=torch.bool)
+                    response_mask[:, -response_length - 1:-1] = True
+                    keep = response_mask.flatten()[indices].nonzero().squeeze(-1)  # (num_response_tokens,)
+                    with self._gather_before_lm_head(keep):
+                        output = self.actor_module(input_ids=input_ids_rmpad,
+                                                   attention_mask=None,
+                                                   position_ids=position_ids_rmpad,
+                                                   use_cache=False)  # prevent model thinks we are generating
+                    logits_rmpad = output.logits.squeeze(0)  # (num_response_tokens, vocab_size)
+                    logits_rmpad.div_(temperature)
+                    log_probs, entropy_rmpad = self._logprobs_and_entropy(logits_rmpad, input_ids_rmpad_rolled[keep])
+
+                    # scatter back to (bsz, seqlen), the positions without a response token stay 0
+                    full_entropy = entropy_rmpad.new_zeros(batch_size * seqlen)
+                    full_log_probs = log_probs.new_zeros(batch_size * seqlen)
+                    full_entropy[indices[keep]] = entropy_rmpad
+                    full_log_probs[indices[keep]] = log_probs
+                    entropy = full_entropy.view(batch_size, seqlen)[:, -response_length - 1:-1]
+                    log_probs = full_log_probs.view(batch_size, seqlen)[:, -response_length - 1:-1]
+                    return entropy, log_probs
+
                 # only pass input_ids and position_ids to enable flash_attn_varlen
                 output = self.actor_module(input_ids=input_ids_rmpad,
                                            attention_mask=None,
@@ -99,11 +174,9 @@ class DataParallelPPOActor(BasePPOActor):
 
                 logits_rmpad.div_(temperature)
 
-                # compute entropy
-                entropy_rmpad = self.compute_entropy_from_logits(logits_rmpad)  # ((total_nnz / sp) + pad)
-
-                # if use_sp: ((total_nnz / sp) + pad) ; if not use_sp: (batch, seqlen)
-                log_probs = logprobs_from_logits(logits=logits_rmpad, labels=input_ids_rmpad_rolled)
+                # compute entropy and log_probs
+                # if use_sp: ((total_nnz / sp) + pad) ; if not use_sp: (total_nnz,)
+                log_probs, entropy_rmpad = self._logprobs_and_entropy(logits_rmpad, input_ids_rmpad_rolled)
 
                 # gather log_prob if sp > 1
                 if self.use_ulysses_sp:
@@ -127,6 +200,17 @@ class DataParallelPPOActor(BasePPOActor):
                 entropy = full_entropy.squeeze(-1)[:, -response_length - 1:-1]  # (bsz, response_length)
                 log_probs = full_log_probs.squeeze(-1)[:, -response_length - 1:-1]  # (bsz, response_length)
 
+            elif self.response_only_logits:
+                with self._gather_before_lm_head(slice(-response_length - 1, -1)):
+                    output = self.actor_module(input_ids=input_ids,
+                                               attention_mask=attention_mask,
+                                               position_ids=position_ids,
+                                               use_cache=False)  # prevent model thinks we are generating
+                logits = output.logits  # (bsz, response_length, vocab_size)
+                logits.div_(temperature)
+                log_probs, entropy = self._logprobs_and_entropy(logits, micro_batch['responses'],
+                                                                compile_entropy=False)  # (bsz, response_length)
+
             else:  # not using rmpad and no ulysses sp
                 output = self.actor_module(input_ids=input_ids,
                                            attention_mask=attention_mask,
@@ -135,11 +219,90 @@ class DataParallelPPOActor(BasePPOActor):
                 logits = output.logits
                 logits.div_(temperature)
                 logits = logits[:, -response_length - 1:-1]  # (bsz, response_length)
-                log_probs = logprobs_from_logits(logits, micro_batch['responses'])
-                entropy = verl_F.entropy_from_logits(logits)  # (bsz, response_length)
+                log_probs, entropy = self._logprobs_and_entropy(logits, micro_batch['responses'],
+                                                                compile_entropy=False)  # (bsz, response_length)
 
             return entropy, log_probs
 
+    def _get_prefix_state(self, prompt_ids: torch.Tensor):
+        """KV cache and last-position logits of an unpadded prompt, computed on a cache miss.
+        Returns (state, number of forwards run)."""
+        key = tuple(prompt_ids.tolist())
+        state = self.prefix_cache.get(key)
+        num_forwards = 0
+        if state is None:
+            num_forwards = 1
+            output = self.actor_module(input_ids=prompt_ids.unsqueeze(0),
+                                       position_ids=torch.arange(len(prompt_ids), device=prompt_ids.device).unsqueeze(0),
+                                       use_cache=True)
+            past_key_values = output.past_key_values
+            if hasattr(past_key_values, 'to_legacy_cache'):
+                past_key_values = past_key_values.to_legacy_cache()
+            last_logits = output.logits[0, -1].float()
+            state = (past_key_values, last_logits)
+            self.prefix_cache.put(key, state, tensors=[t for kv in past_key_values for t in kv] + [last_logits])
+        return state, num_forwards
+
+    def _forward_micro_batch_with_prefix_cache(self, micro_batch, temperature) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Same outputs as _forward_micro_batch, but the prompt is only run once per distinct prompt.
+
+        Sequences are grouped by prompt and the model runs on the response tokens only, attending to the
+        cached KV of their prompt. The first response token is scored with the cached logits of the last prompt token.
+
+        The number of forwards depends on the prompts and the cache content of the rank. With FSDP every forward
+        all-gathers the parameters, so the ranks agree on the largest count and the others pad with dummy forwards.
+        """
+        from transformers import DynamicCache
+
+        responses = micro_batch['responses']
+        response_length = responses.size(-1)
+        input_ids = micro_batch['input_ids']
+        attention_mask = micro_batch['attention_mask']
+        position_ids = micro_batch['position_ids']
+        batch_size = input_ids.shape[0]
+
+        prompt_ids = input_ids[:, :-response_length]
+        prompt_mask = attention_mask[:, :-response_length].bool()
+        groups = defaultdict(list)
+        for i in range(batch_size):
+            # prompts are left-padded, the valid tokens are contiguous
+            groups[tuple(prompt_ids[i][prompt_mask[i]].tolist())].append(i)
+
+        entropy = torch.zeros(batch_size, response_length, dtype=torch.float32, device=input_ids.device)
+        log_probs = torch.zeros(batch_size, response_length, dtype=torch.float32, device=input_ids.device)
+        num_forwards = 0
+        with torch.autocast(device_type='cuda', dtype=torch.bfloat16):
+            for prompt, rows in groups.items():
+                (past_key_values, last_logits), prefix_forwards = self._get_prefix_state(
+                    torch.tensor(prompt, dtype=input_ids.dtype, device=input_ids.device))
+                num_forwards += prefix_forwards + 1
+                rows = torch.tensor(rows, device=input_ids.device)
+                num_rows = len(rows)
+                past_key_values = DynamicCache.from_legacy_cache(
+                    tuple((k.expand(num_rows, -1, -1, -1), v.expand(num_rows, -1, -1, -1)) for k, v in past_key_values))
+                group_attention_mask = torch.cat([
+                    torch.ones(num_rows, len(prompt), dtype=attention_mask.dtype, device=attention_mask.device),
+                    attention_mask[rows, -response_length:]
+                ], dim=1)
+                output = self.actor_module(input_ids=responses[rows],
+                                           attention_mask=group_attention_mask,
+                                           position_ids=position_ids[rows, -response_length:],
+                                           past_key_values=past_key_values,
+                                           use_cache=True)
+                logits = torch.cat([last_logits.to(output.logits.dtype).expand(num_rows, 1, -1), output.logits[:, :-1]],
+                                   dim=1)  # (num_rows, response_length, vocab_size)
+                logits.div_(temperature)
+                group_log_probs, group_entropy = self._logprobs_and_entropy(logits, responses[rows], compile_entropy=False)
+                log_probs[rows] = group_log_probs.float()
+                entropy[rows] = group_entropy.float()
+
+            if torch.distributed.is_initialized() and torch.distributed.get_world_size() > 1:
+                max_forwards = torch.tensor(num_forwards, device=input_ids.device)
+                torch.distributed.all_reduce(max_forwards, op=torch.distributed.ReduceOp.MAX)
+                for _ in range(int(max_forwards) - num_forwards):
+                    self.actor_module(input_ids=input_ids[:1, -1:], position_ids=position_ids[:1, -1:], use_cache=False)
+        return entropy, log_probs
+
     def _optimizer_step(self):
         assert self.config.grad_clip is not None
 
@@ -178,19 +341,32 @@ class DataParallelPPOActor(BasePPOActor):
         select_keys = ['responses', 'input_ids', 'attention_mask', 'position_ids']
         batch = data.select(batch_keys=select_keys).batch
 
-        if use_dynamic_bsz:
+        if self.micro_batch_autotune:
+            if self.log_prob_tuner is None:
+                self.log_prob_tuner = TokenBudgetTuner(init_tokens=data.meta_info['max_token_len'] *
+                                                       self.ulysses_sequence_parallel_size)
+            use_dynamic_bsz = True
+            max_token_len = self.log_prob_tuner.get_budget(min_tokens=batch['attention_mask'].shape[-1])
+            micro_batches, indices = rearrange_micro_batches(batch=batch, max_token_len=max_token_len)
+        elif use_dynamic_bsz:
             # split using dynamic bsz
             max_token_len = data.meta_info['max_token_len'] * self.ulysses_sequence_parallel_size
             micro_batches, indices = rearrange_micro_batches(batch=batch, max_token_len=max_token_len)
         else:
             micro_batches = batch.split(micro_batch_size)
 
+        def log_prob_fn(micro_batch, weight):
+            if self.prefix_cache is not None:
+                return self._forward_micro_batch_with_prefix_cache(micro_batch, temperature=temperature)[1]
+            return self._forward_micro_batch(micro_batch, temperature=temperature)[1]
+
         log_probs_lst = []
         for micro_batch in micro_batches:
             with torch.no_grad():
-                _, log_probs = self._forward_micro_batch(micro_batch, temperature=temperature)
-            log_probs_lst.append(log_probs)
+                log_probs_lst.extend(run_micro_batch(log_prob_fn, micro_batch, tuner=self.log_prob_tuner))
         log_probs = torch.concat(log_probs_lst, dim=0)
+        if self.log_prob_tuner is not None:
+            self.log_prob_tuner.step()
 
         if use_dynamic_bsz:
             indices = list(itertools.chain.from_iterable(indices))
@@ -200,6 +376,12 @@ class DataParallelPPOActor(BasePPOActor):
 
         return log_probs
 
+    def log_prob_metrics(self, prefix: str) -> dict:
+        """Token budget of compute_log_prob, reported by the worker with the log probs"""
+        if self.log_prob_tuner is None:
+            return {}
+        return self.log_prob_tuner.metrics(f'{prefix}/log_prob')
+
     def update_policy(self, data: DataProto):
         # make sure we are in training mode
         self.actor_module.train()
@@ -219,11 +401,67 @@ class DataParallelPPOActor(BasePPOActor):
         # See PPO paper for details. https://arxiv.org/abs/1707.06347
         dataloader = batch.split(self.config.ppo_mini_batch_size)
 
+        def update_fn(data, weight):
+            data = data.cuda()  # actor device is cpu when using offload
+            responses = data['responses']
+            response_length = responses.size(1)
+            attention_mask = data['attention_mask']
+            response_mask = attention_mask[:, -response_length:]
+            if self.config.state_masking:
+                response_mask = data['loss_mask']
+            old_log_prob = data['old_log_probs']
+            advantages = data['advantages']
+
+            clip_ratio = self.config.clip_ratio
+            entropy_coeff = self.config.entropy_coeff
+
+            # all return: (bsz, response_length)
+            entropy, log_prob = self._forward_micro_batch(micro_batch=data, temperature=temperature)
+
+            pg_loss, pg_clipfrac, ppo_kl = core_algos.compute_policy_loss(old_log_prob=old_log_prob,
+                                                                          log_prob=log_prob,
+                                                                          advantages=advantages,
+                                                                          eos_mask=response_mask,
+                                                                          cliprange=clip_ratio)
+            # compute entropy loss from entropy
+            entropy_loss = verl_F.masked_mean(entropy, response_mask)
+
+            # compute policy loss
+            policy_loss = pg_loss - entropy_loss * entropy_coeff
+
+            micro_metrics = {}
+            if self.config.use_kl_loss:
+                ref_log_prob = data['ref_log_prob']
+                # compute kl loss
+                kld = core_algos.kl_penalty(logprob=log_prob,
+                                            ref_logprob=ref_log_prob,
+                                            kl_penalty=self.config.kl_loss_type)
+                kl_loss = masked_mean(kld, response_mask)
+
+                policy_loss = policy_loss - kl_loss * self.config.kl_loss_coef
+                micro_metrics['actor/kl_loss'] = kl_loss.detach().item()
+                micro_metrics['actor/kl_coef'] = self.config.kl_loss_coef
+
+            # weight is the share of the mini batch in this micro batch (or in its part re-split after an OOM)
+            loss = policy_loss * weight
+            loss.backward()
+
+            micro_metrics.update({
+                'actor/entropy_loss': entropy_loss.detach().item(),
+                'actor/pg_loss': pg_loss.detach().item(),
+                'actor/pg_clipfrac': pg_clipfrac.detach().item(),
+                'actor/ppo_kl': ppo_kl.detach().item(),
+            })
+            return micro_metrics
+
         metrics = {}
         for batch_idx, data in enumerate(dataloader):
             # split batch into micro_batches
             mini_batch = data
-            if self.config.use_dynamic_bsz:
+            if self.update_tuner is not None:
+                max_token_len = self.update_tuner.get_budget(min_tokens=mini_batch['attention_mask'].shape[-1])
+                micro_batches, _ = rearrange_micro_batches(batch=mini_batch, max_token_len=max_token_len)
+            elif self.config.use_dynamic_bsz:
                 max_token_len = self.config.ppo_max_token_len_per_gpu * self.ulysses_sequence_parallel_size
                 micro_batches, _ = rearrange_micro_batches(batch=mini_batch, max_token_len=max_token_len)
             else:
@@ -233,58 +471,20 @@ class DataParallelPPOActor(BasePPOActor):
             self.actor_optimizer.zero_grad()
 
             for data in micro_batches:
-                data = data.cuda()  # actor device is cpu when using offload
-                responses = data['responses']
-                response_length = responses.size(1)
-                attention_mask = data['attention_mask']
-                response_mask = attention_mask[:, -response_length:]
-                if self.config.state_masking:
-                    response_mask = data['loss_mask']
-                old_log_prob = data['old_log_probs']
-                advantages = data['advantages']
-
-                clip_ratio = self.config.clip_ratio
-                entropy_coeff = self.config.entropy_coeff
-
-                # all return: (bsz, response_length)
-                entropy, log_prob = self._forward_micro_batch(micro_batch=data, temperature=temperature)
-
-                pg_loss, pg_clipfrac, ppo_kl = core_algos.compute_policy_loss(old_log_prob=old_log_prob,
-                                                                              log_prob=log_prob,
-                                                                              advantages=advantages,
-                                                                              eos_mask=response_mask,
-                                                                              cliprange=clip_ratio)
-                # compute entropy loss from entropy
-                entropy_loss = verl_F.masked_mean(entropy, response_mask)
-
-                # compute policy loss
-                policy_loss = pg_loss - entropy_loss * entropy_coeff
-
-                if self.config.use_kl_loss:
-                    ref_log_prob = data['ref_log_prob']
-                    # compute kl loss
-                    kld = core_algos.kl_penalty(logprob=log_prob,
-                                                ref_logprob=ref_log_prob,
-                                                kl_penalty=self.config.kl_loss_type)
-                    kl_loss = masked_mean(kld, response_mask)
-
-                    policy_loss = policy_loss - kl_loss * self.config.kl_loss_coef
-                    metrics['actor/kl_loss'] = kl_loss.detach().item()
-                    metrics['actor/kl_coef'] = self.config.kl_loss_coef
-
-                loss = policy_loss / self.gradient_accumulation
-                loss.backward()
-
-                data = {
-                    'actor/entropy_loss': entropy_loss.detach().item(),
-                    'actor/pg_loss': pg_loss.detach().item(),
-                    'actor/pg_clipfrac': pg_clipfrac.detach().item(),
-                    'actor/ppo_kl': ppo_kl.detach().item(),
-                }
-                append_to_dict(metrics, data)
+                if self.update_tuner is not None:
+                    # the number of micro batches follows the token budget, it changes from step to step
+                    weight = data.batch_size[0] / mini_batch.batch_size[0]
+                else:
+                    weight = 1 / self.gradient_accumulation
+                for micro_metrics in run_micro_batch(update_fn, data, tuner=self.update_tuner, weight=weight):
+                    append_to_dict(metrics, micro_metrics)
 
             grad_norm = self._optimizer_step()
-            data = {'actor/grad_norm': grad_norm.detach().item()}
+            data = {'actor/grad_norm': grad_norm.detach().item(), 'actor/num_micro_batches': len(micro_batches)}
             append_to_dict(metrics, data)
+
+        if self.update_tuner is not None:
+            self.update_tuner.step()
+            metrics.update(self.update_tuner.metrics('actor/update'))
         self.actor_optimizer.zero_grad()
         return metrics
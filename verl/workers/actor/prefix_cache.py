@@ -0,0 +1,68 @@
+# Copyright 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Cache of prompt prefix states for a frozen model
+"""
+
+from collections import OrderedDict
+from typing import Hashable, Iterable
+
+import torch
+
+
+class PrefixCache:
+    """LRU cache of per-prompt states (e.g. the KV cache of the prompt), bounded by the bytes of their tensors.
+
+    Only valid for a model whose weights never change, such as the reference policy.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(tensors: Iterable[torch.Tensor]) -> int:
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def get(self, key: Hashable):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key: Hashable, value, tensors: Iterable[torch.Tensor]):
+        """Store ``value``, whose memory is the total size of ``tensors``, evicting the least recently used entries."""
+        size = self._size(tensors)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.num_bytes -= self.entries.pop(key)[1]
+        while self.num_bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.num_bytes -= evicted_size
+        self.entries[key] = (value, size)
+        self.num_bytes += size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'prefix_cache/entries': len(self.entries),
+            'prefix_cache/mb': self.num_bytes / 1024**2,
+            'prefix_cache/hit_rate': self.hits / total if total > 0 else 0.,
+        }
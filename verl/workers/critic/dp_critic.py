@@ -30,6 +30,7 @@ from verl.utils.py_functional import append_to_dict
 from verl.utils.torch_functional import masked_mean
 from verl.utils.ulysses import ulysses_pad_and_slice_inputs, gather_outpus_and_unpad
 from verl.utils.seqlen_balancing import rearrange_micro_batches, get_reverse_idx
+from verl.utils.micro_batch_tuner import TokenBudgetTuner, run_micro_batch
 
 from flash_attn.bert_padding import pad_input, unpad_input, rearrange, index_first_axis
 
@@ -50,6 +51,14 @@ class DataParallelPPOCritic(BasePPOCritic):
 
         self.ulysses_sequence_parallel_size = self.config.get('ulysses_sequence_parallel_size', 1)
 
+        # learn the tokens per micro batch from the observed peak memory instead of the static config values
+        self.micro_batch_autotune = self.config.get('micro_batch_autotune', False)
+        self.values_tuner = None
+        self.update_tuner = None
+        if self.micro_batch_autotune:
+            self.update_tuner = TokenBudgetTuner(init_tokens=self.config.ppo_max_token_len_per_gpu *
+                                                 self.ulysses_sequence_parallel_size)
+
     def _forward_micro_batch(self, micro_batch):
         response_length = micro_batch['responses'].size(-1)
         with torch.autocast(device_type='cuda', dtype=torch.bfloat16):
@@ -117,7 +126,14 @@ class DataParallelPPOCritic(BasePPOCritic):
         batch = data.select(batch_keys=select_keys).batch
         use_dynamic_bsz = data.meta_info['use_dynamic_bsz']
 
-        if use_dynamic_bsz:
+        if self.micro_batch_autotune:
+            if self.values_tuner is None:
+                self.values_tuner = TokenBudgetTuner(init_tokens=data.meta_info['max_token_len'] *
+                                                     self.ulysses_sequence_parallel_size)
+            use_dynamic_bsz = True
+            max_token_len = self.values_tuner.get_budget(min_tokens=batch['attention_mask'].shape[-1])
+            micro_batches, indices = rearrange_micro_batches(batch=batch, max_token_len=max_token_len)
+        elif use_dynamic_bsz:
             # split using dynamic bsz
             max_token_len = data.meta_info['max_token_len'] * self.ulysses_sequence_parallel_size
             micro_batches, indices = rearrange_micro_batches(batch=batch, max_token_len=max_token_len)
@@ -127,9 +143,13 @@ class DataParallelPPOCritic(BasePPOCritic):
         values_lst = []
         for micro_batch in micro_batches:
             with torch.no_grad():
-                values = self._forward_micro_batch(micro_batch)
-            values_lst.append(values)
+                values_lst.extend(
+                    run_micro_batch(lambda micro_batch, weight: self._forward_micro_batch(micro_batch),
+                                    micro_batch,
+                                    tuner=self.values_tuner))
         values = torch.concat(values_lst, dim=0)
+        if self.values_tuner is not None:
+            self.values_tuner.step()
         responses = data.batch['responses']
         attention_mask = data.batch['attention_mask']
         response_length = responses.size(1)
@@ -154,10 +174,42 @@ class DataParallelPPOCritic(BasePPOCritic):
         # See PPO paper for details. https://arxiv.org/abs/1707.06347
         dataloader = batch.split(self.config.ppo_mini_batch_size)
 
+        def update_fn(data, weight):
+            data = data.cuda()  # critic device is cpu when using offload
+            responses = data['responses']
+            attention_mask = data['attention_mask']
+            values = data['values']
+            returns = data['returns']
+            response_length = responses.size(1)
+
+            eos_mask = attention_mask[:, -response_length - 1:-1]
+
+            vpreds = self._forward_micro_batch(data)
+
+            # assert not torch.any(torch.isnan(vpreds)).item()
+
+            vf_loss, vf_clipfrac = core_algos.compute_value_loss(vpreds=vpreds,
+                                                                 values=values,
+                                                                 returns=returns,
+                                                                 eos_mask=eos_mask,
+                                                                 cliprange_value=self.config.cliprange_value)
+            # weight is the share of the mini batch in this micro batch (or in its part re-split after an OOM)
+            loss = vf_loss * weight
+            loss.backward()
+
+            return {
+                'critic/vf_loss': vf_loss.detach().item(),
+                'critic/vf_clipfrac': vf_clipfrac.detach().item(),
+                'critic/vpred_mean': masked_mean(vpreds, eos_mask).detach().item(),
+            }
+
         for batch_idx, data in enumerate(dataloader):
             # split batch into micro_batches
             mini_batch = data
-            if self.config.use_dynamic_bsz:
+            if self.update_tuner is not None:
+                max_token_len = self.update_tuner.get_budget(min_tokens=mini_batch['attention_mask'].shape[-1])
+                micro_batches, _ = rearrange_micro_batches(batch=mini_batch, max_token_len=max_token_len)
+            elif self.config.use_dynamic_bsz:
                 max_token_len = self.config.ppo_max_token_len_per_gpu * self.ulysses_sequence_parallel_size
                 micro_batches, _ = rearrange_micro_batches(batch=mini_batch, max_token_len=max_token_len)
             else:
@@ -166,39 +218,22 @@ class DataParallelPPOCritic(BasePPOCritic):
             self.critic_optimizer.zero_grad()
 
             for data in micro_batches:
-                data = data.cuda()  # critic device is cpu when using offload
-                input_ids = data['input_ids']
-                responses = data['responses']
-                attention_mask = data['attention_mask']
-                position_ids = data['position_ids']
-                values = data['values']
-                returns = data['returns']
-                response_length = responses.size(1)
-
-                eos_mask = attention_mask[:, -response_length - 1:-1]
-
-                vpreds = self._forward_micro_batch(data)
-
-                # assert not torch.any(torch.isnan(vpreds)).item()
-
-                vf_loss, vf_clipfrac = core_algos.compute_value_loss(vpreds=vpreds,
-                                                                     values=values,
-                                                                     returns=returns,
-                                                                     eos_mask=eos_mask,
-                                                                     cliprange_value=self.config.cliprange_value)
-                loss = vf_loss / self.gradient_accumulation
-                loss.backward()
-
-                data = {
-                    'critic/vf_loss': vf_loss.detach().item(),
-                    'critic/vf_clipfrac': vf_clipfrac.detach().item(),
-                    'critic/vpred_mean': masked_mean(vpreds, eos_mask).detach().item(),
-                }
-
-                append_to_dict(metrics, data)
+                if self.update_tuner is not None:
+                    # the number of micro batches follows the token budget, it changes from step to step
+                    weight = data.batch_size[0] / mini_batch.batch_size[0]
+                else:
+                    weight = 1 / self.gradient_accumulation
+                for micro_metrics in run_micro_batch(update_fn, data, tuner=self.update_tuner, weight=weight):
+                    append_to_dict(metrics, micro_metrics)
 
             grad_norm = self._optimizer_step()
-            data = {'critic/grad_norm': grad_norm.detach().item()}
+            data = {'critic/grad_norm': grad_norm.detach().item(), 'critic/num_micro_batches': len(micro_batches)}
             append_to_dict(metrics, data)
+
+        if self.update_tuner is not None:
+            self.update_tuner.step()
+            metrics.update(self.update_tuner.metrics('critic/update'))
+        if self.values_tuner is not None:
+            metrics.update(self.values_tuner.metrics('critic/values'))
         self.critic_optimizer.zero_grad()
         return metrics
@@ -17,8 +17,11 @@ The main entry point to run the PPO algorithm
 
 import logging
 import os
+import time
 import warnings
 
+_import_start = time.perf_counter()
+
 import torch
 import torch.distributed
 import verl.utils.hdfs_io as hdfs_io
@@ -30,20 +33,28 @@ from verl.single_controller.base.decorator import register, Dispatch
 from verl.utils import hf_tokenizer
 from verl.utils.debug import log_gpu_memory_usage
 from verl.utils.fs import copy_local_path_from_hdfs
+from verl.utils.fsdp_checkpoint import ShardedCheckpointer, upload_files
 from verl.utils.fsdp_utils import get_fsdp_wrap_policy, offload_fsdp_grad, init_fn, get_init_weight_context_manager
 from verl.utils.fsdp_utils import offload_fsdp_optimizer, offload_fsdp_param_and_grad, load_fsdp_optimizer, \
     load_fsdp_param_and_grad
 from verl.utils.import_utils import import_external_libs
 from verl.utils.model import compute_position_id_with_mask
-from verl.utils.flops_counter import FlopsCounter
 from verl.workers.sharding_manager.fsdp_ulysses import FSDPUlyssesShardingManager
 
 from codetiming import Timer
 
+# seconds to import this module and its dependencies in the worker process
+_MODULE_IMPORT_S = time.perf_counter() - _import_start
+
 logger = logging.getLogger(__file__)
 logger.setLevel(os.getenv('VERL_PPO_LOGGING_LEVEL', 'WARN'))
 
 
+def _record_startup_time(timing: dict, name: str, start: float):
+    """Add the seconds since ``start`` to ``timing[name]``, the breakdown returned by init_model"""
+    timing[name] = timing.get(name, 0.) + time.perf_counter() - start
+
+
 class ActorRolloutRefWorker(Worker):
     """
     This worker can be instantiated as a standalone actor or a standalone rollout or a standalone reference policy
@@ -91,6 +102,10 @@ class ActorRolloutRefWorker(Worker):
         elif self._is_ref:
             # TODO: it seems that manual offload is slowly than FSDP offload
             self._is_offload_param = self.config.ref.fsdp_config.get('param_offload', False)
+        # the ref model follows its own offload config, also when it lives next to the actor (actor_rollout_ref)
+        self._is_offload_ref_param = self._is_ref and self.config.ref.fsdp_config.get('param_offload', False)
+
+        self.checkpointer = ShardedCheckpointer(rank=self.rank, world_size=self.world_size)
 
         # normalize config
         if self._is_actor:
@@ -115,7 +130,10 @@ class ActorRolloutRefWorker(Worker):
                                override_model_config,
                                use_remove_padding=False,
                                enable_gradient_checkpointing=False,
-                               trust_remote_code=False):
+                               trust_remote_code=False,
+                               model_role='actor'):
+        """Build one FSDP model. ``model_role`` is 'actor' (fp32 master weights and optimizer),
+        'rollout' or 'ref' (frozen, bf16 by default, without mixed precision)."""
         from verl.utils.model import print_model_size, update_model_config
         from verl.utils.torch_dtypes import PrecisionType
         from transformers import AutoModelForCausalLM, AutoConfig
@@ -131,7 +149,7 @@ class ActorRolloutRefWorker(Worker):
 
         torch_dtype = fsdp_config.get('model_dtype', None)
         if torch_dtype is None:
-            torch_dtype = torch.float32 if self._is_actor else torch.bfloat16
+            torch_dtype = torch.float32 if model_role == 'actor' else torch.bfloat16
         else:
             torch_dtype = PrecisionType.to_dtype(torch_dtype)
 
@@ -159,6 +177,7 @@ class ActorRolloutRefWorker(Worker):
         # NOTE(fix me): tie_word_embedding causes meta_tensor init to hang
         init_context = get_init_weight_context_manager(use_meta_tensor=not actor_model_config.tie_word_embeddings)
 
+        start = time.perf_counter()
         with init_context(), warnings.catch_warnings():
             warnings.simplefilter("ignore")
             actor_module = AutoModelForCausalLM.from_pretrained(pretrained_model_name_or_path=local_path,
@@ -172,6 +191,7 @@ class ActorRolloutRefWorker(Worker):
             if enable_gradient_checkpointing:
                 actor_module.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
         torch.distributed.barrier()
+        _record_startup_time(self.startup_timing, f'{model_role}/model_load', start)
 
         if self.rank == 0:
             print_model_size(actor_module)
@@ -191,7 +211,7 @@ class ActorRolloutRefWorker(Worker):
 
         mixed_precision = MixedPrecision(param_dtype=param_dtype, reduce_dtype=reduce_dtype, buffer_dtype=buffer_dtype)
 
-        if self._is_ref:
+        if model_role == 'ref':
             mixed_precision = None
 
         auto_wrap_policy = get_fsdp_wrap_policy(module=actor_module, config=fsdp_config.get('wrap_policy', None))
@@ -209,6 +229,7 @@ class ActorRolloutRefWorker(Worker):
             sharding_strategy = ShardingStrategy.FULL_SHARD
 
         # TODO: add transformer policy
+        start = time.perf_counter()
         actor_module_fsdp = FSDP(
             actor_module,
             param_init_fn=init_fn,
@@ -221,10 +242,11 @@ class ActorRolloutRefWorker(Worker):
             device_mesh=self.device_mesh,
             forward_prefetch=False)
 
+        _record_startup_time(self.startup_timing, f'{model_role}/fsdp_wrap', start)
         log_gpu_memory_usage('After Actor FSDP init', logger=logger)
 
         # TODO: add more optimizer args into config
-        if self._is_actor:
+        if model_role == 'actor':
             from verl.utils.torch_functional import get_constant_schedule_with_warmup
             actor_optimizer = optim.AdamW(actor_module_fsdp.parameters(),
                                           lr=optim_config.lr,
@@ -283,9 +305,12 @@ class ActorRolloutRefWorker(Worker):
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
     def init_model(self):
+        self.startup_timing = {'module_import': _MODULE_IMPORT_S}
+        start = time.perf_counter()
         from verl.workers.actor import DataParallelPPOActor
         # This is used to import external_lib into the huggingface systems
         import_external_libs(self.config.model.get('external_lib', None))
+        _record_startup_time(self.startup_timing, 'import', start)
 
         from omegaconf import OmegaConf
         override_model_config = OmegaConf.to_container(self.config.model.get('override_config', OmegaConf.create()))
@@ -307,7 +332,8 @@ class ActorRolloutRefWorker(Worker):
                 override_model_config=override_model_config,
                 use_remove_padding=use_remove_padding,
                 enable_gradient_checkpointing=self.config.model.get('enable_gradient_checkpointing', False),
-                trust_remote_code=self.config.model.get('trust_remote_code', False))
+                trust_remote_code=self.config.model.get('trust_remote_code', False),
+                model_role='actor' if self._is_actor else 'rollout')
 
             # get the original unwrapped module
             self.actor_module = self.actor_module_fsdp._fsdp_wrapped_module
@@ -324,12 +350,17 @@ class ActorRolloutRefWorker(Worker):
             OmegaConf.set_struct(self.config.actor, True)
             with open_dict(self.config.actor):
                 self.config.actor.use_remove_padding = use_remove_padding
+                self.config.actor.response_only_logits = self.config.model.get('response_only_logits', False)
+                self.config.actor.logprob_chunk_size = self.config.model.get('logprob_chunk_size', 0)
             self.actor = DataParallelPPOActor(config=self.config.actor,
                                               actor_module=self.actor_module_fsdp,
                                               actor_optimizer=self.actor_optimizer)
 
         if self._is_rollout:
+            # includes importing vllm and building its engine
+            start = time.perf_counter()
             self.rollout, self.rollout_sharding_manager = self._build_rollout()
+            _record_startup_time(self.startup_timing, 'rollout/engine_build', start)
 
         if self._is_ref:
             self.ref_module_fsdp = self._build_model_optimizer(model_path=self.config.model.path,
@@ -338,19 +369,24 @@ class ActorRolloutRefWorker(Worker):
                                                                override_model_config=override_model_config,
                                                                use_remove_padding=use_remove_padding,
                                                                trust_remote_code=self.config.model.get(
-                                                                   'trust_remote_code', False))[0]
-            if self._is_offload_param:
-                offload_fsdp_param_and_grad(module=self.ref_module_fsdp, offload_grad=self._is_offload_grad)
+                                                                   'trust_remote_code', False),
+                                                               model_role='ref')[0]
+            if self._is_offload_ref_param:
+                offload_fsdp_param_and_grad(module=self.ref_module_fsdp, offload_grad=False)
 
             OmegaConf.set_struct(self.config.ref, True)
             with open_dict(self.config.ref):
                 self.config.ref.use_remove_padding = use_remove_padding
+                self.config.ref.response_only_logits = self.config.model.get('response_only_logits', False)
+                self.config.ref.logprob_chunk_size = self.config.model.get('logprob_chunk_size', 0)
             self.ref_policy = DataParallelPPOActor(config=self.config.ref, actor_module=self.ref_module_fsdp)
 
         if self._is_actor:
+            from verl.utils.flops_counter import FlopsCounter
             self.flops_counter = FlopsCounter(self.actor_model_config)
 
         torch.cuda.empty_cache()
+        return self.startup_timing
 
     @register(dispatch_mode=Dispatch.DP_COMPUTE_PROTO)
     def update_actor(self, data: DataProto):
@@ -415,7 +451,8 @@ class ActorRolloutRefWorker(Worker):
         with self.ulysses_sharding_manager:
             data = self.ulysses_sharding_manager.preprocess_data(data)
             old_log_probs = self.actor.compute_log_prob(data=data)
-            output = DataProto.from_dict(tensors={'old_log_probs': old_log_probs})
+            output = DataProto.from_dict(tensors={'old_log_probs': old_log_probs},
+                                         meta_info={'metrics': self.actor.log_prob_metrics('actor')})
             output = self.ulysses_sharding_manager.postprocess_data(output)
             
         output = output.to('cpu')
@@ -464,6 +501,7 @@ class ActorRolloutRefWorker(Worker):
                 output = self.ulysses_sharding_manager.preprocess_data(output)
                 old_log_probs = self.actor.compute_log_prob(data=output)
                 output.batch['old_log_probs'] = old_log_probs
+                output.meta_info.setdefault('metrics', {}).update(self.actor.log_prob_metrics('actor'))
                 output = self.ulysses_sharding_manager.postprocess_data(output)
 
         output = output.to('cpu')
@@ -482,10 +520,8 @@ class ActorRolloutRefWorker(Worker):
 
         data = data.to('cuda')
 
-        if self._is_offload_param:
-            load_fsdp_param_and_grad(module=self.ref_module_fsdp,
-                                     device_id=torch.cuda.current_device(),
-                                     load_grad=self._is_offload_grad)
+        if self._is_offload_ref_param:
+            load_fsdp_param_and_grad(module=self.ref_module_fsdp, device_id=torch.cuda.current_device(), load_grad=False)
 
         micro_batch_size = self.config.ref.log_prob_micro_batch_size
         data.meta_info['micro_batch_size'] = micro_batch_size
@@ -495,18 +531,23 @@ class ActorRolloutRefWorker(Worker):
         with self.ulysses_sharding_manager:
             data = self.ulysses_sharding_manager.preprocess_data(data)
             output = self.ref_policy.compute_log_prob(data=data)
-            output = DataProto.from_dict(tensors={'ref_log_prob': output})
+            output = DataProto.from_dict(tensors={'ref_log_prob': output},
+                                         meta_info={'metrics': self.ref_policy.log_prob_metrics('ref')})
+            if self.ref_policy.prefix_cache is not None:
+                output.meta_info['metrics'].update(self.ref_policy.prefix_cache.stats())
             output = self.ulysses_sharding_manager.postprocess_data(output)
 
         output = output.to('cpu')
 
-        if self._is_offload_param:
-            offload_fsdp_param_and_grad(module=self.ref_module_fsdp, offload_grad=self._is_offload_grad)
+        if self._is_offload_ref_param:
+            offload_fsdp_param_and_grad(module=self.ref_module_fsdp, offload_grad=False)
         torch.cuda.empty_cache()
         return output
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
-    def save_checkpoint(self, local_path, hdfs_path=None):
+    def save_checkpoint(self, local_path, hdfs_path=None, sharded=False, async_save=True):
+        """Save the actor as a huggingface model on rank 0, or with ``sharded`` as per-rank shards of the model,
+        optimizer and lr scheduler states that can be resumed from (see ``load_checkpoint``)."""
         assert self._is_actor
         import torch
         if self._is_offload_param:
@@ -514,25 +555,70 @@ class ActorRolloutRefWorker(Worker):
                                      device_id=torch.cuda.current_device(),
                                      load_grad=self._is_offload_grad)
 
-        # TODO: support DCP and save sharded checkpoints
-        import torch.distributed
-        from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType, FullStateDictConfig
-        cfg = FullStateDictConfig(offload_to_cpu=True, rank0_only=True)
-        with FSDP.state_dict_type(self.actor.actor_module, StateDictType.FULL_STATE_DICT, cfg):
-            state_dict = self.actor.actor_module.state_dict()
-        if self.rank == 0:
-            print(f'Saving actor checkpoint to {local_path}')
-            os.makedirs(local_path, exist_ok=True)
-            self.actor_module.save_pretrained(local_path, state_dict=state_dict)
-            self.tokenizer.save_pretrained(local_path)
-            if hdfs_path is not None:
-                print(f'Uploading actor checkpoint to {hdfs_path}')
-                hdfs_io.makedirs(hdfs_path, exist_ok=True)
-                hdfs_io.copy(src=local_path, dst=hdfs_path)
+        if sharded:
+            remote_path = None if hdfs_path is None else os.path.join(hdfs_path, os.path.basename(local_path))
+            if self.rank == 0:
+                print(f'Saving sharded actor checkpoint to {local_path}')
+                os.makedirs(local_path, exist_ok=True)
+                self.actor_model_config.save_pretrained(local_path)
+                self.tokenizer.save_pretrained(local_path)
+                if remote_path is not None:
+                    upload_files(local_path, remote_path)
+            self.checkpointer.async_save = async_save
+            self.checkpointer.save(local_path,
+                                   module=self.actor_module_fsdp,
+                                   optimizer=self.actor_optimizer,
+                                   lr_scheduler=self.actor_lr_scheduler,
+                                   hdfs_path=remote_path)
+        else:
+            import torch.distributed
+            from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType, FullStateDictConfig
+            cfg = FullStateDictConfig(offload_to_cpu=True, rank0_only=True)
+            with FSDP.state_dict_type(self.actor.actor_module, StateDictType.FULL_STATE_DICT, cfg):
+                state_dict = self.actor.actor_module.state_dict()
+            if self.rank == 0:
+                print(f'Saving actor checkpoint to {local_path}')
+                os.makedirs(local_path, exist_ok=True)
+                self.actor_module.save_pretrained(local_path, state_dict=state_dict)
+                self.tokenizer.save_pretrained(local_path)
+                if hdfs_path is not None:
+                    print(f'Uploading actor checkpoint to {hdfs_path}')
+                    hdfs_io.makedirs(hdfs_path, exist_ok=True)
+                    hdfs_io.copy(src=local_path, dst=os.path.join(hdfs_path, os.path.basename(local_path)))
+
+            torch.distributed.barrier()
+        if self._is_offload_param:
+            offload_fsdp_param_and_grad(module=self.actor_module_fsdp, offload_grad=self._is_offload_grad)
+
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def load_checkpoint(self, local_path):
+        """Restore the actor model, optimizer, lr scheduler and rng states from a sharded checkpoint"""
+        assert self._is_actor
+        import torch
+        if self._is_offload_param:
+            load_fsdp_param_and_grad(module=self.actor_module_fsdp,
+                                     device_id=torch.cuda.current_device(),
+                                     load_grad=self._is_offload_grad)
+        if self._is_offload_optimizer:
+            load_fsdp_optimizer(optimizer=self.actor_optimizer, device_id=torch.cuda.current_device())
 
+        if self.rank == 0:
+            print(f'Loading sharded actor checkpoint from {local_path}')
+        self.checkpointer.load(local_path,
+                               module=self.actor_module_fsdp,
+                               optimizer=self.actor_optimizer,
+                               lr_scheduler=self.actor_lr_scheduler)
         torch.distributed.barrier()
+
         if self._is_offload_param:
             offload_fsdp_param_and_grad(module=self.actor_module_fsdp, offload_grad=self._is_offload_grad)
+        if self._is_offload_optimizer:
+            offload_fsdp_optimizer(optimizer=self.actor_optimizer)
+
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def wait_for_checkpoint(self):
+        """Block until the sharded checkpoint being written in the background is on disk"""
+        self.checkpointer.wait()
 
 
 class CriticWorker(Worker):
@@ -562,6 +648,8 @@ class CriticWorker(Worker):
         self._is_offload_grad = self.config.model.fsdp_config.grad_offload
         self._is_offload_optimizer = self.config.model.fsdp_config.optimizer_offload
 
+        self.checkpointer = ShardedCheckpointer(rank=self.rank, world_size=self.world_size)
+
         # normalize config
         self.config.ppo_mini_batch_size //= (torch.distributed.get_world_size() // self.ulysses_sequence_parallel_size)
         self.config.ppo_micro_batch_size //= (torch.distributed.get_world_size() // self.ulysses_sequence_parallel_size)
@@ -613,6 +701,7 @@ class CriticWorker(Worker):
             apply_monkey_patch(critic_model_config, verbose=True)
 
         init_context = get_init_weight_context_manager()
+        start = time.perf_counter()
         with init_context(), warnings.catch_warnings():
             warnings.simplefilter("ignore")
             setattr(critic_model_config, 'classifier_dropout', 0.)
@@ -628,6 +717,7 @@ class CriticWorker(Worker):
 
             if config.model.get('enable_gradient_checkpointing', False):
                 critic_module.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+        _record_startup_time(self.startup_timing, 'model_load', start)
         if self.rank == 0:
             print_model_size(critic_module)
 
@@ -649,6 +739,7 @@ class CriticWorker(Worker):
         auto_wrap_policy = get_fsdp_wrap_policy(module=critic_module, config=self.config.model.fsdp_config.wrap_policy)
 
         log_gpu_memory_usage('Before critic FSDP', logger=None)
+        start = time.perf_counter()
 
         critic_module = FSDP(critic_module,
                              param_init_fn=init_fn,
@@ -660,6 +751,7 @@ class CriticWorker(Worker):
                              sync_module_states=True,
                              forward_prefetch=False)
 
+        _record_startup_time(self.startup_timing, 'fsdp_wrap', start)
         log_gpu_memory_usage('After critic FSDP', logger=None)
 
         critic_optimizer = optim.AdamW(critic_module.parameters(),
@@ -681,10 +773,14 @@ class CriticWorker(Worker):
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
     def init_model(self):
+        self.startup_timing = {'module_import': _MODULE_IMPORT_S}
+        start = time.perf_counter()
         # This is used to import external_lib into the huggingface systems
         import_external_libs(self.config.model.get('external_lib', None))
 
         from verl.workers.critic import DataParallelPPOCritic
+        from verl.utils.flops_counter import FlopsCounter
+        _record_startup_time(self.startup_timing, 'import', start)
         self.critic_module, self.critic_optimizer, self.critic_lr_scheduler = self._build_critic_model_optimizer(
             self.config)
 
@@ -700,6 +796,7 @@ class CriticWorker(Worker):
         self.flops_counter = FlopsCounter(self.critic_model_config)
 
         torch.cuda.empty_cache()
+        return self.startup_timing
 
     @register(dispatch_mode=Dispatch.DP_COMPUTE_PROTO)
     def compute_values(self, data: DataProto):
@@ -764,32 +861,74 @@ class CriticWorker(Worker):
         return output
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
-    def save_checkpoint(self, local_path, hdfs_path=None):
+    def save_checkpoint(self, local_path, hdfs_path=None, sharded=False, async_save=True):
         import torch
         if self._is_offload_param:
             load_fsdp_param_and_grad(module=self.critic_module,
                                      device_id=torch.cuda.current_device(),
                                      load_grad=self._is_offload_grad)
 
-        # TODO: support DCP and save sharded checkpoints
-        import torch.distributed
-        from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType, FullStateDictConfig
-        cfg = FullStateDictConfig(offload_to_cpu=True, rank0_only=True)
-        with FSDP.state_dict_type(self.critic_module, StateDictType.FULL_STATE_DICT, cfg):
-            state_dict = self.critic_module.state_dict()
-        if self.rank == 0:
-            print(f'Saving critic checkpoint to {local_path}')
-            os.makedirs(local_path, exist_ok=True)
-            self.critic_module._fsdp_wrapped_module.save_pretrained(local_path, state_dict=state_dict)
-            self.tokenizer.save_pretrained(local_path)
-            if hdfs_path is not None:
-                print(f'Uploading critic checkpoint to {hdfs_path}')
-                hdfs_io.makedirs(hdfs_path, exist_ok=True)
-                hdfs_io.copy(src=local_path, dst=hdfs_path)
+        if sharded:
+            remote_path = None if hdfs_path is None else os.path.join(hdfs_path, os.path.basename(local_path))
+            if self.rank == 0:
+                print(f'Saving sharded critic checkpoint to {local_path}')
+                os.makedirs(local_path, exist_ok=True)
+                self.critic_module._fsdp_wrapped_module.config.save_pretrained(local_path)
+                self.tokenizer.save_pretrained(local_path)
+                if remote_path is not None:
+                    upload_files(local_path, remote_path)
+            self.checkpointer.async_save = async_save
+            self.checkpointer.save(local_path,
+                                   module=self.critic_module,
+                                   optimizer=self.critic_optimizer,
+                                   lr_scheduler=self.critic_lr_scheduler,
+                                   hdfs_path=remote_path)
+        else:
+            import torch.distributed
+            from torch.distributed.fsdp import FullyShardedDataParallel as FSDP, StateDictType, FullStateDictConfig
+            cfg = FullStateDictConfig(offload_to_cpu=True, rank0_only=True)
+            with FSDP.state_dict_type(self.critic_module, StateDictType.FULL_STATE_DICT, cfg):
+                state_dict = self.critic_module.state_dict()
+            if self.rank == 0:
+                print(f'Saving critic checkpoint to {local_path}')
+                os.makedirs(local_path, exist_ok=True)
+                self.critic_module._fsdp_wrapped_module.save_pretrained(local_path, state_dict=state_dict)
+                self.tokenizer.save_pretrained(local_path)
+                if hdfs_path is not None:
+                    print(f'Uploading critic checkpoint to {hdfs_path}')
+                    hdfs_io.makedirs(hdfs_path, exist_ok=True)
+                    hdfs_io.copy(src=local_path, dst=os.path.join(hdfs_path, os.path.basename(local_path)))
+
+            torch.distributed.barrier()
+        if self._is_offload_param:
+            offload_fsdp_param_and_grad(module=self.critic_module, offload_grad=self._is_offload_grad)
 
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def load_checkpoint(self, local_path):
+        import torch
+        if self._is_offload_param:
+            load_fsdp_param_and_grad(module=self.critic_module,
+                                     device_id=torch.cuda.current_device(),
+                                     load_grad=self._is_offload_grad)
+        if self._is_offload_optimizer:
+            load_fsdp_optimizer(optimizer=self.critic_optimizer, device_id=torch.cuda.current_device())
+
+        if self.rank == 0:
+            print(f'Loading sharded critic checkpoint from {local_path}')
+        self.checkpointer.load(local_path,
+                               module=self.critic_module,
+                               optimizer=self.critic_optimizer,
+                               lr_scheduler=self.critic_lr_scheduler)
         torch.distributed.barrier()
+
         if self._is_offload_param:
             offload_fsdp_param_and_grad(module=self.critic_module, offload_grad=self._is_offload_grad)
+        if self._is_offload_optimizer:
+            offload_fsdp_optimizer(optimizer=self.critic_optimizer)
+
+    @register(dispatch_mode=Dispatch.ONE_TO_ALL)
+    def wait_for_checkpoint(self):
+        self.checkpointer.wait()
 
 
 # TODO(sgm): we may need to extract it to dp_reward_model.py
@@ -854,6 +993,7 @@ class RewardModelWorker(Worker):
         # note that we have to create model in fp32. Otherwise, the optimizer is in bf16, which is incorrect
         init_context = get_init_weight_context_manager(use_meta_tensor=not model_config.tie_word_embeddings)
 
+        start = time.perf_counter()
         with init_context(), warnings.catch_warnings():
             warnings.simplefilter("ignore")
             setattr(model_config, 'classifier_dropout', 0.)
@@ -863,8 +1003,10 @@ class RewardModelWorker(Worker):
                                                                             attn_implementation='flash_attention_2',
                                                                             trust_remote_code=trust_remote_code)
             reward_module.to(torch.bfloat16)
+        _record_startup_time(self.startup_timing, 'model_load', start)
         auto_wrap_policy = get_fsdp_wrap_policy(module=reward_module, config=self.config.model.fsdp_config)
 
+        start = time.perf_counter()
         reward_module = FSDP(
             reward_module,
             param_init_fn=init_fn,
@@ -875,15 +1017,20 @@ class RewardModelWorker(Worker):
             sync_module_states=True,
             cpu_offload=CPUOffload(offload_params=self.config.model.fsdp_config.param_offload),
             forward_prefetch=False)
+        _record_startup_time(self.startup_timing, 'fsdp_wrap', start)
 
         return reward_module
 
     @register(dispatch_mode=Dispatch.ONE_TO_ALL)
     def init_model(self):
+        self.startup_timing = {'module_import': _MODULE_IMPORT_S}
+        start = time.perf_counter()
         # This is used to import external_lib into the huggingface systems
         import_external_libs(self.config.model.get('external_lib', None))
+        _record_startup_time(self.startup_timing, 'import', start)
         self.reward_module = self._build_model(config=self.config)
         torch.cuda.empty_cache()
+        return self.startup_timing
 
     def _forward_micro_batch(self, micro_batch):
         from flash_attn.bert_padding import pad_input, unpad_input, index_first_axis, rearrange
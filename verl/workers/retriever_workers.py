@@ -349,9 +349,12 @@ import ray
 import faiss
 import torch
 
-@ray.remote(num_gpus=8)  # Allocate all GPUs
+@ray.remote
 class FAISSIndexServer:
-    """Ray Actor that loads and serves a shared FAISS index with FAISS GPU optimization."""
+    """Ray Actor that loads and serves a shared FAISS index, on all GPUs or sharded across CPU threads.
+
+    Create it with :func:`create_faiss_index_server` so that its resources follow the config.
+    """
 
     def __init__(self, config):
         """Initialize the FAISS index only once."""
@@ -360,24 +363,44 @@ class FAISSIndexServer:
         self.index = self.load_index(config)
 
     def load_index(self, config):
-        """Loads the FAISS index into GPU memory with sharding."""
-        index_path = os.path.join(config.index_path, f'{config.retrieval_method}_Flat.index')
+        """Loads the FAISS index into GPU memory with sharding, or serves it from CPU threads."""
+        faiss_type = getattr(config, 'faiss_type', 'Flat').replace(',', '_')
+        index_path = os.path.join(config.index_path, f'{config.retrieval_method}_{faiss_type}.index')
+
+        if not self.config.faiss_gpu:
+            from search_r1.search.sharded_index import ShardedIndex
+            print("[FAISSIndexServer] Serving FAISS index on CPU...")
+            return ShardedIndex(index_path,
+                                num_threads=getattr(config, 'faiss_cpu_threads', None),
+                                omp_threads_per_shard=getattr(config, 'faiss_omp_threads_per_shard', None),
+                                use_mmap=getattr(config, 'faiss_mmap', True))
+
         index = faiss.read_index(index_path)
 
-        if self.config.faiss_gpu:
+        # Apply FAISS GPU settings
+        co = faiss.GpuMultipleClonerOptions()
+        co.useFloat16 = True  # Reduce memory footprint
+        co.shard = True  # Distribute index across all GPUs
 
-            # Apply FAISS GPU settings
-            co = faiss.GpuMultipleClonerOptions()
-            co.useFloat16 = True  # Reduce memory footprint
-            co.shard = True  # Distribute index across all GPUs
-            
-            print("[FAISSIndexServer] Moving FAISS index to all GPUs with sharding enabled...")
-            index = faiss.index_cpu_to_all_gpus(index, co=co)
+        print("[FAISSIndexServer] Moving FAISS index to all GPUs with sharding enabled...")
+        index = faiss.index_cpu_to_all_gpus(index, co=co)
 
-            print("[FAISSIndexServer] FAISS index successfully moved to GPUs.")
+        print("[FAISSIndexServer] FAISS index successfully moved to GPUs.")
         return index
 
     def batch_search(self, batch_emb, k):
         """Perform batch search on the FAISS index."""
         print(f"[FAISSIndexServer] Received {len(batch_emb)} queries.")
         return self.index.search(batch_emb, k)  # Adjust 'k' as needed
+
+
+def create_faiss_index_server(config):
+    """Create the FAISSIndexServer actor with the resources requested in ``config``.
+
+    ``faiss_num_gpus`` defaults to 8 when ``faiss_gpu`` is set and to 0 otherwise, ``faiss_num_cpus`` to 1.
+    """
+    num_gpus = getattr(config, 'faiss_num_gpus', None)
+    if num_gpus is None:
+        num_gpus = 8 if config.faiss_gpu else 0
+    num_cpus = getattr(config, 'faiss_num_cpus', None) or 1
+    return FAISSIndexServer.options(num_gpus=num_gpus, num_cpus=num_cpus).remote(config)
@@ -17,17 +17,17 @@ from verl.utils.import_utils import is_vllm_available, is_megatron_core_availabl
 from .base import BaseShardingManager
 from .fsdp_ulysses import FSDPUlyssesShardingManager
 
-AllGatherPPModel = None
 
-if is_megatron_core_available() and is_vllm_available():
-    from .megatron_vllm import AllGatherPPModel, MegatronVLLMShardingManager
-elif AllGatherPPModel is not None:
-    pass
-else:
-    AllGatherPPModel = None
-    MegatronVLLMShardingManager = None
-
-if is_vllm_available():
-    from .fsdp_vllm import FSDPVLLMShardingManager
-else:
-    FSDPVLLMShardingManager = None
+def __getattr__(name):
+    # the vllm sharding managers are imported on first use, so that the workers without a rollout do not import vllm
+    if name in ('AllGatherPPModel', 'MegatronVLLMShardingManager'):
+        if not (is_megatron_core_available() and is_vllm_available()):
+            return None
+        from . import megatron_vllm
+        return getattr(megatron_vllm, name)
+    if name == 'FSDPVLLMShardingManager':
+        if not is_vllm_available():
+            return None
+        from .fsdp_vllm import FSDPVLLMShardingManager
+        return FSDPVLLMShardingManager
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')